@@ -0,0 +1,125 @@
+"""Admission control.
+
+Every request is priced before any work starts: the prompt tokens it will
+send and the number of upstream calls it needs. It is turned away at once
+when it is too large (413), when too much work is already in flight (429),
+or when the upstream queue means it could not finish before its deadline
+(503), always with a Retry-After hint.
+"""
+import math
+import time
+import threading
+
+from ratelimit import BATCH, INTERACTIVE
+from metrics import record_rejection
+
+
+class Rejected(Exception):
+    """A request refused by admission control; the message is an 'Error:' string"""
+
+    def __init__(self, status, reason, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Work admitted for one request, handed back to release() when it finishes"""
+
+    def __init__(self, tokens, calls, rounds, queue_wait=0.0, parallelism=1):
+        self.tokens = tokens
+        self.calls = calls
+        self.rounds = rounds
+        self.queue_wait = queue_wait
+        self.parallelism = parallelism
+        # Statuses of the upstream calls actually made, filled in while the request runs
+        self.upstream = []
+        self.started = time.monotonic()
+
+
+class AdmissionController:
+    """Decides whether a request can be served in time, given what is already in flight.
+
+    Service time is learned as a moving average of how long one round of
+    upstream calls takes; queueing time comes from the outbound scheduler.
+    Batch-priority requests answer item by item, so they are held to the
+    longer `batch_deadline`.
+    """
+
+    def __init__(self, max_tokens=250000, max_in_flight=64, max_in_flight_tokens=1000000, deadline=30.0, scheduler=None, round_seconds=2.0, smoothing=0.1, batch_deadline=300.0):
+        self.max_tokens = max_tokens
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_tokens = max_in_flight_tokens
+        self.deadline = deadline
+        self.batch_deadline = batch_deadline
+        self.scheduler = scheduler
+        self.round_seconds = round_seconds
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.in_flight_tokens = 0
+        self._lock = threading.Lock()
+        self._stats = {'admitted': 0, 'too_large': 0, 'overloaded': 0, 'too_slow': 0}
+
+    def _reject(self, status, reason, message, retry_after=None):
+        self._stats[reason] += 1
+        record_rejection(reason)
+        raise Rejected(status, reason, message, retry_after)
+
+    def admit(self, tokens, calls=1, parallelism=1, level=INTERACTIVE, deadline=None):
+        """Admit a request or raise Rejected; parallelism is how many of its calls run at once"""
+        limit = self.batch_deadline if level == BATCH else self.deadline
+        deadline = limit if deadline is None else min(deadline, limit)
+        rounds = max(1, math.ceil(calls / max(1, parallelism)))
+        queue_wait = 0.0
+        with self._lock:
+            if tokens > self.max_tokens:
+                self._reject(413, 'too_large', f"Error: Submission is too large (about {tokens} tokens; the limit is {self.max_tokens}).")
+
+            retry_after = max(1, int(self.round_seconds) + 1)
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self._reject(429, 'overloaded', "Error: Too many requests are being processed. Please retry shortly.", retry_after)
+            if self.max_in_flight_tokens and self.in_flight and self.in_flight_tokens + tokens > self.max_in_flight_tokens:
+                self._reject(429, 'overloaded', "Error: Too much code is being processed right now. Please retry shortly.", retry_after)
+
+            if calls:
+                # Calls already scheduled run while the rest wait for quota, so the last
+                # one finishes a round after it is scheduled
+                service = rounds * self.round_seconds
+                alone = max(service, (self.scheduler.idle_wait(calls) if self.scheduler is not None else 0.0) + self.round_seconds)
+                if alone > deadline:
+                    self._reject(413, 'too_large', f"Error: This submission would take about {int(alone)}s even on an idle server. Submit it as a job with POST /api/jobs instead.")
+                queue_wait = self.scheduler.estimate_wait(calls, level) if self.scheduler is not None else 0.0
+                expected = max(service, queue_wait + self.round_seconds)
+                if expected > deadline:
+                    retry_after = max(1, int(math.ceil(expected - deadline)))
+                    self._reject(503, 'too_slow', f"Error: The service is overloaded and could not finish this request in time (about {int(expected)}s). Please retry in {retry_after} seconds.", retry_after)
+
+            self.in_flight += 1
+            self.in_flight_tokens += tokens
+            self._stats['admitted'] += 1
+        return Ticket(tokens, calls, rounds, queue_wait, max(1, parallelism))
+
+    def release(self, ticket):
+        """Return a ticket's capacity, learning from how long its upstream rounds took.
+
+        Requests answered without an upstream call (cache hits, local fixes)
+        say nothing about upstream latency and are left out.
+        """
+        elapsed = time.monotonic() - ticket.started
+        with self._lock:
+            self.in_flight -= 1
+            self.in_flight_tokens -= ticket.tokens
+            if ticket.calls and ticket.upstream:
+                # The expected queueing time is accounted for separately, so leave it out
+                rounds = math.ceil(len(ticket.upstream) / ticket.parallelism)
+                per_round = max(0.0, elapsed - ticket.queue_wait) / rounds
+                self.round_seconds += self.smoothing * (per_round - self.round_seconds)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self.in_flight
+            stats['in_flight_tokens'] = self.in_flight_tokens
+            stats['round_seconds'] = round(self.round_seconds, 3)
+        return stats
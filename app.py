@@ -1,801 +1,877 @@
 import os
+import re
 import json
-import requests
-from flask import Flask, render_template, request, jsonify
+import math
+import time
+import tempfile
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from flask import Flask, Request, Response, g, make_response, render_template, request, jsonify, stream_with_context, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS  # Add CORS support
 from dotenv import load_dotenv
+from cache import ResultCache, make_cache_key
+from singleflight import SingleFlight, SQLiteLeases
+from ratelimit import KeyPool, Scheduler, QueueFull, BATCH, INTERACTIVE, priority
+from gemini_client import GeminiClient, GeminiError, request_cache_key
+from chunking import split_code, reassemble, strip_code_fences
+from incremental import DocumentStore, plan_update
+from preanalysis import Report, analyze_code
+from diffing import Diff
+from compaction import Compaction, compact, estimate_tokens, MARKER_NOTE
+from assets import AssetBundle
+from hedging import Hedger
+from jobs import JobQueue, JobStore, RetryLater, FINISHED
+from repo_scan import open_source, prioritize, prefiltered
+from admission import AdmissionController, Rejected
+from fingerprint import fingerprint
+from speculation import Speculator
+from profiling import RequestProfiler
+import metrics
+from metrics import current_endpoint, stage, timed
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)  # Enable CORS
-
-# Gemini API configuration
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'your-api-key-here')
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-lite:generateContent"
-
-def create_directories_and_files():
-    """Create necessary directories and files for the application"""
-    # Create templates folder if it doesn't exist
-    if not os.path.exists('templates'):
-        os.makedirs('templates')
-    
-    # Create static folder if it doesn't exist
-    if not os.path.exists('static'):
-        os.makedirs('static')
-    
-    # Create the HTML template
-    with open('templates/index.html', 'w', encoding='utf-8') as f:
-        f.write("""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>CodeFix Pro | Advanced Code Debugging Platform</title>
-    <link rel="stylesheet" href="{{ url_for('static', filename='style.css') }}">
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@300;400;500;600;700&display=swap" rel="stylesheet">
-    <link href="https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;500&display=swap" rel="stylesheet">
-    <meta name="description" content="Professional AI-powered code debugging and optimization platform">
-</head>
-<body>
-    <div class="container">
-        <header class="app-header">
-            <div class="logo-container">
-                <div class="logo-icon"><span>&lt;/&gt;</span></div>
-                <h1>CodeFix<span class="accent">Pro</span></h1>
-            </div>
-            <p class="tagline">Advanced AI-Powered Code Debugging & Optimization</p>
-            <div class="header-decoration"></div>
-        </header>
-        
-        <main class="workspace">
-            <section class="code-container">
-                <div class="code-panel input-panel">
-                    <div class="panel-header">
-                        <h2><span class="icon">📝</span>Source Code</h2>
-                        <div class="panel-controls">
-                            <button class="control-btn" id="clear-input" title="Clear code"><span>⟲</span></button>
-                        </div>
-                    </div>
-                    <textarea id="buggy-code" placeholder="// Paste your code here for analysis and optimization..."></textarea>
-                    <div class="button-group">
-                        <button id="fix-code-btn" class="primary-btn"><span class="btn-icon">🔍</span>Analyze & Debug</button>
-                    </div>
-                </div>
-                
-                <div class="code-panel output-panel">
-                    <div class="panel-header">
-                        <h2><span class="icon">✅</span>Optimized Code</h2>
-                        <div class="panel-controls">
-                            <button class="control-btn" id="fullscreen-btn" title="Fullscreen"><span>⛶</span></button>
-                        </div>
-                    </div>
-                    <div id="fixed-code-container">
-                        <pre><code id="fixed-code">// Your optimized code will appear here...</code></pre>
-                    </div>
-                    <div class="button-group">
-                        <button id="explain-code-btn" class="secondary-btn" disabled><span class="btn-icon">💡</span>Explain Changes</button>
-                        <button id="copy-code-btn" class="secondary-btn" disabled><span class="btn-icon">📋</span>Copy Code</button>
-                    </div>
-                </div>
-            </section>
-            
-            <section class="explanation-panel" id="explanation-panel">
-                <div class="panel-header">
-                    <h2><span class="icon">🧠</span>Technical Analysis</h2>
-                </div>
-                <div id="explanation-container" class="scrollable">
-                    <p>Detailed analysis of code changes will appear here...</p>
-                </div>
-            </section>
-        </main>
-        
-        <div class="loading" id="loading">
-            <div class="spinner"></div>
-            <p id="loading-text">Analyzing code structure...</p>
-            <div class="progress-bar">
-                <div class="progress-fill"></div>
-            </div>
-        </div>
-        
-        <footer class="app-footer">
-            <p>Powered by advanced AI technology</p>
-        </footer>
-    </div>
-
-    <script>
-        document.addEventListener('DOMContentLoaded', function() {
-            const buggyCodeTextarea = document.getElementById('buggy-code');
-            const fixedCodeElement = document.getElementById('fixed-code');
-            const fixCodeBtn = document.getElementById('fix-code-btn');
-            const explainCodeBtn = document.getElementById('explain-code-btn');
-            const copyCodeBtn = document.getElementById('copy-code-btn');
-            const loadingElement = document.getElementById('loading');
-            const loadingTextElement = document.getElementById('loading-text');
-            const explanationPanel = document.getElementById('explanation-panel');
-            const explanationContainer = document.getElementById('explanation-container');
-            const clearInputBtn = document.getElementById('clear-input');
-            const fullscreenBtn = document.getElementById('fullscreen-btn');
-            const progressFill = document.querySelector('.progress-fill');
-            
-            let originalCode = '';
-            let fixedCode = '';
-            
-            // Initially hide the explanation panel
-            explanationPanel.style.display = 'none';
-            
-            // Clear input button functionality
-            clearInputBtn.addEventListener('click', function() {
-                buggyCodeTextarea.value = '';
-                buggyCodeTextarea.focus();
-            });
-            
-            // Fullscreen functionality
-            fullscreenBtn.addEventListener('click', function() {
-                const codeContainer = document.querySelector('.output-panel');
-                if (!document.fullscreenElement) {
-                    if (codeContainer.requestFullscreen) {
-                        codeContainer.requestFullscreen();
-                    } else if (codeContainer.mozRequestFullScreen) {
-                        codeContainer.mozRequestFullScreen();
-                    } else if (codeContainer.webkitRequestFullscreen) {
-                        codeContainer.webkitRequestFullscreen();
-                    } else if (codeContainer.msRequestFullscreen) {
-                        codeContainer.msRequestFullscreen();
-                    }
-                } else {
-                    if (document.exitFullscreen) {
-                        document.exitFullscreen();
-                    } else if (document.mozCancelFullScreen) {
-                        document.mozCancelFullScreen();
-                    } else if (document.webkitExitFullscreen) {
-                        document.webkitExitFullscreen();
-                    } else if (document.msExitFullscreen) {
-                        document.msExitFullscreen();
-                    }
-                }
-            });
-            
-            fixCodeBtn.addEventListener('click', async function() {
-                originalCode = buggyCodeTextarea.value.trim();
-                
-                if (!originalCode) {
-                    alert('Please enter some code to analyze');
-                    return;
-                }
-                
-                // Show loading
-                loadingElement.style.display = 'flex';
-                loadingTextElement.textContent = 'Analyzing code structure...';
-                
-                // Animate progress bar
-                progressFill.style.width = '0%';
-                let progress = 0;
-                const progressInterval = setInterval(() => {
-                    progress += 1;
-                    progressFill.style.width = `${Math.min(progress, 95)}%`;
-                    
-                    if (progress === 30) {
-                        loadingTextElement.textContent = 'Identifying issues...';
-                    } else if (progress === 60) {
-                        loadingTextElement.textContent = 'Optimizing code...';
-                    } else if (progress === 85) {
-                        loadingTextElement.textContent = 'Finalizing solution...';
-                    }
-                }, 50);
-                
-                // Hide explanation panel when starting a new debug
-                explanationPanel.style.display = 'none';
-                
-                // Disable explain button initially
-                explainCodeBtn.disabled = true;
-                copyCodeBtn.disabled = true;
-                
-                try {
-                    const response = await fetch('/api/fix_code', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({ code: originalCode })
-                    });
-                    
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        fixedCode = data.fixed_code;
-                        fixedCodeElement.textContent = fixedCode;
-                        
-                        // Enable buttons after successful fix
-                        explainCodeBtn.disabled = false;
-                        copyCodeBtn.disabled = false;
-                    } else {
-                        fixedCodeElement.textContent = `Error: ${data.error || 'Unknown error'}`;
-                    }
-                } catch (error) {
-                    fixedCodeElement.textContent = `Error: ${error.message}`;
-                } finally {
-                    // Complete progress bar
-                    progressFill.style.width = '100%';
-                    clearInterval(progressInterval);
-                    
-                    // Hide loading after a short delay to show completed progress
-                    setTimeout(() => {
-                        loadingElement.style.display = 'none';
-                    }, 500);
-                }
-            });
-            
-            explainCodeBtn.addEventListener('click', async function() {
-                if (!originalCode || !fixedCode) {
-                    alert('Please debug the code first');
-                    return;
-                }
-                
-                // Show loading
-                loadingElement.style.display = 'flex';
-                loadingTextElement.textContent = 'Generating technical analysis...';
-                
-                // Reset and animate progress bar
-                progressFill.style.width = '0%';
-                let progress = 0;
-                const progressInterval = setInterval(() => {
-                    progress += 1;
-                    progressFill.style.width = `${Math.min(progress, 95)}%`;
-                }, 50);
-                
-                try {
-                    const response = await fetch('/api/explain_changes', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({ 
-                            original_code: originalCode,
-                            fixed_code: fixedCode
-                        })
-                    });
-                    
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        explanationContainer.innerHTML = data.explanation;
-                        explanationPanel.style.display = 'block';
-                    } else {
-                        explanationContainer.innerHTML = `<p class="error">Error: ${data.error || 'Unknown error'}</p>`;
-                        explanationPanel.style.display = 'block';
-                    }
-                } catch (error) {
-                    explanationContainer.innerHTML = `<p class="error">Error: ${error.message}</p>`;
-                    explanationPanel.style.display = 'block';
-                } finally {
-                    // Complete progress bar
-                    progressFill.style.width = '100%';
-                    clearInterval(progressInterval);
-                    
-                    // Hide loading after a short delay
-                    setTimeout(() => {
-                        loadingElement.style.display = 'none';
-                    }, 500);
-                }
-            });
-            
-            copyCodeBtn.addEventListener('click', function() {
-                if (!fixedCode) {
-                    return;
-                }
-                
-                // Create a temporary textarea to copy the text
-                const tempTextarea = document.createElement('textarea');
-                tempTextarea.value = fixedCode;
-                document.body.appendChild(tempTextarea);
-                tempTextarea.select();
-                
-                try {
-                    document.execCommand('copy');
-                    // Show temporary success message
-                    const originalText = copyCodeBtn.textContent;
-                    copyCodeBtn.textContent = 'Copied!';
-                    setTimeout(() => {
-                        copyCodeBtn.textContent = originalText;
-                    }, 2000);
-                } catch (err) {
-                    console.error('Failed to copy: ', err);
-                } finally {
-                    document.body.removeChild(tempTextarea);
-                }
-            });
-        });
-    </script>
-</body>
-</html>
-        """)
-    
-    # Create the CSS file
-    with open('static/style.css', 'w', encoding='utf-8') as f:
-        f.write("""
-
-* {
-    margin: 0;
-    padding: 0;
-    box-sizing: border-box;
-    font-family: 'Poppins', sans-serif;
-}
-
-body {
-    background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
-    padding: 20px;
-    min-height: 100vh;
-    color: #e7e7e7;
-}
-
-.container {
-    max-width: 1300px;
-    margin: 0 auto;
-    background: rgba(26, 32, 44, 0.95);
-    border-radius: 16px;
-    box-shadow: 0 8px 32px rgba(0, 0, 0, 0.5);
-    padding: 30px;
-    backdrop-filter: blur(8px);
-    border: 1px solid rgba(255, 255, 255, 0.08);
-}
-
-.app-header {
-    position: relative;
-    margin-bottom: 40px;
-    text-align: center;
-}
-
-.logo-container {
-    display: flex;
-    align-items: center;
-    justify-content: center;
-    margin-bottom: 10px;
-}
-
-.logo-icon {
-    background: linear-gradient(135deg, #ff6b6b, #ffa06b);
-    width: 45px;
-    height: 45px;
-    border-radius: 12px;
-    display: flex;
-    align-items: center;
-    justify-content: center;
-    margin-right: 15px;
-    box-shadow: 0 4px 15px rgba(255, 107, 107, 0.4);
-    font-weight: 700;
-    font-size: 1.5rem;
-}
-
-h1 {
-    color: #ffffff;
-    font-weight: 700;
-    font-size: 2.5rem;
-    text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.3);
-}
-
-.accent {
-    background: linear-gradient(to right, #ff6b6b, #ffa06b);
-    -webkit-background-clip: text;
-    -webkit-text-fill-color: transparent;
-}
-
-.tagline {
-    font-size: 1rem;
-    color: #a0aec0;
-    margin-bottom: 15px;
-    font-weight: 300;
-}
-
-.header-decoration {
-    height: 4px;
-    width: 150px;
-    background: linear-gradient(to right, #ff6b6b, #ffa06b, #ffd56b, #c2ff6b, #6bffd5, #6bb5ff, #a06bff);
-    margin: 0 auto;
-    border-radius: 2px;
-}
-
-.workspace {
-    display: flex;
-    flex-direction: column;
-    gap: 30px;
-}
-
-h2 {
-    margin-bottom: 0;
-    font-size: 1.2rem;
-    color: #e2e8f0;
-    font-weight: 600;
-    display: flex;
-    align-items: center;
-}
-
-.icon {
-    margin-right: 8px;
-    font-size: 1.3rem;
-}
-
-.code-container {
-    display: flex;
-    gap: 25px;
-}
-
-@media (max-width: 992px) {
-    .code-container {
-        flex-direction: column;
-    }
-}
-
-.code-panel {
-    flex: 1;
-    display: flex;
-    flex-direction: column;
-    border-radius: 12px;
-    padding: 20px;
-    box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);
-    transition: transform 0.3s ease, box-shadow 0.3s ease;
-}
-
-.code-panel:hover {
-    transform: translateY(-5px);
-    box-shadow: 0 8px 25px rgba(0, 0, 0, 0.25);
-}
-
-.panel-header {
-    display: flex;
-    justify-content: space-between;
-    align-items: center;
-    margin-bottom: 15px;
-}
-
-.panel-controls {
-    display: flex;
-    gap: 8px;
-}
-
-.control-btn {
-    background: rgba(255, 255, 255, 0.1);
-    border: none;
-    width: 30px;
-    height: 30px;
-    border-radius: 6px;
-    display: flex;
-    align-items: center;
-    justify-content: center;
-    cursor: pointer;
-    color: #e2e8f0;
-    transition: all 0.2s ease;
-}
-
-.control-btn:hover {
-    background: rgba(255, 255, 255, 0.2);
-}
-
-.input-panel {
-    background: linear-gradient(135deg, #2d3748 0%, #1a202c 100%);
-    border: 1px solid rgba(255, 255, 255, 0.1);
-}
-
-.output-panel {
-    background: linear-gradient(135deg, #2c3e50 0%, #1a202c 100%);
-    border: 1px solid rgba(255, 255, 255, 0.1);
-}
-
-textarea {
-    width: 100%;
-    height: 400px;
-    padding: 15px;
-    border: 1px solid rgba(255, 255, 255, 0.1);
-    border-radius: 8px;
-    resize: none;
-    font-family: 'JetBrains Mono', monospace;
-    font-size: 14px;
-    line-height: 1.6;
-    margin-bottom: 15px;
-    background-color: rgba(0, 0, 0, 0.3);
-    color: #e2e8f0;
-    box-shadow: inset 0 2px 4px rgba(0, 0, 0, 0.2);
-    transition: all 0.3s ease;
-}
-
-textarea:focus {
-    outline: none;
-    border-color: rgba(255, 107, 107, 0.5);
-    box-shadow: inset 0 2px 8px rgba(0, 0, 0, 0.3), 0 0 0 3px rgba(255, 107, 107, 0.2);
-}
-
-.button-group {
-    display: flex;
-    gap: 12px;
-    margin-top: 15px;
-}
-
-button {
-    padding: 12px 24px;
-    border: none;
-    border-radius: 8px;
-    cursor: pointer;
-    font-size: 15px;
-    transition: all 0.3s ease;
-    font-weight: 600;
-    display: flex;
-    align-items: center;
-    justify-content: center;
-}
-
-.btn-icon {
-    margin-right: 8px;
-}
-
-button:disabled {
-    opacity: 0.5;
-    cursor: not-allowed;
-}
-
-.primary-btn {
-    background: linear-gradient(135deg, #ff6b6b 0%, #ffa06b 100%);
-    color: white;
-    box-shadow: 0 4px 15px rgba(255, 107, 107, 0.4);
-}
-
-.primary-btn:hover:not(:disabled) {
-    background: linear-gradient(135deg, #ff5252 0%, #ff8a50 100%);
-    transform: translateY(-3px);
-    box-shadow: 0 6px 20px rgba(255, 107, 107, 0.5);
-}
-
-.secondary-btn {
-    background: rgba(255, 255, 255, 0.1);
-    color: #e2e8f0;
-    border: 1px solid rgba(255, 255, 255, 0.2);
-}
-
-.secondary-btn:hover:not(:disabled) {
-    background: rgba(255, 255, 255, 0.15);
-    transform: translateY(-3px);
-    box-shadow: 0 6px 20px rgba(0, 0, 0, 0.2);
-}
-
-#fixed-code-container {
-    width: 100%;
-    height: 400px;
-    border: 1px solid rgba(255, 255, 255, 0.1);
-    border-radius: 8px;
-    overflow-y: auto;
-    background-color: rgba(0, 0, 0, 0.3);
-    box-shadow: inset 0 2px 4px rgba(0, 0, 0, 0.2);
-}
-
-pre {
-    margin: 0;
-    padding: 15px;
-    font-family: 'JetBrains Mono', monospace;
-    font-size: 14px;
-    line-height: 1.6;
-    white-space: pre-wrap;
-    color: #e2e8f0;
-}
-
-.explanation-panel {
-    background: linear-gradient(135deg, #2d3748 0%, #1a202c 100%);
-    border-radius: 12px;
-    padding: 25px;
-    margin-top: 10px;
-    border-left: 4px solid #ff6b6b;
-    box-shadow: 0 4px 15px rgba(0, 0, 0, 0.2);
-    transition: transform 0.3s ease;
-}
-
-.explanation-panel:hover {
-    transform: translateY(-5px);
-    box-shadow: 0 8px 25px rgba(0, 0, 0, 0.25);
-}
-
-#explanation-container {
-    line-height: 1.7;
-    color: #e2e8f0;
-    max-height: 400px;
-    overflow-y: auto;
-    padding-right: 10px;
-}
-
-.scrollable::-webkit-scrollbar {
-    width: 8px;
-}
-
-.scrollable::-webkit-scrollbar-track {
-    background: rgba(255, 255, 255, 0.05);
-    border-radius: 4px;
-}
-
-.scrollable::-webkit-scrollbar-thumb {
-    background: rgba(255, 255, 255, 0.2);
-    border-radius: 4px;
-}
-
-.scrollable::-webkit-scrollbar-thumb:hover {
-    background: rgba(255, 255, 255, 0.3);
-}
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that records request parsing and response serialization time"""
 
-#explanation-container p {
-    margin-bottom: 12px;
-}
+    def loads(self, s, **kwargs):
+        with stage('json_parse'):
+            return super().loads(s, **kwargs)
 
-#explanation-container code {
-    background-color: rgba(0, 0, 0, 0.3);
-    padding: 3px 6px;
-    border-radius: 4px;
-    font-family: 'JetBrains Mono', monospace;
-    color: #ff6b6b;
-}
+    def dumps(self, obj, **kwargs):
+        with stage('serialize'):
+            return super().dumps(obj, **kwargs)
 
-.error {
-    color: #ff6b6b;
-    font-weight: 500;
-}
+class LimitedRequest(Request):
+    """Request whose body limit depends on the route: archive uploads get the scan cap"""
 
-.loading {
-    position: fixed;
-    top: 0;
-    left: 0;
-    width: 100%;
-    height: 100%;
-    background: rgba(26, 32, 44, 0.95);
-    display: none;
-    justify-content: center;
-    align-items: center;
-    flex-direction: column;
-    z-index: 1000;
-    backdrop-filter: blur(8px);
-}
+    @property
+    def max_content_length(self):
+        if self.url_rule is not None and self.url_rule.rule == '/api/scan':
+            return SCAN_MAX_UPLOAD_MB * 1024 * 1024
+        return int(ADMISSION_MAX_BODY_MB * 1024 * 1024)
 
-.spinner {
-    border: 4px solid rgba(255, 255, 255, 0.1);
-    border-top: 4px solid #ff6b6b;
-    border-radius: 50%;
-    width: 50px;
-    height: 50px;
-    animation: spin 1s linear infinite;
-    margin-bottom: 25px;
-}
+# Initialize Flask app
+app = Flask(__name__)
+app.request_class = LimitedRequest
+app.json = TimedJSONProvider(app)
+CORS(app)  # Enable CORS
 
-.progress-bar {
-    width: 300px;
-    height: 6px;
-    background: rgba(255, 255, 255, 0.1);
-    border-radius: 3px;
-    margin-top: 20px;
-    overflow: hidden;
-}
+# Static files are served under content-hashed names built by `python assets.py`
+# (or in memory when there is no build output), so browsers may cache them forever
+ASSET_MAX_AGE = int(os.getenv('ASSET_MAX_AGE', str(365 * 24 * 3600)))
+asset_bundle = AssetBundle.load(app.static_folder)
 
-.progress-fill {
-    height: 100%;
-    width: 0%;
-    background: linear-gradient(to right, #ff6b6b, #ffa06b);
-    border-radius: 3px;
-    transition: width 0.3s ease;
-}
+def asset_url(name):
+    """URL of the hashed copy of a static file, or of the plain file if it isn't in the bundle"""
+    hashed = asset_bundle.hashed(name)
+    if hashed is None:
+        return url_for('static', filename=name)
+    return url_for('serve_asset', filename=hashed)
 
-#loading-text {
-    font-size: 16px;
-    color: white;
-    font-weight: 400;
-}
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': asset_url}
 
-@keyframes spin {
-    0% { transform: rotate(0deg); }
-    100% { transform: rotate(360deg); }
-}
+# Gemini API configuration
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', 'your-api-key-here')
+# Comma-separated pool of keys; calls are spread over them by remaining quota
+GEMINI_API_KEYS = [key.strip() for key in os.getenv('GEMINI_API_KEYS', '').split(',') if key.strip()] or [GEMINI_API_KEY]
+GEMINI_API_URL = os.getenv('GEMINI_API_URL', "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-lite:generateContent")
+GEMINI_TIMEOUT = int(os.getenv('GEMINI_TIMEOUT', '30'))
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', '16'))
+
+# Result cache configuration
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', '1') != '0'
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', os.path.join('.cache', 'results.sqlite3'))
+CACHE_TTL = int(os.getenv('CACHE_TTL', str(24 * 3600)))
+CACHE_MEMORY_ENTRIES = int(os.getenv('CACHE_MEMORY_ENTRIES', '512'))
+CACHE_MAX_DISK_MB = int(os.getenv('CACHE_MAX_DISK_MB', '256'))
+
+result_cache = ResultCache(
+    CACHE_DB_PATH,
+    ttl=CACHE_TTL,
+    max_memory_entries=CACHE_MEMORY_ENTRIES,
+    max_disk_bytes=CACHE_MAX_DISK_MB * 1024 * 1024,
+    enabled=CACHE_ENABLED
+)
+
+# Identical concurrent prompts share one upstream call, across threads and
+# (through leases in the cache database) across worker processes
+SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT_ENABLED', '1') != '0'
+
+singleflight = None
+if SINGLEFLIGHT_ENABLED:
+    singleflight = SingleFlight(
+        leases=SQLiteLeases(CACHE_DB_PATH) if CACHE_ENABLED else None,
+        cache=result_cache if CACHE_ENABLED else None,
+        lease_ttl=GEMINI_TIMEOUT * 2
+    )
+
+# Batch fan-out configuration
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '8'))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '32'))
+
+class CountingExecutor(ThreadPoolExecutor):
+    """Thread pool that counts the tasks submitted but not yet started, for the queue depth gauges"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queued = 0
+        self._queued_lock = threading.Lock()
+
+    def _count(self, delta):
+        with self._queued_lock:
+            self.queued += delta
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            self._count(-1)
+            return fn(*args, **kwargs)
+
+        self._count(1)
+        try:
+            future = super().submit(run)
+        except RuntimeError:
+            self._count(-1)
+            raise
+        # A task cancelled while queued never runs, so it leaves the count here
+        future.add_done_callback(lambda f: self._count(-1) if f.cancelled() else None)
+        return future
+
+batch_executor = CountingExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+# Large inputs are split at top-level boundaries and fixed chunk by chunk
+CHUNK_THRESHOLD_LINES = int(os.getenv('CHUNK_THRESHOLD_LINES', '300'))
+CHUNK_MAX_LINES = int(os.getenv('CHUNK_MAX_LINES', '150'))
+CHUNK_CONCURRENCY = int(os.getenv('CHUNK_CONCURRENCY', '8'))
+CHUNK_WORKERS = int(os.getenv('CHUNK_WORKERS', '32'))
+
+chunk_executor = CountingExecutor(max_workers=CHUNK_WORKERS, thread_name_prefix='chunk')
+
+# Local pre-analysis; clean code is returned without calling Gemini when SKIP_CLEAN is on
+PREANALYSIS_ENABLED = os.getenv('PREANALYSIS_ENABLED', '1') != '0'
+PREANALYSIS_SKIP_CLEAN = os.getenv('PREANALYSIS_SKIP_CLEAN', '0') != '0'
+
+# Prompt compaction: license headers, long comment blocks, blank runs and large data
+# literals are replaced with placeholders before sending and restored in the returned code
+COMPACTION_ENABLED = os.getenv('COMPACTION_ENABLED', '1') != '0'
+COMPACTION_MIN_COMMENT_LINES = int(os.getenv('COMPACTION_MIN_COMMENT_LINES', '4'))
+COMPACTION_MIN_LITERAL_LINES = int(os.getenv('COMPACTION_MIN_LITERAL_LINES', '12'))
+
+# Prompt tokens saved by compaction during the current request
+compaction_tally = contextvars.ContextVar('compaction_tally', default=None)
+
+# Semantic cache: fixes are also stored under a fingerprint of the code (comments, docstrings,
+# formatting and, for Python, the names it defines normalized) and replayed on near-duplicates
+FINGERPRINT_ENABLED = os.getenv('FINGERPRINT_ENABLED', '1') != '0'
+FINGERPRINT_MAX_BYTES = int(os.getenv('FINGERPRINT_MAX_BYTES', str(256 * 1024)))
+
+# Explain prompts send only the changed hunks with this many lines of context around them
+EXPLAIN_DIFF_CONTEXT = int(os.getenv('EXPLAIN_DIFF_CONTEXT', '3'))
+
+# Durable job queue for long analyses; jobs live in SQLite, so queued and interrupted
+# jobs are picked up again after a restart
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', os.path.join('.cache', 'jobs.sqlite3'))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '60'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', str(24 * 3600)))
+JOB_MAX_WAIT = float(os.getenv('JOB_MAX_WAIT', '30'))
+
+# Repository scans: files are pre-analyzed in a process pool and fixed SCAN_CONCURRENCY at a time
+SCAN_PROCESSES = int(os.getenv('SCAN_PROCESSES', str(min(4, os.cpu_count() or 1))))
+SCAN_CONCURRENCY = int(os.getenv('SCAN_CONCURRENCY', '8'))
+SCAN_MAX_FILES = int(os.getenv('SCAN_MAX_FILES', '2000'))
+SCAN_MAX_FILE_BYTES = int(os.getenv('SCAN_MAX_FILE_BYTES', str(256 * 1024)))
+SCAN_MAX_UPLOAD_MB = int(os.getenv('SCAN_MAX_UPLOAD_MB', '100'))
+
+# Last analyzed version of each document, kept in the shared cache so any worker can reuse it
+document_store = DocumentStore(result_cache, GEMINI_API_URL)
+
+# Outbound pacing to the Gemini quota of each key (0 disables a limit); each of the
+# WEB_WORKERS worker processes paces its own share of the quota
+GEMINI_RPM = int(os.getenv('GEMINI_RPM', '30'))
+GEMINI_RPD = int(os.getenv('GEMINI_RPD', '1500'))
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '20'))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '3'))
+KEY_DISABLE_SECONDS = float(os.getenv('KEY_DISABLE_SECONDS', '600'))
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+
+def worker_share(limit):
+    """This process's share of a quota limit (0 stays unlimited)"""
+    return max(1, limit // WEB_WORKERS) if limit > 0 else 0
+
+key_pool = KeyPool(GEMINI_API_KEYS, worker_share(GEMINI_RPM), worker_share(GEMINI_RPD), disable_seconds=KEY_DISABLE_SECONDS)
+
+scheduler = None
+if GEMINI_RPM > 0:
+    scheduler = Scheduler(
+        worker_share(GEMINI_RPM),
+        requests_per_day=worker_share(GEMINI_RPD),
+        max_wait=RATE_LIMIT_MAX_WAIT,
+        max_retries=RATE_LIMIT_MAX_RETRIES,
+        keys=key_pool
+    )
+
+# Hedging: an interactive call still unanswered after the HEDGE_PERCENTILE latency of
+# recent calls gets a second copy, with hedges capped at HEDGE_BUDGET extra calls per call
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', '0') != '0'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', '0.05'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+
+hedger = None
+if HEDGE_ENABLED:
+    hedger = Hedger(percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET, min_samples=HEDGE_MIN_SAMPLES)
+
+# Admission control: requests are priced up front and refused at once when they are too
+# large, too much is in flight, or the upstream queue means they would miss their deadline
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') != '0'
+ADMISSION_MAX_BODY_MB = float(os.getenv('ADMISSION_MAX_BODY_MB', '2'))
+ADMISSION_MAX_TOKENS = int(os.getenv('ADMISSION_MAX_TOKENS', '250000'))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '64'))
+ADMISSION_MAX_IN_FLIGHT_TOKENS = int(os.getenv('ADMISSION_MAX_IN_FLIGHT_TOKENS', '1000000'))
+ADMISSION_DEADLINE = float(os.getenv('ADMISSION_DEADLINE', str(GEMINI_TIMEOUT)))
+ADMISSION_BATCH_DEADLINE = float(os.getenv('ADMISSION_BATCH_DEADLINE', '300'))
+
+admission = AdmissionController(
+    max_tokens=ADMISSION_MAX_TOKENS,
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    max_in_flight_tokens=ADMISSION_MAX_IN_FLIGHT_TOKENS,
+    deadline=ADMISSION_DEADLINE,
+    scheduler=scheduler,
+    batch_deadline=ADMISSION_BATCH_DEADLINE
+)
+
+# Speculative explanations: once a fix is returned, its explanation is generated in the
+# background at batch priority, for up to SPECULATE_BUDGET of fixes, and only while fewer than
+# SPECULATE_MAX_LOAD of ADMISSION_MAX_IN_FLIGHT requests are in flight and quota is spare
+SPECULATE_ENABLED = os.getenv('SPECULATE_ENABLED', '0') != '0'
+SPECULATE_BUDGET = float(os.getenv('SPECULATE_BUDGET', '0.5'))
+SPECULATE_MAX_IN_FLIGHT = int(os.getenv('SPECULATE_MAX_IN_FLIGHT', '4'))
+SPECULATE_MAX_LOAD = float(os.getenv('SPECULATE_MAX_LOAD', '0.5'))
+
+def server_busy():
+    """Whether speculative work should stand aside for real requests"""
+    if ADMISSION_ENABLED and ADMISSION_MAX_IN_FLIGHT and admission.in_flight >= SPECULATE_MAX_LOAD * ADMISSION_MAX_IN_FLIGHT:
+        return True
+    return scheduler is not None and scheduler.estimate_wait(1, BATCH) > 0
+
+speculator = None
+if SPECULATE_ENABLED:
+    speculator = Speculator(
+        ThreadPoolExecutor(max_workers=SPECULATE_MAX_IN_FLIGHT, thread_name_prefix='speculate'),
+        budget=SPECULATE_BUDGET,
+        max_in_flight=SPECULATE_MAX_IN_FLIGHT,
+        busy=server_busy
+    )
+
+# Profiling: requests sending X-Profile: PROFILE_TOKEN, and PROFILE_SAMPLE_RATE of all requests,
+# have their stacks sampled into PROFILE_DIR; requests slower than SLOW_REQUEST_SECONDS log
+# their stage timings. Only the newest PROFILE_MAX_FILES profiles are kept. No hooks are
+# installed while all three are off
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join('.cache', 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', '0'))
+
+profiler = None
+if PROFILE_TOKEN or PROFILE_SAMPLE_RATE > 0 or SLOW_REQUEST_SECONDS > 0:
+    profiler = RequestProfiler(
+        PROFILE_DIR,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        token=PROFILE_TOKEN,
+        slow_seconds=SLOW_REQUEST_SECONDS,
+        interval=PROFILE_INTERVAL_MS / 1000.0,
+        max_files=PROFILE_MAX_FILES
+    )
+    profiler.install(app)
+
+# Shared upstream client; the pool is sized to the number of request threads per
+# worker plus the threads used to fan out batch and chunked requests
+gemini_client = GeminiClient(
+    GEMINI_API_URL,
+    GEMINI_API_KEY,
+    cache=result_cache,
+    pool_size=WORKER_THREADS + BATCH_WORKERS + CHUNK_WORKERS,
+    timeout=GEMINI_TIMEOUT,
+    singleflight=singleflight,
+    scheduler=scheduler,
+    hedger=hedger,
+    keys=key_pool
+)
+
+@timed('prompt_build')
+def build_fix_prompt(buggy_code, diagnostics=None, placeholders=False):
+    """Build the prompt used to ask Gemini for a fixed version of the code"""
+    note = f"\n{MARKER_NOTE}" if placeholders else ''
+    if diagnostics:
+        findings = '\n'.join(f"- {diagnostic}" for diagnostic in diagnostics)
+        return f"Fix this code and only return the fixed code without any explanations.{note}\nA static check reported:\n{findings}\n\nCode:\n{buggy_code}"
+    if placeholders:
+        return f"Fix this code and only return the fixed code without any explanations.{note}\n\nCode:\n{buggy_code}"
+    return f"Fix this code and only return the fixed code without any explanations:\n{buggy_code}"
+
+@timed('prompt_build')
+def build_explain_prompt(original_code, fixed_code):
+    """Build the prompt used to ask Gemini to explain a fix.
+
+    The fix is sent as a unified diff with some context when that is smaller
+    than the two full versions, which it is for most fixes to larger files.
+    """
+    patch = Diff(original_code, fixed_code, EXPLAIN_DIFF_CONTEXT).unified()
+    if patch and len(patch) < len(original_code) + len(fixed_code):
+        return f"""Explain the changes made to fix this code. Be detailed and technical.
+The fix is shown as a unified diff: lines starting with '-' were removed, lines starting with '+' were added, and the rest is unchanged context:
+{patch}"""
+    return f"""Explain the changes made to fix this code. Be detailed and technical:
+Original code:
+{original_code}
 
-.app-footer {
-    margin-top: 40px;
-    text-align: center;
-    color: rgba(255, 255, 255, 0.5);
-    font-size: 0.9rem;
-}
-        """)
+Fixed code:
+{fixed_code}"""
 
-def fix_code_with_gemini(buggy_code):
-    """Use Gemini API to fix the code"""
+def run_bounded(func, items, concurrency, executor=batch_executor):
+    """Run func over items on an executor with at most `concurrency` calls in flight.
+
+    Yields (index, result) pairs in completion order.
+    """
+    pending = {}
+    queue = iter(enumerate(items))
+
+    def submit_next():
+        for index, item in queue:
+            # Carry the caller's context (e.g. request priority) into the worker thread
+            pending[executor.submit(contextvars.copy_context().run, func, item)] = index
+            return
+
+    for _ in range(concurrency):
+        submit_next()
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            yield index, future.result()
+            submit_next()
+
+@timed('prompt_build')
+def build_chunk_fix_prompt(chunk, context, placeholders=False):
+    """Build the prompt used to fix one chunk of a larger file"""
+    note = f"\n{MARKER_NOTE}" if placeholders else ''
+    return f"""Fix this code and only return the fixed code without any explanations.{note}
+It is one part of a larger file. For reference, the file contains these imports and definitions:
+{context}
+
+Only return the fixed version of this part:
+{chunk}"""
+
+def fix_chunks_in_order(chunks, context, reused=None):
+    """Fix chunks concurrently, yielding each fixed chunk in file order as soon as it is ready.
+
+    Chunks whose index is in `reused` are not sent upstream; their previously
+    fixed text is used as-is. Stops after yielding the first 'Error:' result.
+    """
+    reused = reused or {}
+    ready = {}
+    next_index = 0
+    compactions = [
+        compact_code(chunk) if chunk.strip() and index not in reused else None
+        for index, chunk in enumerate(chunks)
+    ]
+
+    def fix(index):
+        if index in reused:
+            return reused[index]
+        compaction = compactions[index]
+        if compaction is None:
+            return chunks[index]
+        return generate_restored(compaction, lambda c: build_chunk_fix_prompt(c.text, context, bool(c.blocks)))
+
+    for index, fixed in run_bounded(fix, range(len(chunks)), CHUNK_CONCURRENCY, chunk_executor):
+        if fixed.startswith('Error:'):
+            yield fixed
+            return
+        ready[index] = reassemble([chunks[index]], [fixed])
+        while next_index in ready:
+            yield ready.pop(next_index)
+            next_index += 1
+
+def split_for_fixing(buggy_code):
+    """Return (chunks, context) for inputs large enough to chunk, otherwise None"""
+    if buggy_code.count('\n') < CHUNK_THRESHOLD_LINES:
+        return None
+    chunks, context = split_code(buggy_code, CHUNK_MAX_LINES)
+    if len(chunks) < 2:
+        return None
+    return chunks, context
+
+def plan_fix(buggy_code, document_id=None):
+    """Decide how to fix the code.
+
+    Returns (chunks, context, reused) for a piecewise fix, or None when the
+    code should go upstream as a single prompt. With a document_id, regions
+    unchanged since the last submission of that document are reused.
+    """
+    if document_id:
+        segments = document_store.load(document_id)
+        if segments:
+            plan = plan_update(segments, buggy_code)
+            if plan is not None:
+                return plan
+
+    split = split_for_fixing(buggy_code)
+    if split is None:
+        return None
+    return split[0], split[1], {}
+
+def remember_document(document_id, pairs):
+    """Store (original, fixed) pieces as the latest analyzed version of a document"""
+    if document_id:
+        document_store.save(document_id, pairs)
+
+def preanalyze(buggy_code, language=None):
+    """Run the local checks in front of Gemini, returning a preanalysis Report"""
+    if not PREANALYSIS_ENABLED:
+        return Report(buggy_code, language)
+    return analyze_code(buggy_code, language, skip_clean=PREANALYSIS_SKIP_CLEAN)
+
+@timed('prompt_build')
+def compact_code(code, language=None):
+    """Compact code for a prompt, adding the tokens saved to the current request's tally"""
+    if not COMPACTION_ENABLED:
+        return Compaction(code)
+    compaction = compact(code, language, COMPACTION_MIN_COMMENT_LINES, COMPACTION_MIN_LITERAL_LINES)
+    tally = compaction_tally.get()
+    if tally is not None:
+        tally.append(compaction.tokens_saved)
+    return compaction
+
+def generate_restored(compaction, prompt_for):
+    """Send prompt_for(compaction) and restore the omitted content into the reply.
+
+    When the model dropped a placeholder, the code is sent again uncompacted
+    rather than returned without what the placeholder stood for.
+    """
+    fixed = gemini_client.generate(prompt_for(compaction))
+    if fixed.startswith('Error:'):
+        return fixed
+    restored = compaction.restore(fixed)
+    if restored is None:
+        return gemini_client.generate(prompt_for(Compaction(compaction.original)))
+    return restored
+
+def compacted_diagnostics(diagnostics, compaction):
+    """Point 'line N:' diagnostics at the matching line of the compacted code"""
+    if not compaction.compacted:
+        return diagnostics
+    return [
+        re.sub(r'^line (\d+)', lambda m: f"line {compaction.line_number(int(m.group(1)))}", diagnostic)
+        for diagnostic in diagnostics
+    ]
+
+def fingerprint_code(code, language=None):
+    """Fingerprint code for the semantic cache, or None when that is off or the code cannot be handled"""
+    if not FINGERPRINT_ENABLED or not CACHE_ENABLED or len(code) > FINGERPRINT_MAX_BYTES:
+        return None
+    return fingerprint(code, language)
+
+def fingerprint_cache_key(fp):
+    return make_cache_key(GEMINI_API_URL, f"fingerprint:{fp.key}")
+
+@timed('fingerprint')
+def replay_fix(fp):
+    """Replay the stored fix of a near-duplicate on this code, or return None"""
+    value = result_cache.get(fingerprint_cache_key(fp))
+    if value is None:
+        metrics.record_semantic_cache('miss')
+        return None
     try:
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            "contents": [
-                {
-                    "parts": [
-                        {
-                            "text": f"Fix this code and only return the fixed code without any explanations:\n{buggy_code}"
-                        }
-                    ]
-                }
-            ]
-        }
-        
-        response = requests.post(
-            f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-            headers=headers,
-            json=data,
-            timeout=30  # Add timeout
-        )
-        
-        # Handle rate limiting specifically
-        if response.status_code == 429:
-            return "Error: API quota exceeded. Please wait a few minutes and try again, or upgrade to a paid plan for higher limits."
-        
-        response.raise_for_status()  # Raise exception for bad status codes
-        
-        result = response.json()
-        if 'candidates' in result and len(result['candidates']) > 0:
-            return result['candidates'][0]['content']['parts'][0]['text']
-        else:
-            return "Error: No response from AI model"
-            
-    except requests.exceptions.RequestException as e:
-        if "429" in str(e):
-            return "Error: API quota exceeded. Please wait and try again later, or upgrade your plan."
-        return f"Error: Connection failed - {str(e)}"
-    except Exception as e:
-        return f"Error: {str(e)}"
+        fixed_code = fp.apply(json.loads(value))
+    except (ValueError, KeyError, IndexError, TypeError):
+        fixed_code = None
+    metrics.record_semantic_cache('hit' if fixed_code is not None else 'rejected')
+    return fixed_code
+
+def remember_fix(fp, fixed_code):
+    """Store a fix under the code's fingerprint so near-duplicates can reuse it"""
+    template = fp.template(strip_code_fences(fixed_code))
+    if template is not None:
+        result_cache.set(fingerprint_cache_key(fp), json.dumps(template))
+
+def remember_fixed(document_id, fp, buggy_code, fixed_code):
+    """Store a single-prompt fix for incremental re-analysis and for near-duplicates"""
+    remember_document(document_id, [(buggy_code, strip_code_fences(fixed_code))])
+    if fp is not None:
+        remember_fix(fp, fixed_code)
+
+def fix_code_with_gemini(buggy_code, document_id=None, language=None, on_progress=None, report=None):
+    """Use Gemini API to fix the code.
+
+    on_progress, if given, is called with a progress dict as chunks of a large file are fixed.
+    A preanalysis report already made for buggy_code can be passed in to skip that step.
+    """
+    report = report or preanalyze(buggy_code, language)
+    if report.resolved:
+        remember_document(document_id, [(buggy_code, report.code)])
+        return report.code
+    buggy_code = report.code
+
+    fp = fingerprint_code(buggy_code, report.language)
+    if fp is not None:
+        fixed_code = replay_fix(fp)
+        if fixed_code is not None:
+            remember_document(document_id, [(buggy_code, fixed_code)])
+            return fixed_code
+
+    plan = plan_fix(buggy_code, document_id)
+    if plan is None:
+        compaction = compact_code(buggy_code, report.language)
+        fixed_code = generate_restored(compaction, lambda c: build_fix_prompt(c.text, compacted_diagnostics(report.diagnostics, c), bool(c.blocks)))
+        if not fixed_code.startswith('Error:'):
+            remember_fixed(document_id, fp, buggy_code, fixed_code)
+        return fixed_code
+
+    return fix_planned(plan, document_id, fp, on_progress)
+
+def fix_planned(plan, document_id=None, fp=None, on_progress=None):
+    """Fix code piecewise following a plan from plan_fix, returning the joined fix or an error"""
+    fixed_chunks = []
+    for fixed in fix_chunks_in_order(*plan):
+        if fixed.startswith('Error:'):
+            return fixed
+        fixed_chunks.append(fixed)
+        if on_progress is not None:
+            on_progress({'stage': 'fixing', 'chunks_done': len(fixed_chunks), 'chunks_total': len(plan[0])})
+    remember_document(document_id, zip(plan[0], fixed_chunks))
+    if fp is not None:
+        remember_fix(fp, ''.join(fixed_chunks))
+    return ''.join(fixed_chunks)
+
+def stream_fixed_code(buggy_code, document_id=None, language=None):
+    """Yield the fixed code as it is produced, raising GeminiError on failure"""
+    report = preanalyze(buggy_code, language)
+    if report.resolved:
+        remember_document(document_id, [(buggy_code, report.code)])
+        yield report.code
+        return
+    buggy_code = report.code
+
+    fp = fingerprint_code(buggy_code, report.language)
+    if fp is not None:
+        fixed_code = replay_fix(fp)
+        if fixed_code is not None:
+            remember_document(document_id, [(buggy_code, fixed_code)])
+            yield fixed_code
+            return
+
+    plan = plan_fix(buggy_code, document_id)
+    if plan is None:
+        texts = []
+        for text in gemini_client.stream(build_fix_prompt(buggy_code, report.diagnostics)):
+            texts.append(text)
+            yield text
+        remember_fixed(document_id, fp, buggy_code, ''.join(texts))
+        return
+
+    fixed_chunks = []
+    for fixed in fix_chunks_in_order(*plan):
+        if fixed.startswith('Error:'):
+            raise GeminiError(fixed)
+        fixed_chunks.append(fixed)
+        yield fixed
+    remember_document(document_id, zip(plan[0], fixed_chunks))
+    if fp is not None:
+        remember_fix(fp, ''.join(fixed_chunks))
 
 def explain_changes_with_gemini(original_code, fixed_code):
     """Use Gemini API to explain the changes made to the code"""
+    return gemini_client.generate(build_explain_prompt(original_code, fixed_code))
+
+def explanation_cache_key(original_code, fixed_code):
+    return request_cache_key(gemini_client.api_url, build_explain_prompt(original_code, fixed_code))
+
+def speculative_explanation(original_code, fixed_code):
+    current_endpoint.set('speculation')
+    metrics.upstream_tally.set(None)
+    with priority(BATCH):
+        return explain_changes_with_gemini(original_code, fixed_code)
+
+def speculate_explanation(original_code, fixed_code):
+    """Start explaining a fix in the background, ahead of the likely "Explain Changes" click"""
+    if speculator is None:
+        return
+    cache_key = explanation_cache_key(original_code, fixed_code)
+    if result_cache.peek(cache_key) is None:
+        speculator.submit(cache_key, speculative_explanation, original_code, fixed_code)
+
+def speculated_explanation(original_code, fixed_code):
+    """Wait for a speculative explanation of this fix that is still being generated, or return None"""
+    if speculator is None:
+        return None
+    explanation = speculator.join(explanation_cache_key(original_code, fixed_code), GEMINI_TIMEOUT * 2)
+    if explanation is None or explanation.startswith('Error:'):
+        return None
+    return explanation
+
+# Structured output used to get the fix and its explanation from a single call
+ANALYZE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "fixed_code": {"type": "STRING"},
+        "explanation": {"type": "STRING"}
+    },
+    "required": ["fixed_code", "explanation"]
+}
+
+@timed('prompt_build')
+def build_analyze_prompt(buggy_code, diagnostics=None, placeholders=False):
+    """Build the prompt asking for the fixed code and an explanation together"""
+    findings = ''
+    if diagnostics:
+        findings = '\nA static check reported:\n' + '\n'.join(f"- {diagnostic}" for diagnostic in diagnostics) + '\n'
+    note = f"\n{MARKER_NOTE}" if placeholders else ''
+    return f"""Fix this code and explain the changes made to fix it. Be detailed and technical in the explanation.
+Put the complete fixed code, without any explanations, in "fixed_code" and the explanation in "explanation".{note}{findings}
+Code:
+{buggy_code}"""
+
+def describe_local_fixes(report):
+    """Explanation for code that was handled entirely by the local pre-analysis"""
+    if not report.fixes:
+        return "No changes were needed: the code passed the syntax and static checks."
+    return "The following issues were fixed:\n" + '\n'.join(f"- {fix}" for fix in report.fixes)
+
+def remember_explanation(original_code, fixed_code, explanation):
+    """Cache an explanation under the key the explain endpoint looks up"""
+    cache_key = request_cache_key(gemini_client.api_url, build_explain_prompt(original_code, fixed_code))
+    result_cache.set(cache_key, explanation)
+
+def analyze_with_gemini(buggy_code, document_id=None, language=None, on_progress=None):
+    """Fix the code and explain the fix with one structured Gemini call.
+
+    Returns {'fixed_code', 'explanation'} or an 'Error:' string.
+    """
+    report = preanalyze(buggy_code, language)
+    if report.resolved:
+        fixed_code = report.code
+        explanation = describe_local_fixes(report)
+        remember_document(document_id, [(buggy_code, fixed_code)])
+    elif plan_fix(report.code, document_id) is not None:
+        # Chunked and incremental fixes are assembled from several calls, so explain separately
+        fixed_code = fix_code_with_gemini(buggy_code, document_id, language, on_progress)
+        if fixed_code.startswith('Error:'):
+            return fixed_code
+        if on_progress is not None:
+            on_progress({'stage': 'explaining'})
+        explanation = explain_changes_with_gemini(buggy_code, fixed_code)
+        if explanation.startswith('Error:'):
+            return explanation
+    else:
+        # A reply that dropped a placeholder is asked for again without compaction
+        for compaction in (compact_code(report.code, report.language), Compaction(report.code)):
+            diagnostics = compacted_diagnostics(report.diagnostics, compaction)
+            reply = gemini_client.generate(build_analyze_prompt(compaction.text, diagnostics, bool(compaction.blocks)), ANALYZE_SCHEMA)
+            if reply.startswith('Error:'):
+                return reply
+            try:
+                result = json.loads(strip_code_fences(reply))
+                fixed_code = compaction.restore(result['fixed_code'])
+                explanation = result['explanation']
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return "Error: Malformed response from AI model"
+            if fixed_code is not None:
+                break
+        remember_document(document_id, [(report.code, strip_code_fences(fixed_code))])
+
+    remember_explanation(buggy_code, fixed_code, explanation)
+    return {'fixed_code': fixed_code, 'explanation': explanation}
+
+def get_document_id(data):
+    """Read the optional document_id used for incremental re-analysis, returning (document_id, error)"""
+    document_id = data.get('document_id')
+    if document_id is None:
+        return None, None
+    if not isinstance(document_id, str) or not 0 < len(document_id) <= 128:
+        return None, 'document_id must be a string of at most 128 characters'
+    return document_id, None
+
+RESPONSE_FORMATS = ('full', 'patch', 'hunks')
+
+def get_response_format(data):
+    """Read the optional response format ('full', 'patch' or 'hunks'), returning (format, error)"""
+    response_format = data.get('format', 'full')
+    if response_format not in RESPONSE_FORMATS:
+        return None, f"format must be one of: {', '.join(RESPONSE_FORMATS)}"
+    return response_format, None
+
+def fix_payload(buggy_code, fixed_code, response_format='full'):
+    """Response body for a fix: the whole fixed file, or only its delta from the submitted code"""
+    if response_format == 'full':
+        return {'fixed_code': fixed_code}
+    diff = Diff(buggy_code, strip_code_fences(fixed_code))
+    if response_format == 'patch':
+        return {'patch': diff.unified()}
+    return {'hunks': diff.hunks()}
+
+def queue_full_body(e):
+    return {'error': str(e), 'queue_position': e.position + 1, 'eta_seconds': round(e.eta, 1)}
+
+def queue_full_response(e):
+    """503 telling the client where it stands in the upstream queue and when to retry"""
+    response = jsonify(queue_full_body(e))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(e.eta) + 1)
+    return response
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    current_endpoint.set(g.metrics_endpoint)
+    metrics.HTTP_IN_FLIGHT.labels(g.metrics_endpoint).inc()
+
+@app.after_request
+def record_request_metrics(response):
+    if 'metrics_started' in g:
+        metrics.HTTP_DURATION.labels(g.metrics_endpoint).observe(time.perf_counter() - g.metrics_started)
+        metrics.HTTP_REQUESTS.labels(g.metrics_endpoint, request.method, response.status_code).inc()
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    if 'metrics_started' in g:
+        metrics.HTTP_IN_FLIGHT.labels(g.metrics_endpoint).dec()
+
+@app.before_request
+def start_compaction_tally():
+    compaction_tally.set([])
+
+@app.after_request
+def report_compaction_savings(response):
+    """Tell the client how many prompt tokens compaction saved on this request"""
+    tally = compaction_tally.get()
+    if tally:
+        response.headers['X-Prompt-Tokens-Saved'] = str(sum(tally))
+    return response
+
+def fix_cost(code):
+    """(tokens, upstream calls, calls run at once) to fix one submission"""
+    lines = code.count('\n')
+    calls = 1 if lines < CHUNK_THRESHOLD_LINES else math.ceil(lines / CHUNK_MAX_LINES)
+    return estimate_tokens(code), calls, CHUNK_CONCURRENCY
+
+def request_cost(rule, data):
+    """Estimate (tokens, calls, parallelism, priority) for a request body, or None to let the route reject it"""
+    if rule in ('/api/fix_code', '/api/fix_code/stream', '/api/analyze'):
+        code = data.get('code')
+        if not isinstance(code, str) or not code:
+            return None
+        tokens, calls, parallelism = fix_cost(code)
+        if rule == '/api/analyze' and calls > 1:
+            calls += 1  # Chunked fixes are explained by a separate call
+        return tokens, calls, parallelism, INTERACTIVE
+    if rule in ('/api/explain_changes', '/api/explain_changes/stream'):
+        original_code, fixed_code = data.get('original_code'), data.get('fixed_code')
+        if not isinstance(original_code, str) or not isinstance(fixed_code, str):
+            return None
+        return estimate_tokens(original_code) + estimate_tokens(fixed_code), 1, 1, INTERACTIVE
+    if rule == '/api/fix_code/batch':
+        snippets = data.get('snippets')
+        if not isinstance(snippets, list):
+            return None
+        codes = [s.get('code', '') if isinstance(s, dict) else s for s in snippets]
+        tokens = sum(estimate_tokens(code) for code in codes if isinstance(code, str))
+        return tokens, len(snippets), BATCH_CONCURRENCY, BATCH
+    return None
+
+def request_deadline(headers):
+    """The client's own deadline from an X-Request-Timeout header (seconds), if it sent one"""
     try:
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            "contents": [
-                {
-                    "parts": [
-                        {
-                            "text": f"""Explain the changes made to fix this code. Be detailed and technical:
-Original code:
-{original_code}
+        return float(headers.get('X-Request-Timeout'))
+    except (TypeError, ValueError):
+        return None
+
+def admit(rule, data, headers):
+    """Admit a request to one of the priced endpoints, returning its ticket (None if unpriced) or raising Rejected"""
+    if not ADMISSION_ENABLED or not isinstance(data, dict):
+        return None
+    cost = request_cost(rule, data)
+    if cost is None:
+        return None
+    tokens, calls, parallelism, level = cost
+    ticket = admission.admit(tokens, calls, parallelism, level, request_deadline(headers))
+    # Count this request's upstream calls, so cache hits do not skew the learned round time
+    metrics.upstream_tally.set(ticket.upstream)
+    return ticket
+
+def rejection_response(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = e.status
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.before_request
+def admit_request():
+    """Refuse oversized bodies and work that cannot be served in time, before any of it starts"""
+    g.admission_ticket = None
+    metrics.upstream_tally.set(None)
+    if request.url_rule is None or request.url_rule.rule == '/api/scan':
+        return None
+    # Reading the body here applies the limit to chunked bodies that send no
+    # Content-Length (which are cut off at the limit), before any handler parses them
+    try:
+        too_large = len(request.get_data(cache=True)) >= request.max_content_length
+    except RequestEntityTooLarge:
+        too_large = True
+    if too_large:
+        return jsonify({'error': f'Request body too large (maximum is {ADMISSION_MAX_BODY_MB:g} MB)'}), 413
+    if not ADMISSION_ENABLED or request.method != 'POST':
+        return None
+    try:
+        g.admission_ticket = admit(request.url_rule.rule, request.get_json(silent=True), request.headers)
+    except Rejected as e:
+        return rejection_response(e)
+    return None
 
-Fixed code:
-{fixed_code}"""
-                        }
-                    ]
-                }
-            ]
-        }
-        
-        response = requests.post(
-            f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-            headers=headers,
-            json=data,
-            timeout=30  # Add timeout
-        )
-        
-        # Handle rate limiting specifically
-        if response.status_code == 429:
-            return "Error: API quota exceeded. Please wait a few minutes and try again, or upgrade to a paid plan for higher limits."
-        
-        response.raise_for_status()  # Raise exception for bad status codes
-        
-        result = response.json()
-        if 'candidates' in result and len(result['candidates']) > 0:
-            return result['candidates'][0]['content']['parts'][0]['text']
-        else:
-            return "Error: No response from AI model"
-            
-    except requests.exceptions.RequestException as e:
-        if "429" in str(e):
-            return "Error: API quota exceeded. Please wait and try again later, or upgrade your plan."
-        return f"Error: Connection failed - {str(e)}"
-    except Exception as e:
-        return f"Error: {str(e)}"
+@app.teardown_request
+def release_admission(exc=None):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission.release(ticket)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # The page itself is revalidated cheaply; the assets it links to are never requested again
+    response = make_response(render_template('index.html'))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Serve a content-hashed asset, precompressed when the client accepts it"""
+    asset = asset_bundle.get(filename)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    encoding, body = asset.encoded({value for value, quality in request.accept_encodings if quality > 0})
+    response = Response(body, mimetype=asset.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    response.set_etag(asset.etag + (f'-{encoding}' if encoding else ''))
+    return response.make_conditional(request)
 
 @app.route('/api/fix_code', methods=['POST'])
 def api_fix_code():
@@ -807,13 +883,57 @@ def api_fix_code():
         buggy_code = data.get('code', '')
         if not buggy_code:
             return jsonify({'error': 'No code provided'}), 400
+
+        document_id, error = get_document_id(data)
+        if error:
+            return jsonify({'error': error}), 400
+
+        response_format, error = get_response_format(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        fixed_code = fix_code_with_gemini(buggy_code)
+        fixed_code = fix_code_with_gemini(buggy_code, document_id, data.get('language'))
         if fixed_code.startswith('Error:'):
             return jsonify({'error': fixed_code}), 500
-            
-        return jsonify({'fixed_code': fixed_code})
+
+        payload = fix_payload(buggy_code, fixed_code, response_format)
+        speculate_explanation(buggy_code, fixed_code if response_format == 'full' else strip_code_fences(fixed_code))
+        return jsonify(payload)
         
+    except QueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/api/analyze', methods=['POST'])
+def api_analyze():
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+
+        buggy_code = data.get('code', '')
+        if not buggy_code:
+            return jsonify({'error': 'No code provided'}), 400
+
+        document_id, error = get_document_id(data)
+        if error:
+            return jsonify({'error': error}), 400
+
+        response_format, error = get_response_format(data)
+        if error:
+            return jsonify({'error': error}), 400
+
+        result = analyze_with_gemini(buggy_code, document_id, data.get('language'))
+        if isinstance(result, str):
+            return jsonify({'error': result}), 500
+
+        payload = fix_payload(buggy_code, result['fixed_code'], response_format)
+        payload['explanation'] = result['explanation']
+        return jsonify(payload)
+
+    except QueueFull as e:
+        return queue_full_response(e)
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
@@ -830,15 +950,406 @@ def api_explain_changes():
         if not original_code or not fixed_code:
             return jsonify({'error': 'Both original and fixed code are required'}), 400
         
-        explanation = explain_changes_with_gemini(original_code, fixed_code)
+        explanation = speculated_explanation(original_code, fixed_code) or explain_changes_with_gemini(original_code, fixed_code)
         if explanation.startswith('Error:'):
             return jsonify({'error': explanation}), 500
             
         return jsonify({'explanation': explanation})
         
+    except QueueFull as e:
+        return queue_full_response(e)
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+def fix_batch_item(snippet):
+    """Fix one batch item, returning its result or error as a dict"""
+    if isinstance(snippet, dict):
+        snippet = snippet.get('code', '')
+    if not isinstance(snippet, str) or not snippet:
+        return {'error': 'No code provided'}
+    try:
+        with priority(BATCH):
+            fixed_code = fix_code_with_gemini(snippet)
+    except QueueFull as e:
+        return queue_full_body(e)
+    except Exception as e:
+        return {'error': f'Server error: {str(e)}'}
+    if fixed_code.startswith('Error:'):
+        return {'error': fixed_code}
+    return {'fixed_code': fixed_code}
+
+@app.route('/api/fix_code/batch', methods=['POST'])
+def api_fix_code_batch():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Invalid JSON data'}), 400
+
+    snippets = data.get('snippets')
+    if not isinstance(snippets, list) or not snippets:
+        return jsonify({'error': 'A non-empty list of snippets is required'}), 400
+    if len(snippets) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many snippets (maximum is {BATCH_MAX_ITEMS})'}), 400
+
+    try:
+        concurrency = int(data.get('concurrency', BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency must be an integer'}), 400
+    concurrency = max(1, min(concurrency, BATCH_CONCURRENCY))
+
+    stream = request.args.get('stream') == '1' or request.accept_mimetypes.best == 'application/x-ndjson'
+    if stream:
+        # Emit each result as soon as it finishes, tagged with its input position
+        def generate():
+            for index, result in run_bounded(fix_batch_item, snippets, concurrency):
+                yield json.dumps(dict(result, index=index)) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    results = [None] * len(snippets)
+    for index, result in run_bounded(fix_batch_item, snippets, concurrency):
+        results[index] = result
+    return jsonify({'results': results})
+
+def job_handler(func):
+    """Run a job at batch priority under the jobs endpoint, requeueing it when the quota is saturated"""
+    @functools.wraps(func)
+    def wrapper(payload, report):
+        current_endpoint.set('/api/jobs')
+        try:
+            with priority(BATCH):
+                return func(payload, report)
+        except QueueFull as e:
+            raise RetryLater(max(1.0, e.eta))
+    return wrapper
+
+@job_handler
+def run_fix_job(payload, report):
+    report({'stage': 'fixing'})
+    fixed_code = fix_code_with_gemini(payload['code'], payload.get('document_id'), payload.get('language'), report)
+    if fixed_code.startswith('Error:'):
+        return fixed_code
+    return fix_payload(payload['code'], fixed_code, payload.get('format', 'full'))
+
+@job_handler
+def run_analyze_job(payload, report):
+    report({'stage': 'analyzing'})
+    result = analyze_with_gemini(payload['code'], payload.get('document_id'), payload.get('language'), report)
+    if isinstance(result, str):
+        return result
+    body = fix_payload(payload['code'], result['fixed_code'], payload.get('format', 'full'))
+    body['explanation'] = result['explanation']
+    return body
+
+@job_handler
+def run_explain_job(payload, report):
+    report({'stage': 'explaining'})
+    explanation = explain_changes_with_gemini(payload['original_code'], payload['fixed_code'])
+    if explanation.startswith('Error:'):
+        return explanation
+    return {'explanation': explanation}
+
+job_queue = JobQueue(
+    JobStore(JOB_DB_PATH),
+    {'fix': run_fix_job, 'analyze': run_analyze_job, 'explain': run_explain_job},
+    workers=JOB_WORKERS,
+    lease_ttl=JOB_LEASE_SECONDS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retention=JOB_RETENTION
+)
+
+@app.before_request
+def start_job_workers():
+    # Workers start with the first request of each process, which also resumes jobs left by a restart
+    job_queue.start()
+
+def get_job_payload(data):
+    """Validate a job submission, returning (type, payload, error)"""
+    kind = data.get('type', 'fix')
+    if kind == 'explain':
+        original_code = data.get('original_code', '')
+        fixed_code = data.get('fixed_code', '')
+        if not original_code or not fixed_code:
+            return None, None, 'Both original and fixed code are required'
+        return kind, {'original_code': original_code, 'fixed_code': fixed_code}, None
+    if kind not in ('fix', 'analyze'):
+        return None, None, 'type must be one of: fix, analyze, explain'
+
+    code = data.get('code', '')
+    if not code:
+        return None, None, 'No code provided'
+    document_id, error = get_document_id(data)
+    if error:
+        return None, None, error
+    response_format, error = get_response_format(data)
+    if error:
+        return None, None, error
+    payload = {'code': code, 'document_id': document_id, 'language': data.get('language'), 'format': response_format}
+    return kind, payload, None
+
+@app.route('/api/jobs', methods=['POST'])
+def api_create_job():
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'Invalid JSON data'}), 400
+
+        kind, payload, error = get_job_payload(data)
+        if error:
+            return jsonify({'error': error}), 400
+
+        job_id = job_queue.submit(kind, payload)
+        location = url_for('api_get_job', job_id=job_id)
+        return jsonify({'job_id': job_id, 'status': 'queued', 'url': location}), 202, {'Location': location}
+
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_get_job(job_id):
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+
+        # Long-poll: with ?wait=SECONDS, hold the request until the job changes from ?version (default: now)
+        try:
+            wait_seconds = min(float(request.args.get('wait', 0)), JOB_MAX_WAIT)
+            version = int(request.args.get('version', job['version']))
+        except ValueError:
+            return jsonify({'error': 'wait and version must be numbers'}), 400
+        if wait_seconds > 0 and job['status'] not in FINISHED:
+            job = job_queue.wait(job_id, version, wait_seconds)
+
+        return jsonify(job)
+
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+def fix_scanned_file(entry):
+    """Fix one pre-analyzed file of a repository scan, returning its NDJSON result"""
+    result = {'path': entry['path'], 'language': entry['language'], 'status': entry['status']}
+    if entry['status'] == 'skipped':
+        result['reason'] = entry['reason']
+        return result
+    if entry['status'] == 'clean':
+        return result
+
+    code = entry['code']
+    try:
+        with priority(BATCH):
+            fixed_code = fix_code_with_gemini(code, report=entry['report'])
+    except QueueFull as e:
+        return dict(result, status='error', **queue_full_body(e))
+    except Exception as e:
+        return dict(result, status='error', error=f'Server error: {str(e)}')
+    if fixed_code.startswith('Error:'):
+        return dict(result, status='error', error=fixed_code)
+    if strip_code_fences(fixed_code) == code:
+        return dict(result, status='clean')
+    result.update(fix_payload(code, fixed_code, entry['format']), status='fixed')
+    return result
+
+def scan_repository(source, response_format='patch', concurrency=None):
+    """Yield one result per candidate file of a directory or zip/tar archive, then a summary.
+
+    Files are read one at a time in priority order, filtered and pre-analyzed
+    in a process pool, and those that still need Gemini are fixed with at
+    most `concurrency` calls in flight. Raises ValueError for an unreadable source.
+    """
+    started = time.perf_counter()
+    files = prioritize(open_source(source, SCAN_MAX_FILE_BYTES, SCAN_MAX_FILES))
+    skipped = len(files) - SCAN_MAX_FILES
+    files = files[:SCAN_MAX_FILES]
+    concurrency = max(1, min(concurrency or SCAN_CONCURRENCY, SCAN_CONCURRENCY))
+
+    def entries():
+        for entry in prefiltered(files, SCAN_MAX_FILE_BYTES, SCAN_PROCESSES, PREANALYSIS_ENABLED, PREANALYSIS_SKIP_CLEAN):
+            entry['format'] = response_format
+            yield entry
+
+    summary = {'files': len(files), 'fixed': 0, 'clean': 0, 'skipped': 0, 'error': 0}
+    for _, result in run_bounded(fix_scanned_file, entries(), concurrency):
+        summary[result['status']] += 1
+        yield result
+    if skipped > 0:
+        summary['not_scanned'] = skipped
+    summary['seconds'] = round(time.perf_counter() - started, 2)
+    yield {'summary': summary}
+
+@app.route('/api/scan', methods=['POST'])
+def api_scan():
+    """Scan an uploaded zip/tar archive, streaming one NDJSON line per file"""
+    if request.content_length and request.content_length > SCAN_MAX_UPLOAD_MB * 1024 * 1024:
+        return jsonify({'error': f'Archive too large (maximum is {SCAN_MAX_UPLOAD_MB} MB)'}), 413
+
+    response_format, error = get_response_format({'format': request.args.get('format', 'patch')})
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        concurrency = int(request.args.get('concurrency', SCAN_CONCURRENCY))
+    except ValueError:
+        return jsonify({'error': 'concurrency must be an integer'}), 400
+
+    # Accept a multipart upload ("archive" field) or the archive as the raw body;
+    # either way it is spooled to disk rather than held in memory
+    # The route's limit is enforced while reading, so chunked uploads are capped too
+    try:
+        upload = request.files.get('archive')
+        if upload is not None:
+            archive = upload.stream
+        else:
+            archive = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+            while True:
+                block = request.stream.read(1024 * 1024)
+                if not block:
+                    break
+                archive.write(block)
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Archive too large (maximum is {SCAN_MAX_UPLOAD_MB} MB)'}), 413
+    if archive.seek(0, os.SEEK_END) == 0:
+        return jsonify({'error': 'No archive provided'}), 400
+
+    try:
+        results = scan_repository(archive, response_format, concurrency)
+        first = next(results)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        yield json.dumps(first) + '\n'
+        for result in results:
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+def stream_completion(prompt, result_field):
+    """Forward Gemini chunks to the browser as SSE, finishing with a 'done' event"""
+    return stream_texts(gemini_client.stream(prompt), result_field)
+
+def stream_texts(texts, result_field, on_done=None):
+    """Send an iterable of text fragments as SSE; GeminiError ends the stream with an 'error' event.
+
+    on_done, if given, is called with the whole text once it has been sent.
+    """
+    def generate():
+        chunks = []
+        try:
+            for text in texts:
+                chunks.append(text)
+                yield sse_event({'text': text})
+        except GeminiError as e:
+            yield sse_event({'error': str(e)}, event='error')
+            return
+        except QueueFull as e:
+            yield sse_event(queue_full_body(e), event='error')
+            return
+        yield sse_event({result_field: ''.join(chunks)}, event='done')
+        if on_done is not None:
+            on_done(''.join(chunks))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/fix_code/stream', methods=['POST'])
+def api_fix_code_stream():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Invalid JSON data'}), 400
+
+    buggy_code = data.get('code', '')
+    if not buggy_code:
+        return jsonify({'error': 'No code provided'}), 400
+
+    document_id, error = get_document_id(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    return stream_texts(
+        stream_fixed_code(buggy_code, document_id, data.get('language')),
+        'fixed_code',
+        on_done=lambda fixed_code: speculate_explanation(buggy_code, fixed_code)
+    )
+
+@app.route('/api/explain_changes/stream', methods=['POST'])
+def api_explain_changes_stream():
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Invalid JSON data'}), 400
+
+    original_code = data.get('original_code', '')
+    fixed_code = data.get('fixed_code', '')
+
+    if not original_code or not fixed_code:
+        return jsonify({'error': 'Both original and fixed code are required'}), 400
+
+    explanation = speculated_explanation(original_code, fixed_code)
+    if explanation is not None:
+        return stream_texts([explanation], 'explanation')
+    return stream_completion(build_explain_prompt(original_code, fixed_code), 'explanation')
+
+@app.route('/api/cache/stats', methods=['GET'])
+def api_cache_stats():
+    stats = result_cache.stats()
+    if singleflight is not None:
+        stats['singleflight'] = singleflight.stats()
+    if speculator is not None:
+        stats['speculation'] = speculator.stats()
+    return jsonify(stats)
+
+@app.route('/api/queue', methods=['GET'])
+def api_queue():
+    if scheduler is None:
+        return jsonify({'enabled': False, 'keys': key_pool.stats()})
+    return jsonify(dict(scheduler.stats(), enabled=True))
+
+# Scrape-time gauges for sizing the worker pools and watching the cache
+metrics.Gauge('stark_scheduler_queued', 'Calls waiting for an upstream quota token', function=lambda: scheduler.stats()['queued'] if scheduler else 0)
+metrics.Gauge('stark_api_keys_available', 'API keys not cooling down, disabled or out of daily quota', function=lambda: key_pool.available(time.monotonic()))
+metrics.Gauge('stark_hedge_delay_seconds', 'Latency after which interactive calls are hedged (0 until enough samples)', function=lambda: (hedger.current_delay() or 0) if hedger else 0)
+metrics.Gauge('stark_jobs_queued', 'Jobs waiting for a job worker', function=lambda: job_queue.store.counts()['queued'])
+metrics.Gauge('stark_jobs_running', 'Jobs being worked on', function=lambda: job_queue.store.counts()['running'])
+metrics.Gauge('stark_admission_in_flight', 'Requests admitted and not yet finished', function=lambda: admission.in_flight)
+metrics.Gauge('stark_admission_round_seconds', 'Learned time for one round of upstream calls', function=lambda: admission.round_seconds)
+metrics.Gauge('stark_cache_hit_ratio', 'Result cache hit ratio since startup', function=lambda: result_cache.stats()['hit_rate'])
+metrics.Gauge('stark_batch_queue_depth', 'Batch items waiting for a worker thread', function=lambda: batch_executor.queued)
+metrics.Gauge('stark_chunk_queue_depth', 'Chunks waiting for a worker thread', function=lambda: chunk_executor.queued)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of this worker process's metrics"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the worker process is up and answering"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the shared databases answer and at least one API key can take calls"""
+    checks = {}
+    try:
+        job_queue.store.counts()
+        checks['database'] = 'ok'
+    except Exception as e:
+        checks['database'] = f"Error: {str(e)}"
+    if key_pool.usable(time.monotonic()):
+        checks['api_keys'] = 'ok'
+    else:
+        checks['api_keys'] = 'Error: Every API key is disabled or out of daily quota'
+    ready = all(check == 'ok' for check in checks.values())
+    return jsonify({'status': 'ready' if ready else 'unavailable', 'checks': checks}), 200 if ready else 503
+
 if __name__ == '__main__':
-    create_directories_and_files()
-    app.run(debug=True, port=5000)
+    # Development server only (debugger and reloader with FLASK_DEBUG=1); see gunicorn.conf.py for production
+    threading.Thread(target=gemini_client.warm, daemon=True).start()
+    job_queue.start()
+    app.run(port=5000)
@@ -0,0 +1,488 @@
+"""Asyncio serving mode.
+
+Run with an ASGI server, e.g. ``uvicorn asgi:application --port 5000``.
+
+The fix/analyze/explain endpoints are served natively here so that waiting on Gemini
+costs a coroutine rather than a worker thread. Every other route (the UI,
+static files, stats) is delegated to the Flask app.
+"""
+import os
+import json
+import time
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import (
+    app as flask_app,
+    GEMINI_API_URL,
+    GEMINI_API_KEY,
+    GEMINI_TIMEOUT,
+    result_cache,
+    scheduler,
+    hedger,
+    key_pool,
+    singleflight,
+    job_queue,
+    admit,
+    admission,
+    ADMISSION_MAX_BODY_MB,
+    queue_full_body,
+    get_response_format,
+    get_document_id,
+    remember_document,
+    fix_payload,
+    build_fix_prompt,
+    compact_code,
+    build_chunk_fix_prompt,
+    CHUNK_CONCURRENCY,
+    plan_fix,
+    fingerprint_code,
+    replay_fix,
+    remember_fix,
+    remember_fixed,
+    compacted_diagnostics,
+    build_explain_prompt,
+    build_analyze_prompt,
+    ANALYZE_SCHEMA,
+    describe_local_fixes,
+    remember_explanation,
+    preanalyze,
+    sse_event,
+    speculator,
+    speculate_explanation,
+    explanation_cache_key,
+    profiler,
+)
+from chunking import strip_code_fences
+from compaction import Compaction
+from gemini_client import AsyncGeminiClient, GeminiError
+from ratelimit import QueueFull
+from admission import Rejected
+import metrics
+from metrics import current_endpoint, stage
+
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', '200'))
+
+wsgi_application = WsgiToAsgi(flask_app)
+gemini_client = None
+
+
+async def read_json(receive, max_bytes=None):
+    """Read the whole request body and decode it as JSON, returning None when invalid.
+
+    Raises Rejected once the body grows past max_bytes.
+    """
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if max_bytes is not None and len(body) > max_bytes:
+            raise Rejected(413, 'too_large', f'Request body too large (maximum is {ADMISSION_MAX_BODY_MB:g} MB)')
+    try:
+        with stage('json_parse'):
+            return json.loads(body)
+    except ValueError:
+        return None
+
+
+async def send_json(send, data, status=200, headers=()):
+    with stage('serialize'):
+        body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+            (b'access-control-allow-origin', b'*'),
+        ] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_stream(send, texts, result_field, on_done=None):
+    """Forward the pieces of text from an async iterator as SSE, finishing with a 'done' or 'error' event.
+
+    on_done, if given, is called (in a worker thread) with the whole text after a successful stream.
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+
+    chunks = []
+    try:
+        async for text in texts:
+            chunks.append(text)
+            await send({'type': 'http.response.body', 'body': sse_event({'text': text}).encode('utf-8'), 'more_body': True})
+        final = sse_event({result_field: ''.join(chunks)}, event='done')
+    except GeminiError as e:
+        final = sse_event({'error': str(e)}, event='error')
+        on_done = None
+    except QueueFull as e:
+        final = sse_event(queue_full_body(e), event='error')
+        on_done = None
+    finally:
+        # Stop upstream work at once if the client went away mid-stream
+        await texts.aclose()
+    await send({'type': 'http.response.body', 'body': final.encode('utf-8')})
+    if on_done is not None:
+        await asyncio.to_thread(on_done, ''.join(chunks))
+
+
+async def await_speculation(data):
+    """Wait for a speculative explanation of this fix still being generated, which leaves it in the cache"""
+    if speculator is None:
+        return
+    cache_key = await asyncio.to_thread(explanation_cache_key, data['original_code'], data['fixed_code'])
+    future = speculator.pending(cache_key)
+    if future is None:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), GEMINI_TIMEOUT * 2)
+    except Exception:
+        return
+    speculator.joined()
+
+
+def parse_fix_request(data):
+    """Validate a fix request and run the local pre-analysis, returning (report, error)"""
+    if not data:
+        return None, 'Invalid JSON data'
+    buggy_code = data.get('code', '')
+    if not buggy_code:
+        return None, 'No code provided'
+    _, error = get_response_format(data)
+    if error:
+        return None, error
+    return preanalyze(buggy_code, data.get('language')), None
+
+
+def parse_explain_request(data):
+    if not data:
+        return None, 'Invalid JSON data'
+    original_code = data.get('original_code', '')
+    fixed_code = data.get('fixed_code', '')
+    if not original_code or not fixed_code:
+        return None, 'Both original and fixed code are required'
+    return build_explain_prompt(original_code, fixed_code), None
+
+
+async def generate_restored(compaction, prompt_for):
+    """Async counterpart of app.generate_restored"""
+    fixed = await gemini_client.generate(prompt_for(compaction))
+    if fixed.startswith('Error:'):
+        return fixed
+    restored = compaction.restore(fixed)
+    if restored is None:
+        return await gemini_client.generate(prompt_for(Compaction(compaction.original)))
+    return restored
+
+
+async def fix_chunks_in_order(chunks, context, reused=None):
+    """Async counterpart of app.fix_chunks_in_order: fix chunks concurrently, yielding them in file order"""
+    reused = reused or {}
+    compactions = await asyncio.to_thread(lambda: [
+        compact_code(chunk) if chunk.strip() and index not in reused else None
+        for index, chunk in enumerate(chunks)
+    ])
+    limit = asyncio.Semaphore(CHUNK_CONCURRENCY)
+
+    async def fix(index):
+        if index in reused:
+            return reused[index]
+        if compactions[index] is None:
+            return chunks[index]
+        async with limit:
+            return await generate_restored(compactions[index], lambda c: build_chunk_fix_prompt(c.text, context, bool(c.blocks)))
+
+    tasks = [asyncio.ensure_future(fix(index)) for index in range(len(chunks))]
+    try:
+        for task in tasks:
+            fixed = await task
+            yield fixed
+            if fixed.startswith('Error:'):
+                return
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def fix_planned(plan, document_id=None, fp=None):
+    """Async counterpart of app.fix_planned, returning the joined fix or an error"""
+    fixed_chunks = []
+    async for fixed in fix_chunks_in_order(*plan):
+        if fixed.startswith('Error:'):
+            return fixed
+        fixed_chunks.append(fixed)
+    await asyncio.to_thread(remember_document, document_id, list(zip(plan[0], fixed_chunks)))
+    if fp is not None:
+        await asyncio.to_thread(remember_fix, fp, ''.join(fixed_chunks))
+    return ''.join(fixed_chunks)
+
+
+async def stream_fixed_code(code, report, document_id=None):
+    """Async counterpart of app.stream_fixed_code: yield the fixed code as it is produced, raising GeminiError on failure"""
+    if report.resolved:
+        await asyncio.to_thread(remember_document, document_id, [(code, report.code)])
+        yield report.code
+        return
+
+    fp = await asyncio.to_thread(fingerprint_code, report.code, report.language)
+    if fp is not None:
+        fixed_code = await asyncio.to_thread(replay_fix, fp)
+        if fixed_code is not None:
+            await asyncio.to_thread(remember_document, document_id, [(report.code, fixed_code)])
+            yield fixed_code
+            return
+
+    plan = await asyncio.to_thread(plan_fix, report.code, document_id)
+    if plan is None:
+        texts = []
+        upstream = gemini_client.stream(build_fix_prompt(report.code, report.diagnostics))
+        try:
+            async for text in upstream:
+                texts.append(text)
+                yield text
+        finally:
+            await upstream.aclose()
+        await asyncio.to_thread(remember_fixed, document_id, fp, report.code, ''.join(texts))
+        return
+
+    fixed_chunks = []
+    async for fixed in fix_chunks_in_order(*plan):
+        if fixed.startswith('Error:'):
+            raise GeminiError(fixed)
+        fixed_chunks.append(fixed)
+        yield fixed
+    await asyncio.to_thread(remember_document, document_id, list(zip(plan[0], fixed_chunks)))
+    if fp is not None:
+        await asyncio.to_thread(remember_fix, fp, ''.join(fixed_chunks))
+
+
+async def fix_code(buggy_code, report, document_id=None):
+    """Async counterpart of app.fix_code_with_gemini, returning (fixed code or an error, response headers)"""
+    if report.resolved:
+        await asyncio.to_thread(remember_document, document_id, [(buggy_code, report.code)])
+        return report.code, []
+
+    fp = await asyncio.to_thread(fingerprint_code, report.code, report.language)
+    if fp is not None:
+        fixed_code = await asyncio.to_thread(replay_fix, fp)
+        if fixed_code is not None:
+            await asyncio.to_thread(remember_document, document_id, [(report.code, fixed_code)])
+            return fixed_code, []
+
+    plan = await asyncio.to_thread(plan_fix, report.code, document_id)
+    if plan is not None:
+        # Large or previously seen files are fixed piecewise
+        return await fix_planned(plan, document_id, fp), []
+
+    compaction = await asyncio.to_thread(compact_code, report.code, report.language)
+    diagnostics = compacted_diagnostics(report.diagnostics, compaction)
+    fixed_code = await gemini_client.generate(build_fix_prompt(compaction.text, diagnostics, bool(compaction.blocks)))
+    if fixed_code.startswith('Error:'):
+        return fixed_code, []
+    headers = [(b'x-prompt-tokens-saved', str(compaction.tokens_saved).encode('ascii'))] if compaction.tokens_saved else []
+    restored = compaction.restore(fixed_code)
+    if restored is None:
+        # The model dropped a placeholder; ask again with nothing omitted
+        headers = []
+        restored = await gemini_client.generate(build_fix_prompt(report.code, report.diagnostics))
+        if restored.startswith('Error:'):
+            return restored, []
+    await asyncio.to_thread(remember_fixed, document_id, fp, report.code, restored)
+    return restored, headers
+
+
+async def analyze(buggy_code, report, document_id=None):
+    """Async counterpart of app.analyze_with_gemini, returning {'fixed_code', 'explanation'} or an 'Error:' string"""
+    if report.resolved:
+        fixed_code = report.code
+        explanation = describe_local_fixes(report)
+        await asyncio.to_thread(remember_document, document_id, [(buggy_code, fixed_code)])
+    elif await asyncio.to_thread(plan_fix, report.code, document_id) is not None:
+        # Chunked and incremental fixes are assembled from several calls, so explain separately
+        fixed_code, _ = await fix_code(buggy_code, report, document_id)
+        if fixed_code.startswith('Error:'):
+            return fixed_code
+        explanation = await gemini_client.generate(await asyncio.to_thread(build_explain_prompt, buggy_code, fixed_code))
+        if explanation.startswith('Error:'):
+            return explanation
+    else:
+        # A reply that dropped a placeholder is asked for again without compaction
+        for compaction in (await asyncio.to_thread(compact_code, report.code, report.language), Compaction(report.code)):
+            diagnostics = compacted_diagnostics(report.diagnostics, compaction)
+            reply = await gemini_client.generate(build_analyze_prompt(compaction.text, diagnostics, bool(compaction.blocks)), ANALYZE_SCHEMA)
+            if reply.startswith('Error:'):
+                return reply
+            try:
+                result = json.loads(strip_code_fences(reply))
+                fixed_code = compaction.restore(result['fixed_code'])
+                explanation = result['explanation']
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return "Error: Malformed response from AI model"
+            if fixed_code is not None:
+                break
+        await asyncio.to_thread(remember_document, document_id, [(report.code, strip_code_fences(fixed_code))])
+
+    await asyncio.to_thread(remember_explanation, buggy_code, fixed_code, explanation)
+    return {'fixed_code': fixed_code, 'explanation': explanation}
+
+
+async def api_fix_code(scope, data, send):
+    report, error = await asyncio.to_thread(parse_fix_request, data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+    document_id, error = get_document_id(data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+    response_format, _ = get_response_format(data)
+
+    fixed_code, headers = await fix_code(data['code'], report, document_id)
+    if fixed_code.startswith('Error:'):
+        return await send_json(send, {'error': fixed_code}, 500)
+    await send_json(send, fix_payload(data['code'], fixed_code, response_format), headers=headers)
+    await asyncio.to_thread(speculate_explanation, data['code'], fixed_code if response_format == 'full' else strip_code_fences(fixed_code))
+
+
+async def api_analyze(scope, data, send):
+    report, error = await asyncio.to_thread(parse_fix_request, data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+    document_id, error = get_document_id(data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+    response_format, _ = get_response_format(data)
+
+    result = await analyze(data['code'], report, document_id)
+    if isinstance(result, str):
+        return await send_json(send, {'error': result}, 500)
+    payload = fix_payload(data['code'], result['fixed_code'], response_format)
+    payload['explanation'] = result['explanation']
+    await send_json(send, payload)
+
+
+async def api_explain_changes(scope, data, send):
+    prompt, error = await asyncio.to_thread(parse_explain_request, data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+
+    await await_speculation(data)
+    explanation = await gemini_client.generate(prompt)
+    if explanation.startswith('Error:'):
+        return await send_json(send, {'error': explanation}, 500)
+    await send_json(send, {'explanation': explanation})
+
+
+async def api_fix_code_stream(scope, data, send):
+    report, error = await asyncio.to_thread(parse_fix_request, data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+    document_id, error = get_document_id(data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+    await send_stream(
+        send, stream_fixed_code(data['code'], report, document_id), 'fixed_code',
+        on_done=lambda fixed_code: speculate_explanation(data['code'], fixed_code)
+    )
+
+
+async def api_explain_changes_stream(scope, data, send):
+    prompt, error = await asyncio.to_thread(parse_explain_request, data)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+    await await_speculation(data)
+    await send_stream(send, gemini_client.stream(prompt), 'explanation')
+
+
+routes = {
+    ('POST', '/api/fix_code'): api_fix_code,
+    ('POST', '/api/analyze'): api_analyze,
+    ('POST', '/api/explain_changes'): api_explain_changes,
+    ('POST', '/api/fix_code/stream'): api_fix_code_stream,
+    ('POST', '/api/explain_changes/stream'): api_explain_changes_stream,
+}
+
+
+async def lifespan(receive, send):
+    global gemini_client
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            gemini_client = AsyncGeminiClient(
+                GEMINI_API_URL,
+                GEMINI_API_KEY,
+                cache=result_cache,
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                timeout=GEMINI_TIMEOUT,
+                scheduler=scheduler,
+                hedger=hedger,
+                keys=key_pool,
+                singleflight=singleflight
+            )
+            await gemini_client.warm()
+            job_queue.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if gemini_client is not None:
+                await gemini_client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    handler = None
+    if scope['type'] == 'http':
+        handler = routes.get((scope['method'], scope['path']))
+    if handler is None:
+        return await wsgi_application(scope, receive, send)
+
+    endpoint = scope['path']
+    current_endpoint.set(endpoint)
+    started = time.perf_counter()
+    status = {}
+    headers = {name.decode('latin-1').title(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    profile = profiler.begin(scope['method'], endpoint, headers) if profiler is not None else None
+
+    async def send_and_record(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+            if profile is not None and profile.file is not None:
+                profile_header = (b'x-profile-file', os.path.basename(profile.file).encode('ascii'))
+                message = dict(message, headers=list(message.get('headers', [])) + [profile_header])
+        await send(message)
+
+    with metrics.HTTP_IN_FLIGHT.track_inprogress(endpoint):
+        ticket = None
+        try:
+            data = await read_json(receive, ADMISSION_MAX_BODY_MB * 1024 * 1024)
+            ticket = admit(endpoint, data, headers)
+            await handler(scope, data, send_and_record)
+        except Rejected as e:
+            retry_after = [(b'retry-after', str(e.retry_after).encode('ascii'))] if e.retry_after is not None else []
+            await send_json(send_and_record, {'error': str(e)}, e.status, retry_after)
+        except QueueFull as e:
+            await send_json(send_and_record, queue_full_body(e), 503, [(b'retry-after', str(int(e.eta) + 1).encode('ascii'))])
+        except Exception as e:
+            await send_json(send_and_record, {'error': f'Server error: {str(e)}'}, 500)
+        finally:
+            if ticket is not None:
+                admission.release(ticket)
+    if profile is not None:
+        await asyncio.to_thread(profiler.finish, profile, status.get('code', 500))
+    metrics.HTTP_DURATION.labels(endpoint).observe(time.perf_counter() - started)
+    metrics.HTTP_REQUESTS.labels(endpoint, scope['method'], status.get('code', 500)).inc()
@@ -0,0 +1,174 @@
+"""Content-hashed, precompressed static assets.
+
+Run ``python assets.py`` as a build step to write hashed copies of the
+files in static/ (plus .gz and, with the optional brotli package, .br
+variants) and a manifest to static/dist/. When no manifest exists, the app
+builds the same bundle in memory at startup instead of writing to disk.
+"""
+import os
+import sys
+import gzip
+import json
+import hashlib
+import mimetypes
+
+try:
+    import brotli
+except ImportError:  # Optional: only gzip variants are produced without it
+    brotli = None
+
+DIST_DIRNAME = 'dist'
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt', '.map')
+MIN_COMPRESS_BYTES = 256
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def hashed_name(name, data):
+    base, ext = os.path.splitext(name)
+    return f"{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def compress_variants(name, data):
+    """Return {encoding: bytes} for the encodings that actually make the file smaller"""
+    variants = {}
+    if not name.endswith(COMPRESSIBLE) or len(data) < MIN_COMPRESS_BYTES:
+        return variants
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        variants['gzip'] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            variants['br'] = compressed
+    return variants
+
+
+def source_files(source_dir):
+    """Relative names of the files under source_dir, skipping the build output"""
+    for directory, subdirectories, files in os.walk(source_dir):
+        if os.path.abspath(directory) == os.path.abspath(source_dir):
+            subdirectories[:] = [d for d in subdirectories if d != DIST_DIRNAME]
+        for filename in sorted(files):
+            path = os.path.join(directory, filename)
+            yield os.path.relpath(path, source_dir).replace(os.sep, '/')
+
+
+class Asset:
+    """One hashed file and its encoded variants, ready to be served"""
+
+    def __init__(self, name, body, variants):
+        self.name = name
+        self.body = body
+        self.variants = variants
+        self.etag = hashlib.sha256(body).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def encoded(self, accepted):
+        """Pick the smallest variant the client accepts, returning (encoding or None, body)"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                return encoding, self.variants[encoding]
+        return None, self.body
+
+
+class AssetBundle:
+    """Maps logical static file names to hashed names and holds the bodies to serve"""
+
+    def __init__(self, manifest=None, assets=None):
+        self.manifest = manifest or {}
+        self.assets = assets or {}
+
+    @classmethod
+    def build(cls, source_dir):
+        """Hash and compress every file under source_dir in memory"""
+        manifest = {}
+        assets = {}
+        for name in source_files(source_dir):
+            with open(os.path.join(source_dir, name), 'rb') as f:
+                data = f.read()
+            hashed = hashed_name(name, data)
+            manifest[name] = hashed
+            assets[hashed] = Asset(hashed, data, compress_variants(name, data))
+        return cls(manifest, assets)
+
+    @classmethod
+    def load(cls, source_dir):
+        """Load the bundle written by `python assets.py`, or build it in memory if there is none"""
+        dist_dir = os.path.join(source_dir, DIST_DIRNAME)
+        try:
+            with open(os.path.join(dist_dir, MANIFEST_NAME), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return cls.build(source_dir)
+
+        # Sources edited since the last build win over stale build output
+        current = {}
+        for name in source_files(source_dir):
+            with open(os.path.join(source_dir, name), 'rb') as f:
+                current[name] = hashed_name(name, f.read())
+        if current and current != manifest:
+            return cls.build(source_dir)
+
+        assets = {}
+        for hashed in manifest.values():
+            try:
+                with open(os.path.join(dist_dir, hashed), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                return cls.build(source_dir)  # Incomplete build output
+            variants = {}
+            for encoding, suffix in ENCODING_SUFFIXES.items():
+                try:
+                    with open(os.path.join(dist_dir, hashed + suffix), 'rb') as f:
+                        variants[encoding] = f.read()
+                except OSError:
+                    pass
+            assets[hashed] = Asset(hashed, body, variants)
+        return cls(manifest, assets)
+
+    def hashed(self, name):
+        return self.manifest.get(name)
+
+    def get(self, hashed):
+        return self.assets.get(hashed)
+
+    def write(self, dist_dir):
+        """Write the bundle and its manifest to dist_dir, removing files from earlier builds"""
+        os.makedirs(dist_dir, exist_ok=True)
+        keep = {MANIFEST_NAME}
+        for hashed, asset in self.assets.items():
+            outputs = {hashed: asset.body}
+            for encoding, body in asset.variants.items():
+                outputs[hashed + ENCODING_SUFFIXES[encoding]] = body
+            for filename, body in outputs.items():
+                path = os.path.join(dist_dir, filename)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(body)
+                keep.add(filename.replace('/', os.sep))
+        with open(os.path.join(dist_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+
+        for directory, _, files in os.walk(dist_dir):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                if os.path.relpath(path, dist_dir) not in keep:
+                    os.remove(path)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    source_dir = argv[0] if argv else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    bundle = AssetBundle.build(source_dir)
+    bundle.write(os.path.join(source_dir, DIST_DIRNAME))
+    for name, hashed in sorted(bundle.manifest.items()):
+        asset = bundle.get(hashed)
+        sizes = ', '.join(f"{encoding} {len(body)}" for encoding, body in sorted(asset.variants.items()))
+        print(f"{name} -> {hashed} ({len(asset.body)} bytes{', ' + sizes if sizes else ''})")
+    if brotli is None:
+        print("brotli is not installed; only gzip variants were written")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Local stand-in for the Gemini generateContent API, for benchmarks.
+
+Answers ``:generateContent`` and ``:streamGenerateContent`` (SSE) with the
+code from the prompt, after a configurable latency, and can be told to
+fail a share of requests with 429 or 500.
+
+    python bench/fake_gemini.py --port 8765 --latency lognormal:300:0.5 --rate-429 0.05
+
+Point the app at it with
+``GEMINI_API_URL=http://127.0.0.1:8765/v1beta/models/fake:generateContent``.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CODE_MARKERS = ('Only return the fixed version of this part:\n', 'Code:\n')
+
+
+def parse_latency(spec):
+    """Turn 'fixed:MS', 'uniform:LOW:HIGH', 'normal:MEAN:STDDEV' or 'lognormal:MEDIAN:SIGMA' into a sampler (seconds)"""
+    kind, *args = spec.split(':')
+    args = [float(arg) for arg in args]
+    if kind == 'fixed':
+        return lambda: args[0] / 1000.0
+    if kind == 'uniform':
+        return lambda: random.uniform(args[0], args[1]) / 1000.0
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(args[0], args[1])) / 1000.0
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(0, args[1]) * args[0] / 1000.0
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+def completion_for(prompt, structured=False):
+    """Pretend to fix the code in the prompt by returning it unchanged"""
+    code = prompt.split('\n', 1)[-1]
+    for marker in CODE_MARKERS:
+        if marker in prompt:
+            code = prompt.rsplit(marker, 1)[1]
+            break
+    if structured:
+        return json.dumps({'fixed_code': code, 'explanation': 'The code was already correct.'})
+    return code
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+    stats = None
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def _empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._empty(404)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.lock:
+                body = json.dumps(self.stats).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self._empty(404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        self._count('requests')
+
+        roll = random.random()
+        if roll < self.config.rate_429:
+            self._count('rate_limited')
+            return self._empty(429)
+        if roll < self.config.rate_429 + self.config.error_rate:
+            self._count('errors')
+            return self._empty(500)
+
+        prompt = body['contents'][0]['parts'][0]['text']
+        structured = body.get('generationConfig', {}).get('responseMimeType') == 'application/json'
+        text = completion_for(prompt, structured)
+        delay = self.config.sample_latency()
+
+        if ':streamGenerateContent' in self.path:
+            return self._stream(text, delay)
+
+        time.sleep(delay)
+        out = json.dumps({
+            'candidates': [{'content': {'parts': [{'text': text}]}}],
+            'usageMetadata': {'promptTokenCount': len(prompt) // 4, 'candidatesTokenCount': len(text) // 4}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _stream(self, text, delay):
+        """Send the first chunk after a share of the latency and spread the rest over the remainder"""
+        size = self.config.stream_chunk_chars
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+        first_byte = delay * self.config.stream_ttfb_share
+        gap = (delay - first_byte) / max(1, len(chunks) - 1)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        time.sleep(first_byte)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(gap)
+            event = ('data: ' + json.dumps({'candidates': [{'content': {'parts': [{'text': chunk}]}}]}) + '\r\n\r\n').encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', default='lognormal:300:0.4', help="fixed:MS, uniform:LOW:HIGH, normal:MEAN:STDDEV or lognormal:MEDIAN:SIGMA")
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 500')
+    parser.add_argument('--stream-chunk-chars', type=int, default=40, help='Characters per streamed chunk')
+    parser.add_argument('--stream-ttfb-share', type=float, default=0.3, help='Share of the latency spent before the first streamed chunk')
+    parser.add_argument('--seed', type=int, default=None)
+    return parser
+
+
+def main(argv=None):
+    config = build_parser().parse_args(argv)
+    config.sample_latency = parse_latency(config.latency)
+    if config.seed is not None:
+        random.seed(config.seed)
+    FakeGeminiHandler.config = config
+    FakeGeminiHandler.stats = {}
+    server = FakeGeminiServer((config.host, config.port), FakeGeminiHandler)
+    print(f"fake Gemini listening on http://{config.host}:{config.port}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
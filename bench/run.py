@@ -0,0 +1,288 @@
+"""Load-test the API against the local Gemini stand-in and record the results.
+
+Each scenario starts a fresh fake Gemini server and a fresh app server
+pointed at it, drives one endpoint at a fixed concurrency, and reports
+throughput, latency percentiles and the app's memory use.
+
+    python bench/run.py                                # every scenario
+    python bench/run.py fix_c16 explain_c16 --duration 30
+    python bench/run.py --server asgi --compare bench/results/20240101-120000.json
+
+Results are written to bench/results/<timestamp>.json.
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import argparse
+import itertools
+import platform
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+# Shared across drivers so warm-up and measured requests never repeat a payload
+request_numbers = itertools.count(1)
+
+SCENARIOS = {
+    'fix_c1': {'endpoint': '/api/fix_code', 'concurrency': 1},
+    'fix_c16': {'endpoint': '/api/fix_code', 'concurrency': 16},
+    'fix_c64': {'endpoint': '/api/fix_code', 'concurrency': 64},
+    'explain_c16': {'endpoint': '/api/explain_changes', 'concurrency': 16},
+    'stream_c16': {'endpoint': '/api/fix_code/stream', 'concurrency': 16},
+    'fix_c16_429': {'endpoint': '/api/fix_code', 'concurrency': 16, 'fake': ['--rate-429', '0.1']},
+    'fix_c16_slow_tail': {'endpoint': '/api/fix_code', 'concurrency': 16, 'fake': ['--latency', 'lognormal:300:1.0']},
+    'fix_c16_hedged': {'endpoint': '/api/fix_code', 'concurrency': 16, 'fake': ['--latency', 'lognormal:300:1.0'], 'env': {'HEDGE_ENABLED': '1'}},
+}
+
+# Keep the app from answering out of its cache or pacing calls to a real quota
+APP_ENV = {
+    'GEMINI_API_KEY': 'bench',
+    'CACHE_ENABLED': '0',
+    'GEMINI_RPM': '0',
+    'PREANALYSIS_SKIP_CLEAN': '0',
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def server_command(server, port):
+    if server == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port), '--log-level', 'warning']
+    return [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads', '--no-reload', '--no-debugger']
+
+
+def memory_of(pid):
+    """Current and peak resident memory of a process in MB, or None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            fields = dict(line.split(':', 1) for line in status if ':' in line)
+    except OSError:
+        return None
+    return {
+        'rss_mb': round(int(fields['VmRSS'].split()[0]) / 1024, 1),
+        'peak_rss_mb': round(int(fields['VmHWM'].split()[0]) / 1024, 1),
+    }
+
+
+def sample_code(n):
+    """A small snippet with a bug, made unique so no layer can answer it from a cache"""
+    body = '\n'.join(f"    total += values[{i}] * {i}" for i in range(30))
+    return f"# request {n}\ndef score(values):\n    total = 0\n{body}\n    return totl\n"
+
+
+def payload_for(endpoint, n):
+    code = sample_code(n)
+    if endpoint.startswith('/api/explain_changes'):
+        return {'original_code': code, 'fixed_code': code.replace('return totl', 'return total')}
+    return {'code': code}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Driver:
+    """Keeps `concurrency` requests in flight against one endpoint until the deadline"""
+
+    def __init__(self, base_url, endpoint, concurrency):
+        self.url = base_url + endpoint
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.stream = endpoint.endswith('/stream')
+        self.latencies = []
+        self.first_byte = []
+        self.statuses = {}
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _record(self, latency, status, first_byte=None):
+        with self._lock:
+            self.latencies.append(latency)
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            if first_byte is not None:
+                self.first_byte.append(first_byte)
+            if status != 200:
+                self.failures += 1
+
+    def _worker(self, deadline):
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            payload = payload_for(self.endpoint, next(request_numbers))
+            started = time.perf_counter()
+            try:
+                response = session.post(self.url, json=payload, stream=self.stream, timeout=120)
+                first_byte = None
+                if self.stream:
+                    for chunk in response.iter_content(chunk_size=None):
+                        if first_byte is None and chunk:
+                            first_byte = time.perf_counter() - started
+                else:
+                    response.content
+                self._record(time.perf_counter() - started, response.status_code, first_byte)
+            except requests.exceptions.RequestException:
+                self._record(time.perf_counter() - started, 'connection_error')
+        session.close()
+
+    def run(self, duration):
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=self._worker, args=(deadline,), daemon=True) for _ in range(self.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def summarize(driver, elapsed):
+    latencies = sorted(driver.latencies)
+    result = {
+        'endpoint': driver.endpoint,
+        'concurrency': driver.concurrency,
+        'requests': len(latencies),
+        'failures': driver.failures,
+        'statuses': driver.statuses,
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+    for p in (50, 95, 99):
+        value = percentile(latencies, p)
+        result[f'p{p}_ms'] = round(value * 1000, 1) if value is not None else None
+    if driver.first_byte:
+        first_byte = sorted(driver.first_byte)
+        result['ttfb_p50_ms'] = round(percentile(first_byte, 50) * 1000, 1)
+        result['ttfb_p99_ms'] = round(percentile(first_byte, 99) * 1000, 1)
+    return result
+
+
+def run_scenario(name, scenario, args):
+    fake_port = free_port()
+    app_port = free_port()
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'bench', 'fake_gemini.py'), '--port', str(fake_port), '--latency', args.latency] + scenario.get('fake', []),
+        cwd=ROOT, stderr=subprocess.DEVNULL
+    )
+    env = dict(os.environ, **APP_ENV)
+    env['GEMINI_API_URL'] = f"http://127.0.0.1:{fake_port}/v1beta/models/fake:generateContent"
+    env.update(scenario.get('env', {}))
+    app = subprocess.Popen(server_command(args.server, app_port), cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(f"http://127.0.0.1:{fake_port}/stats", fake)
+        wait_until_up(f"http://127.0.0.1:{app_port}/api/queue", app)
+        base_url = f"http://127.0.0.1:{app_port}"
+
+        if args.warmup:
+            Driver(base_url, scenario['endpoint'], scenario['concurrency']).run(args.warmup)
+        driver = Driver(base_url, scenario['endpoint'], scenario['concurrency'])
+        elapsed = driver.run(args.duration)
+
+        result = summarize(driver, elapsed)
+        result['memory'] = memory_of(app.pid)
+        result['upstream'] = requests.get(f"http://127.0.0.1:{fake_port}/stats", timeout=5).json()
+        return result
+    finally:
+        for process in (app, fake):
+            process.terminate()
+        for process in (app, fake):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(name, result, baseline=None):
+    line = (f"{name:<20} {result['rps']:>8.1f} rps  p50 {result['p50_ms']}ms  p95 {result['p95_ms']}ms  "
+            f"p99 {result['p99_ms']}ms  failures {result['failures']}/{result['requests']}")
+    if result.get('memory'):
+        line += f"  rss {result['memory']['rss_mb']}MB"
+    if baseline:
+        def change(key):
+            before, after = baseline.get(key), result.get(key)
+            if not before or after is None:
+                return 'n/a'
+            return f"{(after - before) / before * 100:+.1f}%"
+        line += f"  [vs baseline: rps {change('rps')}, p99 {change('p99_ms')}]"
+    print(line, flush=True)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask', help='How to serve the app')
+    parser.add_argument('--duration', type=float, default=15, help='Seconds of measured load per scenario')
+    parser.add_argument('--warmup', type=float, default=2, help='Seconds of unmeasured load before each scenario')
+    parser.add_argument('--latency', default='lognormal:300:0.4', help='Default fake upstream latency distribution')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    parser.add_argument('--output', help='Where to write the results (default: bench/results/<timestamp>.json)')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"unknown scenario(s): {', '.join(unknown)}")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f).get('scenarios', {})
+
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'server': args.server,
+        'python': platform.python_version(),
+        'duration': args.duration,
+        'latency': args.latency,
+        'scenarios': {},
+    }
+    for name in names:
+        result = run_scenario(name, SCENARIOS[name], args)
+        report['scenarios'][name] = result
+        print_result(name, result, baseline.get(name))
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# A hit refreshes a row's accessed_at only when the stored value is older than this,
+# so repeated reads of a hot key do not each take the database write lock
+TOUCH_INTERVAL_SECONDS = 60
+
+# The size cap is checked once this fraction of it has been written by this process,
+# rather than summing every row on every write
+EVICT_CHECK_FRACTION = 1 / 16
+
+
+def make_cache_key(model_url, prompt):
+    """Build a content-addressed key from the model URL and prompt text"""
+    digest = hashlib.sha256()
+    digest.update(model_url.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class MemoryTier:
+    """In-process LRU tier with per-entry expiry"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """Persistent tier shared by every worker process on the host"""
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._ready = False
+        self._init_lock = threading.Lock()
+        self._written = 0
+        self._written_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS results (
+                            key TEXT PRIMARY KEY,
+                            value TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            expires_at REAL NOT NULL,
+                            accessed_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)')
+                    self._ready = True
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value, expires_at, accessed_at FROM results WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        if expires_at < now:
+            conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            return None
+        if accessed_at < now - TOUCH_INTERVAL_SECONDS:
+            conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (now, key))
+        return value, expires_at
+
+    def set(self, key, value, expires_at):
+        conn = self._connect()
+        size = len(value.encode('utf-8'))
+        conn.execute(
+            'INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+            (key, value, size, expires_at, time.time())
+        )
+        with self._written_lock:
+            self._written += size
+            due = self._written >= self.max_bytes * EVICT_CHECK_FRACTION
+            if due:
+                self._written = 0
+        if due:
+            self._evict(conn)
+
+    def _evict(self, conn):
+        conn.execute('DELETE FROM results WHERE expires_at < ?', (time.time(),))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used rows until we are back under the size cap
+        excess = total - self.max_bytes
+        freed = 0
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY accessed_at').fetchall():
+            conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            freed += size
+            if freed >= excess:
+                break
+
+    def clear(self):
+        self._connect().execute('DELETE FROM results')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+
+class ResultCache:
+    """Two-tier (memory LRU + SQLite) cache for model completions"""
+
+    def __init__(self, path, ttl=24 * 3600, max_memory_entries=512, max_disk_bytes=256 * 1024 * 1024, enabled=True):
+        self.ttl = ttl
+        self.enabled = enabled
+        self.memory = MemoryTier(max_memory_entries)
+        self.disk = SQLiteTier(path, max_disk_bytes) if path else None
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+        if self.disk is not None:
+            try:
+                row = self.disk.get(key)
+            except sqlite3.Error:
+                row = None
+                self._count('errors')
+            if row is not None:
+                value, expires_at = row
+                self.memory.set(key, value, expires_at)
+                self._count('disk_hits')
+                return value
+        self._count('misses')
+        return None
+
+    def peek(self, key):
+        """Look a key up in both tiers without touching the hit/miss counters"""
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            try:
+                row = self.disk.get(key)
+            except sqlite3.Error:
+                row = None
+            value = row[0] if row is not None else None
+        return value
+
+    def set(self, key, value, ttl=None):
+        if not self.enabled:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self.memory.set(key, value, expires_at)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, expires_at)
+            except sqlite3.Error:
+                self._count('errors')
+        self._count('stores')
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hits'] = hits
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        stats['memory_entries'] = len(self.memory)
+        stats['enabled'] = self.enabled
+        return stats
@@ -0,0 +1,184 @@
+import re
+import ast
+
+IMPORT_PATTERN = re.compile(r'^\s*(import\s|from\s+\S+\s+import\s|#include\s|using\s|package\s|require\(|const\s+\w+\s*=\s*require\()')
+FENCE_PATTERN = re.compile(r'^\s*```[\w+-]*\s*\n(.*?)\n?\s*```\s*$', re.DOTALL)
+
+
+def detect_language(code):
+    """Best-effort guess of how to split the code: 'python', 'brace' or 'indent'"""
+    try:
+        ast.parse(code)
+        return 'python'
+    except (SyntaxError, ValueError):
+        pass
+    if code.count('{') >= 2 and abs(code.count('{') - code.count('}')) <= max(2, code.count('{') // 10):
+        return 'brace'
+    if re.search(r'^\s*(def|class|async\s+def)\s+\w+', code, re.MULTILINE):
+        return 'python'
+    return 'indent'
+
+
+def python_units(lines):
+    """Split Python source into top-level statement ranges using the AST.
+
+    Comments and blank lines above a definition stay with it. Returns None
+    when the code does not parse.
+    """
+    try:
+        tree = ast.parse(''.join(lines))
+    except (SyntaxError, ValueError):
+        return None
+
+    starts = []
+    for node in tree.body:
+        start = node.lineno
+        for decorator in getattr(node, 'decorator_list', []):
+            start = min(start, decorator.lineno)
+        starts.append(start - 1)
+
+    if not starts:
+        return [(0, len(lines))]
+
+    # Keep comment lines directly above a statement with that statement
+    boundaries = []
+    previous_end = 0
+    for node, start in zip(tree.body, starts):
+        while start > previous_end and lines[start - 1].lstrip().startswith('#'):
+            start -= 1
+        boundaries.append(max(start, previous_end))
+        previous_end = node.end_lineno
+
+    boundaries[0] = 0
+    boundaries.append(len(lines))
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1) if boundaries[i] < boundaries[i + 1]]
+
+
+def brace_units(lines):
+    """Split brace-delimited source wherever nesting depth returns to zero"""
+    units = []
+    depth = 0
+    start = 0
+    in_block_comment = False
+    for index, line in enumerate(lines):
+        stripped = re.sub(r'"(\\.|[^"\\])*"|\'(\\.|[^\'\\])*\'', '""', line)
+        if in_block_comment:
+            if '*/' not in stripped:
+                continue
+            stripped = stripped.split('*/', 1)[1]
+            in_block_comment = False
+        stripped = stripped.split('//', 1)[0]
+        if '/*' in stripped:
+            before, _, after = stripped.partition('/*')
+            stripped = before
+            in_block_comment = '*/' not in after
+        opened = stripped.count('{')
+        closed = stripped.count('}')
+        depth = max(depth + opened - closed, 0)
+        if depth == 0 and closed and index + 1 > start:
+            units.append((start, index + 1))
+            start = index + 1
+    if start < len(lines):
+        units.append((start, len(lines)))
+    return units
+
+
+def indent_units(lines):
+    """Split source at lines that return to column zero after an indented block"""
+    units = []
+    start = 0
+    saw_indented = False
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        if line[0] in ' \t':
+            saw_indented = True
+        elif saw_indented and index > start:
+            units.append((start, index))
+            start = index
+            saw_indented = False
+    units.append((start, len(lines)))
+    return units
+
+
+def group_units(units, max_lines):
+    """Merge adjacent units into chunks of at most max_lines (a single larger unit stays whole)"""
+    chunks = []
+    current_start = current_end = None
+    for start, end in units:
+        if current_start is None:
+            current_start, current_end = start, end
+        elif end - current_start <= max_lines:
+            current_end = end
+        else:
+            chunks.append((current_start, current_end))
+            current_start, current_end = start, end
+    if current_start is not None:
+        chunks.append((current_start, current_end))
+    return chunks
+
+
+def shared_context(lines, units, language):
+    """Collect imports and top-level signatures so each chunk knows about the rest of the file"""
+    context = []
+    for line in lines:
+        if IMPORT_PATTERN.match(line):
+            context.append(line.rstrip())
+    for start, end in units:
+        for line in lines[start:end]:
+            stripped = line.strip()
+            if not stripped or stripped.startswith(('#', '//', '/*', '*', '@')) or IMPORT_PATTERN.match(line):
+                continue
+            if language == 'python' and not stripped.startswith(('def ', 'async def ', 'class ')):
+                break
+            context.append(line.rstrip().rstrip('{').rstrip())
+            break
+    return '\n'.join(dict.fromkeys(context))
+
+
+def split_units(code):
+    """Return (lines, units, language) where units are top-level [start, end) line ranges"""
+    lines = code.splitlines(keepends=True)
+    language = detect_language(code)
+
+    units = None
+    if language == 'python':
+        units = python_units(lines)
+    if units is None:
+        units = brace_units(lines) if language == 'brace' else indent_units(lines)
+    return lines, units, language
+
+
+def split_code(code, max_lines=200):
+    """Split code into chunks at top-level boundaries.
+
+    Returns (chunks, context): the chunk texts, which join back to the
+    original code exactly, and the shared context string for prompts.
+    """
+    lines, units, language = split_units(code)
+
+    chunks = []
+    for start, end in group_units(units, max_lines):
+        text = ''.join(lines[start:end])
+        if chunks and not text.strip():
+            chunks[-1] += text  # Don't send trailing blank lines upstream on their own
+        else:
+            chunks.append(text)
+    return chunks, shared_context(lines, units, language)
+
+
+def strip_code_fences(text):
+    """Remove a surrounding Markdown code fence from a model reply"""
+    match = FENCE_PATTERN.match(text)
+    return match.group(1) if match else text
+
+
+def reassemble(original_chunks, fixed_chunks):
+    """Join fixed chunks, keeping the original line separation between them"""
+    parts = []
+    for original, fixed in zip(original_chunks, fixed_chunks):
+        fixed = strip_code_fences(fixed)
+        if original.endswith('\n') and not fixed.endswith('\n'):
+            fixed += '\n'
+        parts.append(fixed)
+    return ''.join(parts)
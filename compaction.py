@@ -0,0 +1,252 @@
+import io
+import re
+import ast
+import tokenize
+
+from chunking import detect_language, strip_code_fences
+from diffing import diff_opcodes
+
+MARKER_PATTERN = re.compile(r'\[\[stark:(\d+)\]\]')
+LICENSE_PATTERN = re.compile(r'licen[cs]e|copyright|\(c\)|spdx|all rights reserved', re.IGNORECASE)
+PREPROCESSOR_PATTERN = re.compile(r'^\s*#\s*(include|define|undef|if|ifdef|ifndef|elif|else|endif|pragma|error|import)\b')
+SPECIAL_COMMENT_PATTERN = re.compile(r'^#!|^#.*coding[:=]')
+MARKER_SLOT = '[[stark:?]]'
+MAX_BLANK_RUN = 2
+MARKER_NOTE = "Lines containing a [[stark:N]] marker stand for omitted comments or data; keep them unchanged."
+
+
+def estimate_tokens(text):
+    """Rough token count for prompt text (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+
+class Compaction:
+    """Source with non-semantic content replaced, and the mapping needed to put it back.
+
+    `text` is what goes into the prompt. Each compacted line remembers the
+    original text it stands for, and `blocks` maps marker numbers to the
+    content a placeholder line replaced.
+    """
+
+    def __init__(self, original, lines=None, sources=None, blocks=None, header=None):
+        self.original = original
+        self.lines = lines if lines is not None else original.splitlines(keepends=True)
+        self.sources = sources if sources is not None else list(self.lines)
+        self.blocks = blocks or {}
+        self.header = header
+        self.text = ''.join(self.lines)
+
+    @property
+    def compacted(self):
+        return self.text != self.original
+
+    @property
+    def tokens_saved(self):
+        return max(0, estimate_tokens(self.original) - estimate_tokens(self.text))
+
+    def line_number(self, original_line):
+        """Line of the compacted text holding 1-based line `original_line` of the original"""
+        position = 0
+        for index, source in enumerate(self.sources):
+            position += len(source.splitlines()) or 1
+            if position >= original_line:
+                return index + 1
+        return len(self.sources)
+
+    def restore(self, fixed):
+        """Put the omitted content back into the model's version of the compacted text.
+
+        Returns None when the model dropped a placeholder, other than a license
+        header (which is put back at the top), so that nothing it stood for is lost.
+        """
+        if not self.compacted:
+            return fixed
+        fixed_lines = strip_code_fences(fixed).splitlines(keepends=True)
+        out = []
+        seen = set()
+        for tag, i1, i2, j1, j2 in diff_opcodes(self.lines, fixed_lines):
+            if tag == 'equal':
+                out.extend(self.sources[i1:i2])
+                seen.update(self._markers(self.lines[i1:i2]))
+                continue
+            for line in fixed_lines[j1:j2]:
+                match = MARKER_PATTERN.search(line)
+                number = int(match.group(1)) if match else None
+                if number in self.blocks:
+                    out.append(self.blocks[number])
+                    seen.add(number)
+                else:
+                    out.append(line)
+        if any(number not in seen for number in self.blocks if number != self.header):
+            return None
+        # A license header the model dropped is put back at the top, below any shebang or coding line
+        if self.header is not None and self.header not in seen:
+            position = 0
+            while position < min(2, len(out)) and SPECIAL_COMMENT_PATTERN.match(out[position]):
+                position += 1
+            out.insert(position, self.blocks[self.header])
+        return ''.join(out)
+
+    def _markers(self, lines):
+        for line in lines:
+            match = MARKER_PATTERN.search(line)
+            if match:
+                yield int(match.group(1))
+
+
+def python_regions(code):
+    """Return (comment-only line numbers, line numbers inside multi-line strings) for Python source"""
+    comments = set()
+    string_lines = set()
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.COMMENT and token.line.strip().startswith('#'):
+                comments.add(token.start[0] - 1)
+            elif token.type == tokenize.STRING and token.end[0] > token.start[0]:
+                string_lines.update(range(token.start[0], token.end[0]))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return None
+    return comments, string_lines
+
+
+def brace_comments(lines):
+    """Line numbers holding only // or /* */ comments"""
+    comments = set()
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if stripped.startswith('//'):
+            comments.add(i)
+        elif stripped.startswith('/*'):
+            end = i
+            while end < len(lines) and '*/' not in lines[end]:
+                end += 1
+            if end < len(lines) and lines[end].rstrip().endswith('*/'):
+                comments.update(range(i, end + 1))
+                i = end
+        i += 1
+    return comments
+
+
+def python_literals(code, lines, min_lines):
+    """Find assignments of large pure-data literals, as {start: (end, placeholder line)}"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return {}
+    literals = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.Assign, ast.AnnAssign)) or node.value is None:
+            continue
+        value = node.value
+        if node.end_lineno - node.lineno + 1 < min_lines or value.lineno != node.lineno:
+            continue
+        if not isinstance(value, (ast.List, ast.Tuple, ast.Dict, ast.Set, ast.Constant)):
+            continue
+        try:
+            ast.literal_eval(value)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            continue
+        first, last = lines[node.lineno - 1], lines[node.end_lineno - 1]
+        if first[:node.col_offset].strip() or last[node.end_col_offset:].strip():
+            continue
+        segment = ast.get_source_segment(code, value) or ''
+        if segment[:1] in '([{' and segment:
+            stand_in = segment[0] + '...' + segment[-1]
+        else:
+            stand_in = "'...'"
+        head = first[:value.col_offset]
+        count = node.end_lineno - node.lineno + 1
+        literals[node.lineno - 1] = (node.end_lineno, f"{head}{stand_in}  # {MARKER_SLOT} data literal ({count} lines) omitted")
+    return literals
+
+
+def line_ending(line):
+    return line[len(line.rstrip('\r\n')):] or '\n'
+
+
+def compact(code, language=None, min_comment_lines=4, min_literal_lines=12):
+    """Strip license headers, long comment blocks, blank runs and large data literals from code.
+
+    Returns a Compaction whose restore() turns the fixed version of the
+    compacted text back into full source.
+    """
+    lines = code.splitlines(keepends=True)
+    if language not in ('python', 'brace', 'indent'):
+        language = detect_language(code)
+    prefix = '//' if language == 'brace' else '#'
+
+    literals = {}
+    string_lines = set()
+    if language == 'brace':
+        comments = brace_comments(lines)
+    else:
+        regions = python_regions(code) if language == 'python' else None
+        if regions is not None:
+            comments, string_lines = regions
+            literals = python_literals(code, lines, min_literal_lines)
+        else:
+            comments = brace_comments(lines) | {
+                i for i, line in enumerate(lines)
+                if line.lstrip().startswith('#') and not PREPROCESSOR_PATTERN.match(line)
+            }
+    comments = {i for i in comments if i not in string_lines and not (i < 2 and SPECIAL_COMMENT_PATTERN.match(lines[i].strip()))}
+
+    first_content = next((i for i, line in enumerate(lines) if line.strip() and not (i < 2 and SPECIAL_COMMENT_PATTERN.match(line.strip()))), None)
+    out = []
+    sources = []
+    blocks = {}
+    header = None
+
+    def placeholder(template, original):
+        number = len(blocks)
+        blocks[number] = original
+        out.append(template.replace(MARKER_SLOT, f"[[stark:{number}]]"))
+        sources.append(original)
+        return number
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if i in literals:
+            end, text = literals[i]
+            placeholder(text + line_ending(lines[end - 1]), ''.join(lines[i:end]))
+            i = end
+            continue
+
+        if i in comments:
+            j = i
+            while j in comments:
+                j += 1
+            block = ''.join(lines[i:j])
+            is_license = i == first_content and j - i >= 2 and LICENSE_PATTERN.search(block)
+            if is_license or j - i >= min_comment_lines:
+                indent = line[:len(line) - len(line.lstrip())]
+                kind = 'license header' if is_license else 'comment'
+                number = placeholder(f"{indent}{prefix} {MARKER_SLOT} {kind} ({j - i} lines) omitted{line_ending(lines[j - 1])}", block)
+                if is_license:
+                    header = number
+            else:
+                out.extend(lines[i:j])
+                sources.extend(lines[i:j])
+            i = j
+            continue
+
+        if not line.strip() and i not in string_lines:
+            j = i
+            while j < len(lines) and not lines[j].strip() and j not in string_lines:
+                j += 1
+            if j - i > MAX_BLANK_RUN:
+                out.append(line_ending(lines[j - 1]))
+                sources.append(''.join(lines[i:j]))
+            else:
+                out.extend(lines[i:j])
+                sources.extend(lines[i:j])
+            i = j
+            continue
+
+        out.append(line)
+        sources.append(line)
+        i += 1
+
+    return Compaction(code, out, sources, blocks, header)
@@ -0,0 +1,210 @@
+import re
+import difflib
+
+TOKEN_PATTERN = re.compile(r'\w+|\s+|[^\w\s]')
+
+
+def _match_region(a, b, alo, ahi, blo, bhi, matches):
+    """Append matching (i, j) line pairs between a[alo:ahi] and b[blo:bhi] to matches"""
+    # Common prefix and suffix match trivially
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+    suffix = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append((ahi, bhi))
+
+    if alo < ahi and blo < bhi:
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            # Recurse between consecutive anchors
+            previous_i, previous_j = alo, blo
+            for i, j in anchors:
+                _match_region(a, b, previous_i, i, previous_j, j, matches)
+                matches.append((i, j))
+                previous_i, previous_j = i + 1, j + 1
+            _match_region(a, b, previous_i, ahi, previous_j, bhi, matches)
+        else:
+            # No unique lines to anchor on; fall back to difflib for this region
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for block in matcher.get_matching_blocks():
+                for k in range(block.size):
+                    matches.append((alo + block.a + k, blo + block.b + k))
+
+    matches.extend(reversed(suffix))
+
+
+def _unique_anchors(a, b, alo, ahi, blo, bhi):
+    """Lines occurring exactly once on both sides, reduced to their longest increasing run (patience sorting)"""
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.setdefault(a[i], [0, 0, i, None])
+        entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry[3] = j
+    pairs = sorted((entry[2], entry[3]) for entry in counts.values() if entry[0] == 1 and entry[1] == 1)
+    if not pairs:
+        return []
+
+    # Longest increasing subsequence of the b indexes
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < j:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo > 0:
+            previous[index] = tail_indexes[lo - 1]
+        if lo == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[lo] = j
+            tail_indexes[lo] = index
+
+    result = []
+    index = tail_indexes[-1]
+    while index is not None:
+        result.append(pairs[index])
+        index = previous[index]
+    result.reverse()
+    return result
+
+
+def diff_opcodes(a, b):
+    """Patience diff of two line lists, returned as difflib-style (tag, i1, i2, j1, j2) opcodes"""
+    matches = []
+    _match_region(a, b, 0, len(a), 0, len(b), matches)
+    matches.append((len(a), len(b)))
+
+    opcodes = []
+    i = j = 0
+    for mi, mj in matches:
+        if mi > i and mj > j:
+            opcodes.append(('replace', i, mi, j, mj))
+        elif mi > i:
+            opcodes.append(('delete', i, mi, j, j))
+        elif mj > j:
+            opcodes.append(('insert', i, i, j, mj))
+        if mi < len(a):
+            if opcodes and opcodes[-1][0] == 'equal' and opcodes[-1][2] == mi:
+                tag, i1, _, j1, _ = opcodes[-1]
+                opcodes[-1] = ('equal', i1, mi + 1, j1, mj + 1)
+            else:
+                opcodes.append(('equal', mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return opcodes
+
+
+def group_opcodes(opcodes, context=3):
+    """Split opcodes into hunks with `context` unchanged lines around each change"""
+    if not opcodes or all(tag == 'equal' for tag, *_ in opcodes):
+        return []
+    opcodes = list(opcodes)
+    if opcodes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[0]
+        opcodes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if opcodes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        opcodes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+    groups = []
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        groups.append(group)
+    return groups
+
+
+def _hunk_range(start, length):
+    """Format one side of a hunk header the way diff(1) does"""
+    if length == 1:
+        return str(start + 1)
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def token_edits(old_line, new_line):
+    """Token-level edits between two versions of a line as [tag, old_text, new_text] triples"""
+    old_tokens = TOKEN_PATTERN.findall(old_line)
+    new_tokens = TOKEN_PATTERN.findall(new_line)
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    return [
+        [tag, ''.join(old_tokens[i1:i2]), ''.join(new_tokens[j1:j2])]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+class Diff:
+    """Line diff between an original and a fixed version, computed once and rendered as needed"""
+
+    def __init__(self, original, fixed, context=3):
+        self.old_lines = original.splitlines()
+        self.new_lines = fixed.splitlines()
+        self.context = context
+        self.groups = group_opcodes(diff_opcodes(self.old_lines, self.new_lines), context)
+
+    @property
+    def changed(self):
+        return bool(self.groups)
+
+    def unified(self, fromfile='original', tofile='fixed'):
+        """Render the diff in unified format"""
+        if not self.groups:
+            return ''
+        out = [f"--- {fromfile}", f"+++ {tofile}"]
+        for hunk in self.hunks():
+            out.append(hunk['header'])
+            out.extend(hunk['lines'])
+        return '\n'.join(out) + '\n'
+
+    def hunks(self):
+        """Structured hunks with token-level edits for lines that were modified in place"""
+        hunks = []
+        for group in self.groups:
+            i1, i2 = group[0][1], group[-1][2]
+            j1, j2 = group[0][3], group[-1][4]
+            lines = []
+            inline = []
+            for tag, a1, a2, b1, b2 in group:
+                if tag == 'equal':
+                    lines.extend(' ' + line for line in self.old_lines[a1:a2])
+                    continue
+                lines.extend('-' + line for line in self.old_lines[a1:a2])
+                lines.extend('+' + line for line in self.new_lines[b1:b2])
+                if tag == 'replace' and a2 - a1 == b2 - b1:
+                    for offset in range(a2 - a1):
+                        inline.append({
+                            'old_line': a1 + offset + 1,
+                            'new_line': b1 + offset + 1,
+                            'edits': token_edits(self.old_lines[a1 + offset], self.new_lines[b1 + offset]),
+                        })
+            hunks.append({
+                'header': f"@@ -{_hunk_range(i1, i2 - i1)} +{_hunk_range(j1, j2 - j1)} @@",
+                'old_start': i1 + 1,
+                'old_lines': i2 - i1,
+                'new_start': j1 + 1,
+                'new_lines': j2 - j1,
+                'lines': lines,
+                'inline': inline,
+            })
+        return hunks
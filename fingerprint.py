@@ -0,0 +1,393 @@
+"""Near-duplicate detection for fix requests.
+
+Code is reduced to a canonical token stream: comments, docstrings and
+formatting are dropped and, for Python, the names the code itself defines
+are numbered in order of first appearance. Two submissions with the same
+stream are the same program up to naming and layout, so a fix made for one
+can be replayed on the other: the fix is stored as token-level edits
+against the canonical stream and applied to the caller's own source, with
+their identifiers, comments and formatting kept.
+"""
+import io
+import re
+import difflib
+import hashlib
+import keyword
+import tokenize
+
+from chunking import detect_language
+
+# Structure tokens are prefixed with a byte no identifier or literal can start with
+NEWLINE = '\x01NEWLINE'
+INDENT = '\x01INDENT'
+DEDENT = '\x01DEDENT'
+
+# Names kept literally even when the code assigns them
+RESERVED_NAMES = {'self', 'cls'}
+
+ASSIGNMENT_OPERATORS = {'=', '+=', '-=', '*=', '/=', '//=', '%=', '**=', '@=', '&=', '|=', '^=', '>>=', '<<=', ':='}
+PLACEHOLDER = '\x00{}\x00'
+PLACEHOLDER_PATTERN = re.compile('\x00(\\d+)\x00')
+LINE_BREAK_PATTERN = re.compile(r'\r?\n')
+OPENING = {'(': ')', '[': ']', '{': '}'}
+
+BRACE_TOKEN_PATTERN = re.compile(r'''
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<number>\d[\w.]*)
+  | (?P<space>\s+)
+  | (?P<op>.)
+''', re.VERBOSE | re.DOTALL)
+
+
+class Token:
+    """A significant token: its canonical value, its text and the text (`gap`) since the previous one"""
+
+    __slots__ = ('value', 'text', 'gap', 'end', 'depth', 'name')
+
+    def __init__(self, value, text, gap, end, depth=0):
+        self.value = value
+        self.text = text
+        self.gap = gap
+        self.end = end
+        self.depth = depth
+        self.name = None
+
+
+def python_tokens(code):
+    """Tokenize Python source, or return None when it cannot be tokenized"""
+    offsets = [0]
+    for line in io.StringIO(code).readlines():
+        offsets.append(offsets[-1] + len(line))
+
+    def offset(position):
+        row, column = position
+        return offsets[row - 1] + column if row <= len(offsets) else len(code)
+
+    raw = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            raw.append(token)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return None
+
+    tokens = []
+    position = 0
+    depth = 0
+    docstring = False
+    for index, token in enumerate(raw):
+        kind = token.type
+        if kind in (tokenize.COMMENT, tokenize.NL, tokenize.ENDMARKER, tokenize.ENCODING):
+            continue
+        if kind == tokenize.STRING and is_docstring(raw, index):
+            docstring = True
+            continue
+        if kind == tokenize.NEWLINE and docstring:
+            docstring = False
+            continue
+        start, end = offset(token.start), offset(token.end)
+        if kind in (tokenize.INDENT, tokenize.DEDENT):
+            # Zero width at the start of the line, leaving its indentation to the next token
+            start = end = offset((token.start[0], 0))
+        if kind == tokenize.INDENT:
+            depth += 1
+        elif kind == tokenize.DEDENT:
+            depth -= 1
+        value = {tokenize.NEWLINE: NEWLINE, tokenize.INDENT: INDENT, tokenize.DEDENT: DEDENT}.get(kind, token.string)
+        tokens.append(Token(value, code[start:end], code[position:start], end, depth))
+        position = end
+    mark_python_names(tokens)
+    return tokens
+
+
+def is_docstring(raw, index):
+    """A string that is a statement of its own (docstrings and bare string expressions)"""
+    previous = index - 1
+    while previous >= 0 and raw[previous].type in (tokenize.COMMENT, tokenize.NL, tokenize.STRING):
+        previous -= 1
+    following = index + 1
+    while following < len(raw) and raw[following].type == tokenize.STRING:
+        following += 1
+    at_statement_start = previous < 0 or raw[previous].type in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT)
+    return at_statement_start and following < len(raw) and raw[following].type in (tokenize.NEWLINE, tokenize.ENDMARKER)
+
+
+def is_name(token):
+    return token.value.isidentifier() and not keyword.iskeyword(token.value)
+
+
+def mark_python_names(tokens):
+    """Set `name` on tokens that refer to a name the code defines.
+
+    Works from the token stream alone, so code that does not parse yet is
+    handled too: definitions, parameters, assignment, loop, `as` and walrus
+    targets count as defined. Attributes, dunders and self/cls stay literal.
+    """
+    defined = set()
+    depth = 0
+    statement_start = 0
+    in_parameters = None
+    in_lambda = False
+    for index, token in enumerate(tokens):
+        value = token.value
+        previous = tokens[index - 1].value if index else None
+        following = tokens[index + 1].value if index + 1 < len(tokens) else None
+
+        if value in (NEWLINE, INDENT, DEDENT):
+            statement_start = index + 1
+            continue
+        if value in OPENING:
+            depth += 1
+            continue
+        if value in (')', ']', '}'):
+            depth -= 1
+            if in_parameters is not None and depth < in_parameters:
+                in_parameters = None
+            continue
+        if value == 'lambda':
+            in_lambda = True
+            continue
+        if value == ':' and in_lambda:
+            in_lambda = False
+            continue
+        if not is_name(token) or previous == '.':
+            continue
+
+        if previous in ('def', 'class', 'as', 'for') or following == ':=':
+            defined.add(value)
+            if previous == 'def' and following == '(':
+                in_parameters = depth + 1
+        elif in_parameters == depth and previous in ('(', ',', '*', '**'):
+            defined.add(value)
+        elif in_lambda and previous in ('lambda', ',', '*', '**'):
+            defined.add(value)
+        elif previous == ',' and for_target(tokens, index):
+            defined.add(value)
+        elif depth == 0 and assignment_target(tokens, statement_start, index):
+            defined.add(value)
+
+    for token in tokens:
+        if is_name(token) and token.value in defined and token.value not in RESERVED_NAMES and not is_dunder(token.value):
+            token.name = token.value
+    for index, token in enumerate(tokens):
+        if index and tokens[index - 1].value == '.':
+            token.name = None
+
+
+def is_dunder(name):
+    return name.startswith('__') and name.endswith('__')
+
+
+def for_target(tokens, index):
+    """Whether a name after a comma is part of a `for a, b in` target list"""
+    for previous in range(index - 1, -1, -1):
+        value = tokens[previous].value
+        if value == 'for':
+            return True
+        if value != ',' and not is_name(tokens[previous]) and value not in ('(', ')', '[', ']'):
+            return False
+    return False
+
+
+def assignment_target(tokens, start, index):
+    """Whether a top-level name sits before the first assignment operator of its statement"""
+    if index + 1 < len(tokens) and tokens[index + 1].value in ('(', '[', '.'):
+        return False
+    depth = 0
+    for position in range(start, len(tokens)):
+        value = tokens[position].value
+        if value in (NEWLINE, INDENT, DEDENT):
+            return False
+        if value in OPENING:
+            depth += 1
+        elif value in (')', ']', '}'):
+            depth -= 1
+        elif depth == 0 and value == ':' and position < index:
+            return False  # The name is part of an annotation
+        elif depth == 0 and value in ASSIGNMENT_OPERATORS:
+            return position > index
+    return False
+
+
+def brace_tokens(code):
+    """Tokenize C-like source: comments and whitespace go, names stay literal"""
+    tokens = []
+    position = 0
+    for match in BRACE_TOKEN_PATTERN.finditer(code):
+        if match.lastgroup in ('comment', 'space'):
+            continue
+        tokens.append(Token(match.group(), match.group(), code[position:match.start()], match.end()))
+        position = match.end()
+    return tokens
+
+
+def tokenize_code(code, language):
+    if language == 'python':
+        return python_tokens(code)
+    if language == 'brace':
+        return brace_tokens(code)
+    return None
+
+
+def indent_unit(tokens):
+    """The whitespace of the first indented line"""
+    for index, token in enumerate(tokens[:-1]):
+        if token.value == INDENT:
+            return tokens[index + 1].gap.rpartition('\n')[2] or None
+    return None
+
+
+class Fingerprint:
+    """Canonical form of one submission, and the means to store and replay fixes against it"""
+
+    def __init__(self, code, language, tokens):
+        self.code = code
+        self.language = language
+        self.tokens = tokens
+        self.names = []
+        index = {}
+        for token in tokens:
+            if token.name is not None and token.name not in index:
+                index[token.name] = len(self.names)
+                self.names.append(token.name)
+        self.index = index
+        self.values = self.canonical(tokens)
+        digest = hashlib.sha256(language.encode('utf-8'))
+        for value in self.values:
+            digest.update(value.encode('utf-8', 'surrogatepass') + b'\0')
+        self.key = digest.hexdigest()
+
+    def canonical(self, tokens):
+        """Token values with this submission's names replaced by their numbers"""
+        return [f'\x00{self.index[token.value]}' if token.value in self.index and token.name is not None else token.value for token in tokens]
+
+    def _tokens(self, code):
+        tokens = tokenize_code(code, self.language)
+        if tokens is not None and self.language == 'python':
+            # Names of this submission keep their numbers wherever they appear in the fix
+            for index, token in enumerate(tokens):
+                if token.name is None and token.value in self.index and (not index or tokens[index - 1].value != '.'):
+                    token.name = token.value
+        return tokens
+
+    def template(self, fixed_code):
+        """Describe fixed_code as edits to this submission's canonical stream, or None if it cannot be.
+
+        Each edit replaces tokens [i1, i2) with [gap, text, value] entries
+        taken from the fix, where this submission's names are placeholders,
+        and, for edits that insert whole lines, the indentation the fix puts
+        before the next original token.
+        """
+        fixed_tokens = self._tokens(fixed_code)
+        if not fixed_tokens:
+            return None
+        fixed_values = self.canonical(fixed_tokens)
+        # Fixes are usually local, so only the middle that differs goes through the matcher
+        head = 0
+        limit = min(len(self.values), len(fixed_values))
+        while head < limit and self.values[head] == fixed_values[head]:
+            head += 1
+        tail = 0
+        while tail < limit - head and self.values[-1 - tail] == fixed_values[-1 - tail]:
+            tail += 1
+        matcher = difflib.SequenceMatcher(None, self.values[head:len(self.values) - tail], fixed_values[head:len(fixed_values) - tail], autojunk=False)
+        edits = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                continue
+            i1, i2, j1, j2 = i1 + head, i2 + head, j1 + head, j2 + head
+            entries = []
+            for token, value in zip(fixed_tokens[j1:j2], fixed_values[j1:j2]):
+                text = PLACEHOLDER.format(self.index[token.value]) if value != token.value else token.text
+                entries.append([token.gap, text, value])
+            after = None
+            if tag == 'insert' and (not j1 or fixed_values[j1 - 1] in (NEWLINE, INDENT, DEDENT) or '\n' in fixed_tokens[j1].gap):
+                # Only the indentation: lines above it belong to the caller
+                after = fixed_tokens[j2].gap.rpartition('\n')[2] if j2 < len(fixed_tokens) else ''
+            edits.append([i1, i2, entries, after])
+        return {'indent': indent_unit(fixed_tokens), 'edits': edits, 'fixed': fixed_values}
+
+    def apply(self, template):
+        """Replay a stored fix on this submission; None when the result does not check out"""
+        tokens = self.tokens
+
+        def restore_name(match):
+            index = int(match.group(1))
+            return self.names[index] if index < len(self.names) else match.group()
+
+        def restore(text):
+            text = PLACEHOLDER_PATTERN.sub(restore_name, text)
+            return LINE_BREAK_PATTERN.sub(newline, text) if newline != '\n' else text
+
+        def original(start, end):
+            for token in tokens[start:end]:
+                entries.append((token.gap, token.text, token.value, token.depth))
+
+        newline = '\r\n' if '\r\n' in self.code else '\n'
+        entries = []
+        position = 0
+        for i1, i2, replacement, after in template['edits']:
+            original(position, i1)
+            for k, (gap, text, value) in enumerate(replacement):
+                # The caller's own spacing and comments stay in front of replaced and inserted lines
+                keep = k == 0 and i1 < len(tokens) and (i1 < i2 or after is not None)
+                entries.append((tokens[i1].gap if keep else restore(gap), restore(text), value, None))
+            position = i2
+            if after is not None and i1 < len(tokens):
+                token = tokens[i1]
+                entries.append((restore(after), token.text, token.value, None))
+                position += 1
+        original(position, len(tokens))
+        unit = indent_unit(tokens) or template.get('indent') or '    '
+        result = self.render(entries, unit) + self.code[tokens[-1].end:]
+
+        if '\x00' in result:
+            return None
+        result_tokens = self._tokens(result)
+        if result_tokens is None or self.canonical(result_tokens) != template['fixed']:
+            return None
+        if self.language == 'python':
+            try:
+                compile(result, '<fingerprint>', 'exec', dont_inherit=True)
+            except (SyntaxError, ValueError):
+                return None
+        return result
+
+    def render(self, entries, unit):
+        """Join (gap, text, value, depth) entries, re-indenting Python lines whose block depth changed.
+
+        Entries from the fix have no depth of their own, so lines they
+        touch are always indented with the caller's indentation unit.
+        """
+        out = []
+        pending = ''
+        depth = 0
+        line_start = True
+        touched = False
+        for gap, text, value, original_depth in entries:
+            touched = touched or original_depth is None
+            if value in (INDENT, DEDENT):
+                depth += 1 if value == INDENT else -1
+                pending += gap + text
+                continue
+            pending += gap
+            if self.language == 'python' and line_start and (touched or original_depth != depth):
+                head, newline, _ = pending.rpartition('\n')
+                pending = head + newline + unit * depth
+            out.append(pending + text)
+            pending = ''
+            line_start = value == NEWLINE
+            touched = False
+        out.append(pending)
+        return ''.join(out)
+
+
+def fingerprint(code, language=None):
+    """Return the Fingerprint of code, or None for languages or code it cannot handle"""
+    if language not in ('python', 'brace'):
+        language = detect_language(code)
+    tokens = tokenize_code(code, language)
+    if not tokens:
+        return None
+    return Fingerprint(code, language, tokens)
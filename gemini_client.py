@@ -0,0 +1,676 @@
+import json
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from cache import make_cache_key
+from ratelimit import INTERACTIVE, KeyPool, QueueFull, current_priority
+from metrics import observe_stage, record_hedge, record_upstream, record_usage, stage
+
+QUOTA_RETRY_ERROR = "Error: API quota exceeded. Please wait and try again later, or upgrade your plan."
+EMPTY_RESPONSE_ERROR = "Error: No response from AI model"
+QUOTA_EXHAUSTED_ERROR = "Error: API quota exceeded. Please retry in about {} seconds."
+
+
+class GeminiError(Exception):
+    """Raised while streaming when the upstream call fails; the message is an 'Error:' string"""
+
+
+def build_payload(prompt, schema=None):
+    """Build the generateContent request body for a single text prompt.
+
+    With a schema, Gemini is asked for JSON output matching it.
+    """
+    payload = {
+        "contents": [
+            {
+                "parts": [
+                    {
+                        "text": prompt
+                    }
+                ]
+            }
+        ]
+    }
+    if schema is not None:
+        payload["generationConfig"] = {
+            "responseMimeType": "application/json",
+            "responseSchema": schema
+        }
+    return payload
+
+
+def request_cache_key(api_url, prompt, schema=None):
+    if schema is None:
+        return make_cache_key(api_url, prompt)
+    return make_cache_key(api_url, prompt + '\0' + json.dumps(schema, sort_keys=True))
+
+
+def parse_response(result):
+    """Extract the completion text from a generateContent response"""
+    if 'candidates' in result and len(result['candidates']) > 0:
+        return result['candidates'][0]['content']['parts'][0]['text']
+    return EMPTY_RESPONSE_ERROR
+
+
+def parse_stream_line(line):
+    """Return the text fragments carried by one SSE line of a streamGenerateContent response"""
+    if not line or not line.startswith('data:'):
+        return []
+    result = json.loads(line[5:].strip())
+    texts = []
+    for candidate in result.get('candidates', [])[:1]:
+        for part in candidate.get('content', {}).get('parts', []):
+            text = part.get('text')
+            if text:
+                texts.append(text)
+    return texts
+
+
+def stream_url_for(api_url):
+    return api_url.replace(':generateContent', ':streamGenerateContent')
+
+
+def hedge_delay(hedger):
+    """How long an outgoing call may run before it is hedged, or None when it must not be"""
+    if hedger is None:
+        return None
+    delay = hedger.begin()
+    if current_priority.get() != INTERACTIVE:
+        return None
+    return delay
+
+
+def key_pool(api_key, keys, scheduler):
+    """The pool a client sends with: the one given, else the scheduler's, else just api_key"""
+    if keys is not None:
+        return keys
+    if scheduler is not None:
+        return scheduler.keys
+    return KeyPool([api_key])
+
+
+def quota_exhausted(response, keys):
+    """QueueFull for a call still rate limited after its retries, so the client is told when to come back"""
+    try:
+        eta = float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        eta = keys.wait_time(time.monotonic())
+    return QueueFull(0, eta, QUOTA_EXHAUSTED_ERROR.format(int(eta) + 1))
+
+
+def close_response(future):
+    """Done-callback discarding the response of a call that lost a hedge race"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def timed_connection(base):
+    """Connection class that records how long each new upstream connection took to open"""
+    class TimedConnection(base):
+        def connect(self):
+            started = time.perf_counter()
+            super().connect()
+            observe_stage('upstream_connect', time.perf_counter() - started)
+    return TimedConnection
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = timed_connection(HTTPConnection)
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = timed_connection(HTTPSConnection)
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+
+class AsyncUpstreamTrace:
+    """httpx trace hook recording connect time and time to first byte"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connect_started = None
+        self.connect_finished = None
+
+    async def __call__(self, event, info):
+        now = time.perf_counter()
+        if event == 'connection.connect_tcp.started':
+            self.connect_started = now
+        elif event in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+            self.connect_finished = now
+        elif event.endswith('receive_response_headers.complete'):
+            if self.connect_started is not None and self.connect_finished is not None:
+                observe_stage('upstream_connect', self.connect_finished - self.connect_started)
+            observe_stage('upstream_ttfb', now - self.started)
+
+
+class GeminiClient:
+    """Shared Gemini client that keeps pooled keep-alive connections to the API"""
+
+    def __init__(self, api_url, api_key, cache=None, pool_size=10, timeout=30, singleflight=None, scheduler=None, hedger=None, keys=None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.cache = cache
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.singleflight = singleflight
+        self.scheduler = scheduler
+        self.hedger = hedger
+        self.keys = key_pool(api_key, keys, scheduler)
+        self.session = self._create_session()
+        # Hedged calls run off the caller's thread so the first answer can be returned
+        # while the other call is still outstanding
+        self.hedge_executor = ThreadPoolExecutor(max_workers=2 * pool_size, thread_name_prefix='hedge') if hedger else None
+
+    @property
+    def stream_url(self):
+        return stream_url_for(self.api_url)
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Content-Type': 'application/json'})
+        return session
+
+    def reset(self):
+        """Drop pooled connections, e.g. after forking a worker process"""
+        self.session.close()
+        self.session = self._create_session()
+        if self.hedge_executor is not None:
+            self.hedge_executor = ThreadPoolExecutor(max_workers=2 * self.pool_size, thread_name_prefix='hedge')
+
+    def warm(self, connections=2):
+        """Open connections to the API host ahead of the first real request"""
+        parts = urlsplit(self.api_url)
+        origin = f"{parts.scheme}://{parts.netloc}/"
+
+        def touch():
+            try:
+                self.session.head(origin, timeout=5)
+            except requests.exceptions.RequestException:
+                pass
+
+        threads = [threading.Thread(target=touch, daemon=True) for _ in range(min(connections, self.pool_size))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def generate(self, prompt, schema=None):
+        """Send a prompt to Gemini and return the completion text or an 'Error:' string"""
+        cache_key = request_cache_key(self.api_url, prompt, schema)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if self.singleflight is not None:
+            return self.singleflight.do(cache_key, lambda: self._request(prompt, cache_key, schema))
+        return self._request(prompt, cache_key, schema)
+
+    def _acquire(self):
+        """Wait for the scheduler, if any, and return the key to send the call with"""
+        if self.scheduler is None:
+            return self.keys.choose()
+        with stage('queue_wait'):
+            return self.scheduler.acquire()
+
+    def _try_acquire(self):
+        """A key for a hedge, only if one is free right now"""
+        if self.scheduler is None:
+            return self.keys.choose()
+        return self.scheduler.try_acquire()
+
+    def _should_retry(self, response, attempt):
+        """On a 429, back off and report whether another attempt is allowed"""
+        if self.scheduler is None or attempt >= self.scheduler.max_retries:
+            return False
+        self.scheduler.backoff()
+        return True
+
+    def _should_switch(self, response, switches):
+        """On a 401/403, or a 429 that was not backed off from, report whether another key is left to try"""
+        if response.status_code not in (401, 403, 429) or switches >= len(self.keys) - 1:
+            return False
+        now = time.monotonic()
+        if response.status_code == 429:
+            return self.keys.wait_time(now) == 0
+        return bool(self.keys.usable(now))
+
+    def _headers(self, key):
+        return {'x-goog-api-key': key.secret or self.api_key}
+
+    def _send(self, url, prompt, schema=None, key=None, **kwargs):
+        """POST a prompt once with key, recording the upstream metrics and the key's outcome"""
+        key = key or self.keys.choose()
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                url,
+                headers=self._headers(key),
+                json=build_payload(prompt, schema),
+                timeout=self.timeout,
+                **kwargs
+            )
+        except requests.exceptions.Timeout:
+            record_upstream('timeout', key)
+            raise
+        except requests.exceptions.RequestException:
+            record_upstream('error', key)
+            raise
+        record_upstream(response.status_code, key)
+        self.keys.report(key, response.status_code, response.headers.get('Retry-After'))
+        observe_stage('upstream_ttfb', response.elapsed.total_seconds())
+        if not kwargs.get('stream'):
+            elapsed = time.perf_counter() - started
+            observe_stage('upstream_total', elapsed)
+            if self.hedger is not None and response.status_code == 200:
+                self.hedger.observe(elapsed)
+        return response
+
+    def _post(self, url, prompt, schema=None, **kwargs):
+        """POST a prompt once the scheduler allows it, retrying 429s with backoff.
+
+        A key refused with 401/403 is set aside and the call retried on another.
+        Raises QueueFull when the scheduler cannot fit the call in.
+        """
+        attempt = 0
+        switches = 0
+        while True:
+            key = self._acquire()
+            response = self._send(url, prompt, schema, key, **kwargs)
+            if response.status_code == 429 and self._should_retry(response, attempt):
+                response.close()
+                attempt += 1
+                continue
+            if self._should_switch(response, switches):
+                response.close()
+                switches += 1
+                continue
+            return response
+
+    def _post_hedged(self, url, prompt, schema=None):
+        """Like _post, but a call slower than usual gets a second copy and the first good answer wins.
+
+        The copy is sent only if the hedge budget and a free quota token allow
+        it, and is never retried. The losing response is discarded when it arrives.
+        """
+        delay = hedge_delay(self.hedger)
+        if delay is None:
+            return self._post(url, prompt, schema)
+
+        primary = self.hedge_executor.submit(contextvars.copy_context().run, self._post, url, prompt, schema)
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        if not self.hedger.try_hedge():
+            return primary.result()
+        hedge_key = self._try_acquire()
+        if hedge_key is None:
+            self.hedger.cancel_hedge()
+            return primary.result()
+
+        hedge = self.hedge_executor.submit(contextvars.copy_context().run, self._send, url, prompt, schema, hedge_key)
+        winner = None
+        pending = {primary, hedge}
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code == 200:
+                    winner = future
+                    break
+        if winner is None:
+            # Neither copy succeeded; report what the primary call (which may have retried) got
+            winner = primary
+
+        for future in (primary, hedge):
+            if future is not winner:
+                future.add_done_callback(close_response)
+        if winner is hedge:
+            self.hedger.record_win()
+        record_hedge(winner is hedge)
+        return winner.result()
+
+    def _request(self, prompt, cache_key, schema=None):
+        """Call generateContent and cache a successful completion"""
+        try:
+            response = self._post_hedged(self.api_url, prompt, schema)
+
+            # Still rate limited after the retries: tell the client when to come back
+            if response.status_code == 429:
+                raise quota_exhausted(response, self.keys)
+
+            response.raise_for_status()  # Raise exception for bad status codes
+
+            with stage('response_parse'):
+                result = response.json()
+                text = parse_response(result)
+            if not text.startswith('Error:'):
+                record_usage(prompt, text, result.get('usageMetadata'))
+                if self.cache is not None:
+                    self.cache.set(cache_key, text)
+            return text
+
+        except requests.exceptions.RequestException as e:
+            if "429" in str(e):
+                return QUOTA_RETRY_ERROR
+            return f"Error: Connection failed - {str(e)}"
+        except QueueFull:
+            raise
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def stream(self, prompt):
+        """Yield completion text chunks as Gemini generates them, raising GeminiError on failure"""
+        cache_key = make_cache_key(self.api_url, prompt)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        chunks = []
+        parsing = 0.0
+        try:
+            started = time.perf_counter()
+            with self._post(self.stream_url, prompt, params={'alt': 'sse'}, stream=True) as response:
+                if response.status_code == 429:
+                    raise quota_exhausted(response, self.keys)
+                response.raise_for_status()
+
+                for line in response.iter_lines(decode_unicode=True):
+                    parse_started = time.perf_counter()
+                    texts = parse_stream_line(line)
+                    parsing += time.perf_counter() - parse_started
+                    for text in texts:
+                        chunks.append(text)
+                        yield text
+            observe_stage('upstream_total', time.perf_counter() - started)
+            observe_stage('response_parse', parsing)
+
+        except requests.exceptions.RequestException as e:
+            if "429" in str(e):
+                raise GeminiError(QUOTA_RETRY_ERROR)
+            raise GeminiError(f"Error: Connection failed - {str(e)}")
+        except ValueError as e:
+            raise GeminiError(f"Error: {str(e)}")
+
+        if not chunks:
+            raise GeminiError(EMPTY_RESPONSE_ERROR)
+        record_usage(prompt, ''.join(chunks))
+        if self.cache is not None:
+            self.cache.set(cache_key, ''.join(chunks))
+
+
+class AsyncGeminiClient:
+    """asyncio counterpart of GeminiClient used by the ASGI server (requires httpx)"""
+
+    def __init__(self, api_url, api_key, cache=None, max_connections=200, timeout=30, scheduler=None, hedger=None, keys=None, singleflight=None):
+        import httpx
+
+        self.api_url = api_url
+        self.api_key = api_key
+        self.cache = cache
+        self.timeout = timeout
+        self.singleflight = singleflight
+        self.scheduler = scheduler
+        self.hedger = hedger
+        self.keys = key_pool(api_key, keys, scheduler)
+        self.client = httpx.AsyncClient(
+            headers={'Content-Type': 'application/json'},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout
+        )
+
+    @property
+    def stream_url(self):
+        return stream_url_for(self.api_url)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def warm(self):
+        """Open a connection to the API host ahead of the first real request"""
+        import httpx
+
+        parts = urlsplit(self.api_url)
+        try:
+            await self.client.head(f"{parts.scheme}://{parts.netloc}/", timeout=5)
+        except httpx.HTTPError:
+            pass
+
+    async def _cache_get(self, cache_key):
+        if self.cache is None:
+            return None
+        return await asyncio.to_thread(self.cache.get, cache_key)
+
+    async def _cache_set(self, cache_key, text):
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.set, cache_key, text)
+
+    async def _acquire(self):
+        if self.scheduler is None:
+            return self.keys.choose()
+        with stage('queue_wait'):
+            return await self.scheduler.acquire_async()
+
+    async def _should_retry(self, response, attempt):
+        if self.scheduler is None or attempt >= self.scheduler.max_retries:
+            return False
+        await self.scheduler.backoff_async()
+        return True
+
+    def _should_switch(self, response, switches):
+        """On a 401/403, or a 429 that was not backed off from, report whether another key is left to try"""
+        if response.status_code not in (401, 403, 429) or switches >= len(self.keys) - 1:
+            return False
+        now = time.monotonic()
+        if response.status_code == 429:
+            return self.keys.wait_time(now) == 0
+        return bool(self.keys.usable(now))
+
+    def _headers(self, key):
+        return {'x-goog-api-key': key.secret or self.api_key}
+
+    def _record(self, response, key):
+        record_upstream(response.status_code, key)
+        self.keys.report(key, response.status_code, response.headers.get('Retry-After'))
+
+    async def _send(self, prompt, key, schema=None):
+        """POST a prompt once with key, recording the upstream metrics and the key's outcome"""
+        import httpx
+
+        trace = AsyncUpstreamTrace()
+        try:
+            response = await self.client.post(
+                self.api_url,
+                headers=self._headers(key),
+                json=build_payload(prompt, schema),
+                extensions={'trace': trace}
+            )
+        except httpx.TimeoutException:
+            record_upstream('timeout', key)
+            raise
+        except httpx.HTTPError:
+            record_upstream('error', key)
+            raise
+        self._record(response, key)
+        elapsed = time.perf_counter() - trace.started
+        observe_stage('upstream_total', elapsed)
+        if self.hedger is not None and response.status_code == 200:
+            self.hedger.observe(elapsed)
+        return response
+
+    async def _post(self, prompt, schema=None):
+        """POST a prompt once the scheduler allows it, retrying 429s with backoff and 401/403s on another key"""
+        attempt = 0
+        switches = 0
+        while True:
+            key = await self._acquire()
+            response = await self._send(prompt, key, schema)
+            if response.status_code == 429 and await self._should_retry(response, attempt):
+                attempt += 1
+                continue
+            if self._should_switch(response, switches):
+                switches += 1
+                continue
+            return response
+
+    async def _post_hedged(self, prompt, schema=None):
+        """Like _post, but a call slower than usual gets a second copy; the loser is cancelled"""
+        delay = hedge_delay(self.hedger)
+        if delay is None:
+            return await self._post(prompt, schema)
+
+        primary = asyncio.ensure_future(self._post(prompt, schema))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        if not self.hedger.try_hedge():
+            return await primary
+        hedge_key = self.scheduler.try_acquire() if self.scheduler is not None else self.keys.choose()
+        if hedge_key is None:
+            self.hedger.cancel_hedge()
+            return await primary
+
+        hedge = asyncio.ensure_future(self._send(prompt, hedge_key, schema))
+        winner = None
+        pending = {primary, hedge}
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        winner = task
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+        if winner is None:
+            winner = primary
+
+        if winner is hedge:
+            self.hedger.record_win()
+        record_hedge(winner is hedge)
+        return winner.result()
+
+    async def generate(self, prompt, schema=None):
+        """Send a prompt to Gemini and return the completion text or an 'Error:' string"""
+        cache_key = request_cache_key(self.api_url, prompt, schema)
+        cached = await self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        if self.singleflight is not None:
+            return await self.singleflight.do_async(cache_key, lambda: self._request(prompt, cache_key, schema))
+        return await self._request(prompt, cache_key, schema)
+
+    async def _request(self, prompt, cache_key, schema=None):
+        """Call generateContent and cache a successful completion"""
+        import httpx
+
+        try:
+            response = await self._post_hedged(prompt, schema)
+
+            if response.status_code == 429:
+                raise quota_exhausted(response, self.keys)
+
+            response.raise_for_status()
+
+            with stage('response_parse'):
+                result = response.json()
+                text = parse_response(result)
+            if not text.startswith('Error:'):
+                record_usage(prompt, text, result.get('usageMetadata'))
+                await self._cache_set(cache_key, text)
+            return text
+
+        except httpx.HTTPError as e:
+            if "429" in str(e):
+                return QUOTA_RETRY_ERROR
+            return f"Error: Connection failed - {str(e)}"
+        except QueueFull:
+            raise
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    async def stream(self, prompt):
+        """Yield completion text chunks as Gemini generates them, raising GeminiError on failure"""
+        import httpx
+
+        cache_key = make_cache_key(self.api_url, prompt)
+        cached = await self._cache_get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        chunks = []
+        parsing = 0.0
+        key = None
+        try:
+            attempt = 0
+            switches = 0
+            while True:
+                key = await self._acquire()
+                trace = AsyncUpstreamTrace()
+                async with self.client.stream(
+                    'POST',
+                    self.stream_url,
+                    params={'alt': 'sse'},
+                    headers=self._headers(key),
+                    json=build_payload(prompt),
+                    extensions={'trace': trace}
+                ) as response:
+                    self._record(response, key)
+                    if response.status_code == 429 and await self._should_retry(response, attempt):
+                        attempt += 1
+                        continue
+                    if self._should_switch(response, switches):
+                        switches += 1
+                        continue
+                    if response.status_code == 429:
+                        raise quota_exhausted(response, self.keys)
+                    response.raise_for_status()
+
+                    async for line in response.aiter_lines():
+                        parse_started = time.perf_counter()
+                        texts = parse_stream_line(line)
+                        parsing += time.perf_counter() - parse_started
+                        for text in texts:
+                            chunks.append(text)
+                            yield text
+                observe_stage('upstream_total', time.perf_counter() - trace.started)
+                observe_stage('response_parse', parsing)
+                break
+
+        except httpx.TimeoutException as e:
+            record_upstream('timeout', key)
+            raise GeminiError(f"Error: Connection failed - {str(e)}")
+        except httpx.HTTPError as e:
+            if "429" in str(e):
+                raise GeminiError(QUOTA_RETRY_ERROR)
+            raise GeminiError(f"Error: Connection failed - {str(e)}")
+        except ValueError as e:
+            raise GeminiError(f"Error: {str(e)}")
+
+        if not chunks:
+            raise GeminiError(EMPTY_RESPONSE_ERROR)
+        record_usage(prompt, ''.join(chunks))
+        await self._cache_set(cache_key, ''.join(chunks))
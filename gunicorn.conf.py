@@ -0,0 +1,42 @@
+"""Production serving with gunicorn.
+
+    gunicorn app:app                  # this file is picked up from the working directory
+    kill -HUP <master pid>            # new workers with reloaded settings replace the old ones gracefully
+
+The app, its upstream client and asset bundle are loaded once in the master
+and forked into WEB_WORKERS processes of WORKER_THREADS threads each.
+Requests spend most of their time waiting on Gemini, so a few processes with
+many threads serve far more concurrent requests than one process per core.
+"""
+import os
+import multiprocessing
+
+WEB_WORKERS_PER_CORE = float(os.getenv('WEB_WORKERS_PER_CORE', '1'))
+
+workers = int(os.getenv('WEB_WORKERS', '0')) or max(2, int(multiprocessing.cpu_count() * WEB_WORKERS_PER_CORE))
+# The app divides the upstream quota between the worker processes
+os.environ['WEB_WORKERS'] = str(workers)
+
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WORKER_THREADS', '16'))
+bind = os.getenv('WEB_BIND', '0.0.0.0:5000')
+backlog = int(os.getenv('WEB_BACKLOG', '2048'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '60'))
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+accesslog = os.getenv('WEB_ACCESS_LOG') or None
+preload_app = True
+# Heartbeat files on tmpfs, so a slow disk cannot make healthy workers look hung
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def post_fork(server, worker):
+    """Give each worker its own upstream connections and job workers"""
+    import threading
+    from app import gemini_client, job_queue
+
+    gemini_client.reset()
+    threading.Thread(target=gemini_client.warm, daemon=True).start()
+    job_queue.start()
@@ -0,0 +1,121 @@
+"""Hedged upstream calls.
+
+An interactive call that is still outstanding after the usual latency (a
+percentile of recent successful calls) gets a second, identical copy, and
+whichever answers first is used. Hedges spend credit that every call earns
+at a fixed ratio, so they can never add more than that share of extra quota.
+"""
+import bisect
+import threading
+from collections import deque
+
+
+class LatencyWindow:
+    """Percentiles over the most recent `size` latency samples"""
+
+    def __init__(self, size=500):
+        self.samples = deque(maxlen=size)
+        self.ordered = []
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, seconds):
+        if len(self.samples) == self.samples.maxlen:
+            oldest = self.samples[0]
+            del self.ordered[bisect.bisect_left(self.ordered, oldest)]
+        self.samples.append(seconds)
+        bisect.insort(self.ordered, seconds)
+
+    def percentile(self, p):
+        if not self.ordered:
+            return None
+        index = min(len(self.ordered) - 1, int(p / 100.0 * len(self.ordered)))
+        return self.ordered[index]
+
+
+class HedgeBudget:
+    """Each call earns `ratio` of a hedge, up to `burst` saved; a hedge costs one"""
+
+    def __init__(self, ratio, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.credit = 0.0
+
+    def earn(self):
+        self.credit = min(self.burst, self.credit + self.ratio)
+
+    def spend(self):
+        if self.credit < 1:
+            return False
+        self.credit -= 1
+        return True
+
+    def refund(self):
+        self.credit = min(self.burst, self.credit + 1)
+
+
+class Hedger:
+    """Decides when a slow upstream call deserves a second copy.
+
+    `percentile` sets the delay before hedging, `budget` the share of calls
+    that may be hedged. No call is hedged until `min_samples` latencies
+    have been seen.
+    """
+
+    def __init__(self, percentile=95, budget=0.05, window=500, min_samples=20, min_delay=0.05):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.window = LatencyWindow(window)
+        self.budget = HedgeBudget(budget, burst=max(1.0, budget * 100))
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'hedged': 0, 'won': 0, 'over_budget': 0}
+
+    def observe(self, seconds):
+        """Record the latency of a successful call"""
+        with self._lock:
+            self.window.add(seconds)
+
+    def begin(self):
+        """Register a call and return how long to wait before hedging it, or None to never hedge"""
+        with self._lock:
+            self._stats['calls'] += 1
+            self.budget.earn()
+            return self._delay()
+
+    def _delay(self):
+        if len(self.window) < self.min_samples:
+            return None
+        return max(self.min_delay, self.window.percentile(self.percentile))
+
+    def try_hedge(self):
+        """Take budget for a hedge, returning False when hedges have used their share"""
+        with self._lock:
+            if not self.budget.spend():
+                self._stats['over_budget'] += 1
+                return False
+            self._stats['hedged'] += 1
+            return True
+
+    def cancel_hedge(self):
+        """Give back the budget of a hedge that could not be sent"""
+        with self._lock:
+            self.budget.refund()
+            self._stats['hedged'] -= 1
+
+    def record_win(self):
+        with self._lock:
+            self._stats['won'] += 1
+
+    def current_delay(self):
+        with self._lock:
+            return self._delay()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['samples'] = len(self.window)
+            stats['credit'] = round(self.budget.credit, 2)
+            stats['delay'] = self._delay()
+        return stats
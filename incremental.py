@@ -0,0 +1,130 @@
+import json
+import difflib
+
+from cache import make_cache_key
+from chunking import split_units, shared_context
+
+
+def segment_fix(original, fixed):
+    """Split an (original, fixed) pair into aligned [original, fixed] segments.
+
+    Segments are cut at top-level unit boundaries of the original that fall
+    on lines the fix left untouched, so each segment can later be reused on
+    its own.
+    """
+    lines, units, _ = split_units(original)
+    fixed_lines = fixed.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, lines, fixed_lines, autojunk=False)
+    equal_blocks = [(i1, i2, j1) for tag, i1, i2, j1, _ in matcher.get_opcodes() if tag == 'equal']
+
+    cuts = [(0, 0)]
+    for start, _ in units[1:]:
+        for i1, i2, j1 in equal_blocks:
+            if i1 <= start < i2:
+                cuts.append((start, j1 + start - i1))
+                break
+    cuts.append((len(lines), len(fixed_lines)))
+
+    segments = []
+    for (a, ja), (b, jb) in zip(cuts, cuts[1:]):
+        if b > a or jb > ja:
+            segments.append([''.join(lines[a:b]), ''.join(fixed_lines[ja:jb])])
+    return segments
+
+
+def plan_update(segments, new_code):
+    """Work out which parts of new_code still need fixing given a previous snapshot.
+
+    Returns (chunks, context, reused) in the same shape as a chunked fix,
+    where reused maps chunk index to previously fixed text, or None when
+    nothing from the snapshot can be reused.
+    """
+    old_lines = []
+    ranges = []
+    for original, _ in segments:
+        start = len(old_lines)
+        old_lines.extend(original.splitlines(keepends=True))
+        ranges.append((start, len(old_lines)))
+
+    new_lines, units, language = split_units(new_code)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    equal_blocks = [(i1, i2, j1) for tag, i1, i2, j1, _ in matcher.get_opcodes() if tag == 'equal']
+
+    # Old segments copied over verbatim keep their fixed text
+    reused = []
+    for (start, end), (_, fixed) in zip(ranges, segments):
+        if start == end:
+            continue
+        for i1, i2, j1 in equal_blocks:
+            if i1 <= start and end <= i2:
+                reused.append((j1 + start - i1, j1 + end - i1, fixed))
+                break
+
+    # Widen every changed region to whole top-level units, dropping any
+    # reused segment it overlaps, until the layout stops changing
+    boundaries = sorted({0, len(new_lines)} | {start for start, _ in units})
+    while True:
+        gaps = []
+        position = 0
+        for start, end, _ in reused:
+            if start > position:
+                gaps.append((position, start))
+            position = end
+        if position < len(new_lines):
+            gaps.append((position, len(new_lines)))
+
+        widened = [
+            (max(b for b in boundaries if b <= a), min(b for b in boundaries if b >= z))
+            for a, z in gaps
+        ]
+        kept = [r for r in reused if not any(r[0] < z and r[1] > a for a, z in widened)]
+        if len(kept) == len(reused):
+            break
+        reused = kept
+
+    if not reused:
+        return None
+
+    pieces = [(start, end, fixed) for start, end, fixed in reused]
+    pieces.extend((a, z, None) for a, z in widened)
+    pieces.sort()
+
+    chunks = []
+    reused_text = {}
+    for start, end, fixed in pieces:
+        text = ''.join(new_lines[start:end])
+        if fixed is None and chunks and (len(chunks) - 1) not in reused_text:
+            chunks[-1] += text  # Merge adjacent changed regions into one prompt
+            continue
+        if fixed is not None:
+            reused_text[len(chunks)] = fixed
+        chunks.append(text)
+    return chunks, shared_context(new_lines, units, language), reused_text
+
+
+class DocumentStore:
+    """Keeps the last analyzed version of each document in the shared result cache"""
+
+    def __init__(self, cache, namespace):
+        self.cache = cache
+        self.namespace = namespace
+
+    def _key(self, document_id):
+        return make_cache_key(self.namespace, f"document:{document_id}")
+
+    def load(self, document_id):
+        """Return the stored [original, fixed] segments for a document, or None"""
+        value = self.cache.get(self._key(document_id))
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+
+    def save(self, document_id, pairs):
+        """Store a document snapshot from a list of (original, fixed) pieces"""
+        segments = []
+        for original, fixed in pairs:
+            segments.extend(segment_fix(original, fixed))
+        self.cache.set(self._key(document_id), json.dumps(segments))
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import contextvars
+
+logger = logging.getLogger('stark.jobs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+
+class RetryLater(Exception):
+    """Raised by a job handler to put its job back in the queue for `delay` seconds"""
+
+    def __init__(self, delay):
+        super().__init__(f"retry in {delay:.1f}s")
+        self.delay = delay
+
+
+class JobStore:
+    """Jobs and their state in SQLite, so queued and interrupted work survives a restart.
+
+    A running job holds a lease that its worker renews; a job whose lease ran
+    out (its worker or process died) is handed to the next worker that asks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ready = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS jobs (
+                            id TEXT PRIMARY KEY,
+                            kind TEXT NOT NULL,
+                            payload TEXT NOT NULL,
+                            status TEXT NOT NULL,
+                            progress TEXT,
+                            result TEXT,
+                            error TEXT,
+                            owner TEXT,
+                            lease_expires REAL,
+                            run_after REAL NOT NULL,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            version INTEGER NOT NULL DEFAULT 0,
+                            created_at REAL NOT NULL,
+                            updated_at REAL NOT NULL
+                        )
+                    """)
+                    conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_after)')
+                    self._ready = True
+        return conn
+
+    def create(self, kind, payload):
+        """Queue a job and return its ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            'INSERT INTO jobs (id, kind, payload, status, run_after, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (job_id, kind, json.dumps(payload), QUEUED, now, now, now)
+        )
+        return job_id
+
+    def get(self, job_id):
+        """Return the public view of a job, or None if there is no such job"""
+        row = self._connect().execute(
+            'SELECT id, kind, status, progress, result, error, attempts, version, created_at, updated_at FROM jobs WHERE id = ?',
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            'job_id': row[0],
+            'type': row[1],
+            'status': row[2],
+            'progress': json.loads(row[3]) if row[3] else None,
+            'attempts': row[6],
+            'version': row[7],
+            'created_at': row[8],
+            'updated_at': row[9],
+        }
+        if row[4] is not None:
+            job['result'] = json.loads(row[4])
+        if row[5] is not None:
+            job['error'] = row[5]
+        return job
+
+    def claim(self, owner, lease_ttl):
+        """Take the oldest runnable job (queued, or running with an expired lease).
+
+        Returns (job_id, kind, payload, attempts) or None when there is nothing to do.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                """SELECT id, kind, payload, attempts FROM jobs
+                   WHERE (status = ? AND run_after <= ?) OR (status = ? AND lease_expires < ?)
+                   ORDER BY created_at LIMIT 1""",
+                (QUEUED, now, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                """UPDATE jobs SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1,
+                   version = version + 1, updated_at = ? WHERE id = ?""",
+                (RUNNING, owner, now + lease_ttl, now, row[0])
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return row[0], row[1], json.loads(row[2]), row[3] + 1
+
+    def _update(self, job_id, owner, assignments, values):
+        """Apply an update while `owner` still holds the job, returning whether it did"""
+        cursor = self._connect().execute(
+            f'UPDATE jobs SET {assignments}, version = version + 1, updated_at = ? WHERE id = ? AND owner = ? AND status = ?',
+            (*values, time.time(), job_id, owner, RUNNING)
+        )
+        return cursor.rowcount == 1
+
+    def progress(self, job_id, owner, progress, lease_ttl):
+        """Record progress and renew the lease"""
+        return self._update(job_id, owner, 'progress = ?, lease_expires = ?', (json.dumps(progress), time.time() + lease_ttl))
+
+    def renew(self, job_id, owner, lease_ttl):
+        cursor = self._connect().execute(
+            'UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND status = ?',
+            (time.time() + lease_ttl, job_id, owner, RUNNING)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id, owner, result):
+        return self._update(job_id, owner, 'status = ?, result = ?, owner = NULL', (DONE, json.dumps(result)))
+
+    def fail(self, job_id, owner, error):
+        return self._update(job_id, owner, 'status = ?, error = ?, owner = NULL', (FAILED, error))
+
+    def requeue(self, job_id, owner, delay):
+        """Give a job back to the queue, to be picked up again after `delay` seconds"""
+        return self._update(
+            job_id, owner, 'status = ?, owner = NULL, run_after = ?, attempts = attempts - 1',
+            (QUEUED, time.time() + delay)
+        )
+
+    def purge(self, older_than):
+        """Delete finished jobs last updated more than `older_than` seconds ago"""
+        self._connect().execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+            (DONE, FAILED, time.time() - older_than)
+        )
+
+    def counts(self):
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+
+class JobQueue:
+    """Worker threads running jobs from a JobStore.
+
+    `handlers` maps a job type to func(payload, report) returning a
+    JSON-serializable result; `report(progress)` records progress. An
+    'Error:' string result, or an exception, fails the job. Jobs are retried
+    after a restart up to `max_attempts` runs.
+    """
+
+    def __init__(self, store, handlers, workers=4, lease_ttl=60, max_attempts=3, retention=24 * 3600, poll_interval=0.5):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self._changed = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Start the workers once per process (again in a forked child)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.store.purge(self.retention)
+            for index in range(self.workers):
+                threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True).start()
+
+    def submit(self, kind, payload):
+        if kind not in self.handlers:
+            raise ValueError(f"unknown job type: {kind}")
+        job_id = self.store.create(kind, payload)
+        self._notify()
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def wait(self, job_id, version, timeout):
+        """Long-poll: return the job once its version is past `version`, it has finished, or `timeout` passes.
+
+        Changes made in this process wake the waiter at once; changes made by
+        other worker processes are noticed within the poll interval.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.store.get(job_id)
+            if job is None or job['version'] > version or job['status'] in FINISHED:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, self.poll_interval))
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _owner(self):
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def _work(self):
+        owner = self._owner()
+        while True:
+            try:
+                claimed = self.store.claim(owner, self.lease_ttl)
+            except sqlite3.Error:
+                claimed = None
+            if claimed is None:
+                with self._changed:
+                    self._changed.wait(self.poll_interval)
+                continue
+            self._notify()
+            try:
+                self._run(owner, *claimed)
+            except sqlite3.Error:
+                # Keep the worker alive; the job is claimed again once its lease runs out
+                logger.exception(f"Could not record the outcome of job {claimed[0]}")
+            self._notify()
+
+    def _run(self, owner, job_id, kind, payload, attempts):
+        if attempts > self.max_attempts:
+            self.store.fail(job_id, owner, f"Error: Job was interrupted {attempts - 1} times and has been given up")
+            return
+
+        def report(progress):
+            try:
+                self.store.progress(job_id, owner, progress, self.lease_ttl)
+            except sqlite3.Error:
+                logger.warning(f"Could not record the progress of job {job_id}", exc_info=True)
+                return
+            self._notify()
+
+        # Keep the lease alive while a long upstream call gives the handler no chance to report
+        stopped = threading.Event()
+
+        def keep_alive():
+            while not stopped.wait(self.lease_ttl / 3.0):
+                try:
+                    self.store.renew(job_id, owner, self.lease_ttl)
+                except sqlite3.Error:
+                    logger.warning(f"Could not renew the lease of job {job_id}", exc_info=True)
+
+        renewer = threading.Thread(target=keep_alive, daemon=True)
+        renewer.start()
+        try:
+            result = contextvars.copy_context().run(self.handlers[kind], payload, report)
+        except RetryLater as e:
+            self.store.requeue(job_id, owner, e.delay)
+            return
+        except Exception as e:
+            self.store.fail(job_id, owner, f"Error: {str(e)}")
+            return
+        finally:
+            stopped.set()
+        if isinstance(result, str) and result.startswith('Error:'):
+            self.store.fail(job_id, owner, result)
+        else:
+            self.store.finish(job_id, owner, result)
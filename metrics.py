@@ -0,0 +1,284 @@
+import time
+import bisect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from compaction import estimate_tokens
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Route template of the request being served, used to label upstream metrics
+current_endpoint = contextvars.ContextVar('current_endpoint', default='other')
+# (stage, seconds) pairs observed by the current request, while it is being traced
+current_trace = contextvars.ContextVar('current_trace', default=None)
+# Statuses of the upstream calls made for the current admitted request
+upstream_tally = contextvars.ContextVar('upstream_tally', default=None)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{escape_label(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base for a labelled metric family; children are created on first use of a label set"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for every child"""
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in sorted(children):
+            yield from child.samples(values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, values, extra)} {format_value(value)}")
+        return '\n'.join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = float(value)
+
+    def samples(self, values):
+        yield '', values, (), self.value
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(Metric):
+    """Value that can go up and down, or be read from a function at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, function=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    @contextmanager
+    def track_inprogress(self, *values, **kwargs):
+        child = self.labels(*values, **kwargs)
+        child.inc()
+        try:
+            yield
+        finally:
+            child.dec()
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                yield '', (), (), float(self.function())
+            except Exception:
+                pass
+            return
+        yield from super().samples()
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, values):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', values, (('le', format_value(bound)),), cumulative
+        yield '_sum', values, (), total
+        yield '_count', values, (), cumulative
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _Histogram(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """Text exposition format understood by Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter('stark_http_requests_total', 'HTTP requests served', ('endpoint', 'method', 'status'))
+HTTP_IN_FLIGHT = Gauge('stark_http_requests_in_flight', 'HTTP requests currently being served', ('endpoint',))
+HTTP_DURATION = Histogram('stark_http_request_duration_seconds', 'Time to produce a response', ('endpoint',))
+STAGE_DURATION = Histogram(
+    'stark_stage_duration_seconds',
+    'Time spent per stage: json_parse, fingerprint, prompt_build, queue_wait, upstream_connect, upstream_ttfb, upstream_total, response_parse, serialize',
+    ('endpoint', 'stage')
+)
+UPSTREAM_REQUESTS = Counter('stark_upstream_requests_total', 'Calls to Gemini by HTTP status (or "timeout"/"error")', ('endpoint', 'status'))
+UPSTREAM_RATE_LIMITED = Counter('stark_upstream_rate_limited_total', '429 responses from Gemini, including retried ones', ('endpoint',))
+UPSTREAM_KEY_REQUESTS = Counter('stark_upstream_key_requests_total', 'Calls to Gemini by API key (last four characters) and HTTP status', ('key', 'status'))
+UPSTREAM_TIMEOUTS = Counter('stark_upstream_timeouts_total', 'Calls to Gemini that timed out', ('endpoint',))
+ADMISSION_REJECTED = Counter('stark_admission_rejected_total', 'Requests refused by admission control, by reason', ('endpoint', 'reason'))
+SEMANTIC_CACHE = Counter('stark_semantic_cache_total', 'Near-duplicate cache lookups, by outcome (hit, miss or rejected)', ('endpoint', 'outcome'))
+SPECULATIONS = Counter('stark_speculations_total', 'Speculative explanations, by outcome (started, skipped or joined)', ('endpoint', 'outcome'))
+UPSTREAM_HEDGES = Counter('stark_upstream_hedges_total', 'Second copies of slow Gemini calls, by whether they answered first', ('endpoint', 'outcome'))
+PROMPT_CHARS = Counter('stark_prompt_chars_total', 'Characters sent to Gemini', ('endpoint',))
+COMPLETION_CHARS = Counter('stark_completion_chars_total', 'Characters received from Gemini', ('endpoint',))
+PROMPT_TOKENS = Counter('stark_prompt_tokens_total', 'Prompt tokens (as reported by Gemini, or estimated)', ('endpoint',))
+COMPLETION_TOKENS = Counter('stark_completion_tokens_total', 'Completion tokens (as reported by Gemini, or estimated)', ('endpoint',))
+
+
+def observe_stage(stage, seconds, endpoint=None):
+    STAGE_DURATION.labels(endpoint or current_endpoint.get(), stage).observe(seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """Decorator recording each call of the function as the given stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_upstream(status, key=None):
+    endpoint = current_endpoint.get()
+    UPSTREAM_REQUESTS.labels(endpoint, status).inc()
+    tally = upstream_tally.get()
+    if tally is not None:
+        tally.append(status)
+    if key is not None:
+        UPSTREAM_KEY_REQUESTS.labels(key.label, status).inc()
+    if status == 429:
+        UPSTREAM_RATE_LIMITED.labels(endpoint).inc()
+    elif status == 'timeout':
+        UPSTREAM_TIMEOUTS.labels(endpoint).inc()
+
+
+def record_rejection(reason):
+    ADMISSION_REJECTED.labels(current_endpoint.get(), reason).inc()
+
+
+def record_semantic_cache(outcome):
+    SEMANTIC_CACHE.labels(current_endpoint.get(), outcome).inc()
+
+
+def record_speculation(outcome):
+    SPECULATIONS.labels(current_endpoint.get(), outcome).inc()
+
+
+def record_hedge(won):
+    UPSTREAM_HEDGES.labels(current_endpoint.get(), 'won' if won else 'lost').inc()
+
+
+def record_usage(prompt, completion, usage=None):
+    """Count prompt and completion size, preferring Gemini's own token counts when it reports them"""
+    endpoint = current_endpoint.get()
+    usage = usage or {}
+    PROMPT_CHARS.labels(endpoint).inc(len(prompt))
+    COMPLETION_CHARS.labels(endpoint).inc(len(completion))
+    PROMPT_TOKENS.labels(endpoint).inc(usage.get('promptTokenCount') or estimate_tokens(prompt))
+    COMPLETION_TOKENS.labels(endpoint).inc(usage.get('candidatesTokenCount') or estimate_tokens(completion))
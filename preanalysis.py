@@ -0,0 +1,271 @@
+import io
+import re
+import ast
+import builtins
+import textwrap
+import tokenize
+import warnings
+
+from chunking import detect_language
+
+BLOCK_KEYWORDS = ('def', 'class', 'if', 'elif', 'else', 'for', 'while', 'try', 'except', 'finally', 'with', 'async', 'match', 'case')
+CLOSERS = {'(': ')', '[': ']', '{': '}'}
+MODULE_NAMES = {'__file__', '__name__', '__doc__', '__package__', '__spec__', '__loader__', '__builtins__', '__path__', '__annotations__'}
+MAX_FIX_ATTEMPTS = 10
+
+checkers = {}
+
+
+class Report:
+    """Result of local pre-analysis.
+
+    `code` is the (possibly mechanically repaired) source, `diagnostics`
+    are human-readable findings for the prompt, `fixes` describes what was
+    repaired, and `resolved` means no upstream call is needed.
+    """
+
+    def __init__(self, code, language=None, diagnostics=None, fixes=None, resolved=False):
+        self.code = code
+        self.language = language
+        self.diagnostics = diagnostics or []
+        self.fixes = fixes or []
+        self.resolved = resolved
+
+    def to_dict(self):
+        return {
+            'language': self.language,
+            'diagnostics': self.diagnostics,
+            'fixes': self.fixes,
+            'resolved': self.resolved,
+        }
+
+
+def register_checker(language):
+    """Register a function(code, skip_clean) -> Report for a language"""
+    def decorator(func):
+        checkers[language] = func
+        return func
+    return decorator
+
+
+PYTHON_HINT = re.compile(r'^\s*(import \w|from [\w.]+ import |print\b|elif\b|except\b|def \w|class \w)|:\s*(#.*)?$', re.MULTILINE)
+
+
+def guess_language(code):
+    language = detect_language(code)
+    if language == 'indent':
+        try:
+            ast.parse(textwrap.dedent(code))
+            return 'python'
+        except (SyntaxError, ValueError):
+            pass
+        if PYTHON_HINT.search(code) and ';\n' not in code:
+            return 'python'
+    return language
+
+
+def analyze_code(code, language=None, skip_clean=False):
+    """Run the checker for the code's language; unknown languages pass through untouched"""
+    language = language if language in checkers else guess_language(code)
+    checker = checkers.get(language)
+    if checker is None:
+        return Report(code, language)
+    report = checker(code, skip_clean)
+    report.language = language
+    return report
+
+
+def compile_python(code):
+    """Compile code, returning (SyntaxError or None, list of compiler warnings)"""
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        try:
+            compile(code, '<input>', 'exec', dont_inherit=True)
+        except (SyntaxError, ValueError) as e:
+            if not isinstance(e, SyntaxError):
+                e = SyntaxError(str(e))
+            return e, []
+    return None, [f"line {w.lineno}: {w.message}" for w in caught if issubclass(w.category, SyntaxWarning)]
+
+
+def replace_line(code, lineno, transform):
+    lines = code.splitlines(keepends=True)
+    if not 0 < lineno <= len(lines):
+        return None
+    line = lines[lineno - 1]
+    body = line.rstrip('\r\n')
+    new_body = transform(body)
+    if new_body is None or new_body == body:
+        return None
+    lines[lineno - 1] = new_body + line[len(body):]
+    return ''.join(lines)
+
+
+def split_comment(body):
+    """Split a line into (code, trailing comment) using tokenize so '#' in strings is ignored"""
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(body + '\n').readline):
+            if token.type == tokenize.COMMENT:
+                return body[:token.start[1]].rstrip(), body[token.start[1]:]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        pass
+    return body.rstrip(), ''
+
+
+def fix_missing_colon(code, error):
+    if "expected ':'" not in error.msg:
+        return None
+
+    def add_colon(body):
+        statement, comment = split_comment(body)
+        if not statement.lstrip().startswith(BLOCK_KEYWORDS) or statement.endswith(':'):
+            return None
+        return statement + ':' + (' ' + comment if comment else '')
+
+    return replace_line(code, error.lineno, add_colon)
+
+
+def fix_python2_print(code, error):
+    if 'Missing parentheses' not in error.msg or 'print' not in error.msg:
+        return None
+
+    def add_parentheses(body):
+        match = re.match(r'^(\s*)print\s+(.+?)\s*$', split_comment(body)[0])
+        if not match:
+            return None
+        comment = split_comment(body)[1]
+        return f"{match.group(1)}print({match.group(2)})" + (' ' + comment if comment else '')
+
+    return replace_line(code, error.lineno, add_parentheses)
+
+
+def fix_unclosed_bracket(code, error):
+    """Close brackets left open at the end of the line that opened them"""
+    if 'was never closed' not in error.msg:
+        return None
+    stack = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.OP and token.string in CLOSERS:
+                stack.append((token.string, token.start[0]))
+            elif token.type == tokenize.OP and token.string in CLOSERS.values() and stack:
+                stack.pop()
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        pass
+    if not stack:
+        return None
+    opener, lineno = stack[-1]
+
+    def close(body):
+        statement, comment = split_comment(body)
+        return statement + CLOSERS[opener] + (' ' + comment if comment else '')
+
+    return replace_line(code, lineno, close)
+
+
+def fix_indentation(code, error):
+    """Dedent code pasted from inside a block and expand tabs mixed with spaces"""
+    if not isinstance(error, (IndentationError, TabError)):
+        return None
+    dedented = textwrap.dedent(code)
+    if dedented != code:
+        return dedented
+    lines = code.splitlines(keepends=True)
+    expanded = []
+    for line in lines:
+        indent = line[:len(line) - len(line.lstrip(' \t'))]
+        expanded.append(indent.replace('\t', '    ') + line[len(indent):])
+    expanded = ''.join(expanded)
+    return expanded if expanded != code else None
+
+
+PYTHON_FIXERS = [
+    ('removed common indentation / expanded tabs', fix_indentation),
+    ('added missing colon', fix_missing_colon),
+    ('added parentheses to print statement', fix_python2_print),
+    ('closed unclosed bracket', fix_unclosed_bracket),
+]
+
+
+def undefined_names(tree):
+    """Report names that are read but never bound anywhere in the module"""
+    bound = set(dir(builtins)) | MODULE_NAMES
+    loads = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names):
+            return []  # Star imports make this check meaningless
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loads.append(node)
+            else:
+                bound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.alias):
+            bound.add((node.asname or node.name).split('.')[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bound.add(node.rest)
+    reported = {}
+    for node in loads:
+        if node.id not in bound and node.id not in reported:
+            reported[node.id] = f"line {node.lineno}: name '{node.id}' is not defined"
+    return list(reported.values())
+
+
+@register_checker('python')
+def check_python(code, skip_clean=False):
+    error, compiler_warnings = compile_python(code)
+    fixes = []
+    attempts = 0
+    while error is not None and attempts < MAX_FIX_ATTEMPTS:
+        attempts += 1
+        for description, fixer in PYTHON_FIXERS:
+            candidate = fixer(code, error)
+            if candidate is None:
+                continue
+            candidate_error, candidate_warnings = compile_python(candidate)
+            # Accept a repair only if it compiles or moves the error further down the file
+            if candidate_error is None or (candidate_error.lineno or 0) > (error.lineno or 0):
+                fixes.append(f"line {error.lineno}: {description}")
+                code, error, compiler_warnings = candidate, candidate_error, candidate_warnings
+                break
+        else:
+            break
+
+    # A mechanical repair is a guess at the intent, so it goes to the model as a hint
+    hints = [f"{fix} (repaired locally)" for fix in fixes]
+    if error is not None:
+        return Report(code, fixes=fixes, diagnostics=hints + [f"line {error.lineno}: SyntaxError: {error.msg}"])
+
+    diagnostics = compiler_warnings + undefined_names(ast.parse(code))
+    # Compiling cleanly says nothing about logic bugs, so only an explicit skip_clean for
+    # code that was clean as submitted spares the upstream call
+    return Report(code, fixes=fixes, diagnostics=hints + diagnostics, resolved=skip_clean and not fixes and not diagnostics)
+
+
+@register_checker('brace')
+def check_braces(code, skip_clean=False):
+    """Report unbalanced brackets in C-like code; the model still does the fixing"""
+    stack = []
+    diagnostics = []
+    stripped = re.sub(r'"(\\.|[^"\\\n])*"|\'(\\.|[^\'\\\n])*\'|//[^\n]*|/\*.*?\*/', lambda m: re.sub(r'[^\n]', ' ', m.group(0)), code, flags=re.DOTALL)
+    for lineno, line in enumerate(stripped.splitlines(), 1):
+        for char in line:
+            if char in CLOSERS:
+                stack.append((char, lineno))
+            elif char in CLOSERS.values():
+                if stack and CLOSERS[stack[-1][0]] == char:
+                    stack.pop()
+                else:
+                    diagnostics.append(f"line {lineno}: unmatched '{char}'")
+    for char, lineno in stack:
+        diagnostics.append(f"line {lineno}: '{char}' was never closed")
+    return Report(code, diagnostics=diagnostics)
@@ -0,0 +1,210 @@
+"""Per-request profiling and slow-request tracing.
+
+A profiled request has the stack of its thread sampled every few
+milliseconds from one background thread. The samples are written as
+collapsed stacks (one `outer;...;inner count` line per distinct stack),
+ready for flamegraph.pl or speedscope. Any request slower than a threshold
+logs a JSON trace of the stage timings it recorded. Nothing is hooked into
+the app unless one of these is turned on.
+
+Streamed responses are finished when their body has been sent, not when
+the view returns. Under the async server a profile samples the event loop
+thread, so it also shows whatever other requests ran on the loop meanwhile.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import itertools
+import logging
+import threading
+from collections import Counter
+
+from flask import g, request
+
+from metrics import current_trace
+
+logger = logging.getLogger('stark.profiling')
+
+
+def frame_label(frame):
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def collapse(frame):
+    """The stack ending at frame as a collapsed-stack line, outermost call first"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """Samples the stacks of registered threads every `interval` seconds.
+
+    Each registration gets its own Counter, so one thread can be sampled for
+    several overlapping requests (as on an event loop). The sampling thread
+    runs only while something is registered.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._samples = {}
+        self._handles = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        """Start sampling a thread, returning the handle to stop() it with"""
+        with self._lock:
+            handle = next(self._handles)
+            self._samples[handle] = (thread_id, Counter())
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+            return handle
+
+    def stop(self, handle):
+        """Stop a registration and return its Counter of collapsed stacks"""
+        with self._lock:
+            return self._samples.pop(handle, (None, Counter()))[1]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, counts in self._samples.values():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counts[collapse(frame)] += 1
+
+
+class ProfiledRequest:
+    """What is recorded about one request from begin() to finish()"""
+
+    def __init__(self, method, path, sample=None, file=None):
+        self.method = method
+        self.path = path
+        self.sample = sample
+        self.file = file
+        self.stages = []
+        self.started = time.perf_counter()
+
+
+class RequestProfiler:
+    """Profiles requests that ask for it (or are sampled) and traces slow ones.
+
+    A request is profiled when it sends `X-Profile` equal to `token`, or at
+    random for `sample_rate` of requests. Its collapsed stacks are written to
+    `directory`, of which only the newest `max_files` are kept, and the file
+    name is returned in an `X-Profile-File` header.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, token='', slow_seconds=0.0, interval=0.005, max_files=100):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.slow_seconds = slow_seconds
+        self.max_files = max_files
+        self.sampler = StackSampler(interval)
+        self._prune_lock = threading.Lock()
+
+    def install(self, app):
+        """Run first among the app's before-request hooks and last among its after-request ones"""
+        app.before_request_funcs.setdefault(None, []).insert(0, self._begin)
+        app.after_request_funcs.setdefault(None, []).insert(0, self._finish)
+        app.teardown_request(self._teardown)
+
+    def wants_profile(self, headers):
+        if self.token and headers.get('X-Profile') == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def begin(self, method, path, headers):
+        """Start tracing the request served on the current thread (or task), sampling it if it wants a profile"""
+        profile = ProfiledRequest(method, path)
+        current_trace.set(profile.stages)
+        if self.wants_profile(headers):
+            profile.sample = self.sampler.start(threading.get_ident())
+            name = path.strip('/').replace('/', '_') or 'index'
+            profile.file = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}.folded")
+        return profile
+
+    def finish(self, profile, status):
+        """Stop sampling, write the profile and log the trace when the request was profiled or slow"""
+        seconds = time.perf_counter() - profile.started
+        if profile.sample is not None:
+            self.dump(self.sampler.stop(profile.sample), profile.file)
+        if profile.file is not None or (self.slow_seconds and seconds >= self.slow_seconds):
+            logger.warning(json.dumps(self.trace(profile, seconds, status)))
+
+    def _begin(self):
+        g.profile = self.begin(request.method, request.path, request.headers)
+
+    def _finish(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        if profile.file is not None:
+            response.headers['X-Profile-File'] = os.path.basename(profile.file)
+        if response.is_streamed:
+            # The body is generated after this hook returns; finish once it has been sent
+            response.call_on_close(lambda: self.finish(profile, response.status_code))
+        else:
+            self.finish(profile, response.status_code)
+        return response
+
+    def _teardown(self, exc=None):
+        # Stop sampling a request that failed before its after-request hooks ran
+        profile = g.pop('profile', None)
+        if profile is not None and profile.sample is not None:
+            self.sampler.stop(profile.sample)
+
+    def trace(self, profile, seconds, status):
+        """The structured trace of a request: its total time and time per stage"""
+        stages = {}
+        for name, stage_seconds in profile.stages:
+            entry = stages.setdefault(name, {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += stage_seconds
+            entry['count'] += 1
+        for entry in stages.values():
+            entry['seconds'] = round(entry['seconds'], 6)
+        trace = {
+            'event': 'slow_request' if self.slow_seconds and seconds >= self.slow_seconds else 'profiled_request',
+            'method': profile.method,
+            'path': profile.path,
+            'status': status,
+            'seconds': round(seconds, 6),
+            'stages': stages,
+        }
+        if profile.file is not None:
+            trace['profile'] = profile.file
+        return trace
+
+    def dump(self, stacks, path):
+        """Write collapsed stacks to path, then drop the oldest profiles beyond max_files"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        if self.max_files:
+            self.prune()
+
+    def prune(self):
+        with self._prune_lock:
+            try:
+                files = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory) if entry.name.endswith('.folded')]
+            except OSError:
+                return
+            for _, path in sorted(files)[:-self.max_files]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,435 @@
+import time
+import heapq
+import asyncio
+import random
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+INTERACTIVE = 0
+BATCH = 1
+
+current_priority = contextvars.ContextVar('current_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """Run the enclosed upstream calls at the given priority (INTERACTIVE or BATCH)"""
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class QueueFull(Exception):
+    """Raised when a call could not be scheduled within the allowed wait, or was still rate limited after its retries"""
+
+    def __init__(self, position, eta, message=None):
+        super().__init__(message or f"Error: Upstream quota is saturated. You are number {position + 1} in the queue; retry in about {int(eta) + 1} seconds.")
+        self.position = position
+        self.eta = eta
+
+
+class TokenBucket:
+    """Refills `rate` tokens per minute up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * 60.0 / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def drain(self, now):
+        """Empty the bucket, e.g. after the upstream reported a 429"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class DailyQuota:
+    """Counts calls per UTC day"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.day = None
+        self.used = 0
+
+    def _roll(self):
+        today = datetime.now(timezone.utc).date()
+        if today != self.day:
+            self.day = today
+            self.used = 0
+
+    def remaining(self):
+        self._roll()
+        return self.limit - self.used
+
+    def take(self):
+        self._roll()
+        self.used += 1
+
+    def seconds_until_reset(self):
+        now = datetime.now(timezone.utc)
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+        return (tomorrow - now).total_seconds()
+
+
+class ApiKey:
+    """One API key with its own quota counters, 429 cooldown and health"""
+
+    def __init__(self, secret, requests_per_minute=0, requests_per_day=0):
+        self.secret = secret
+        self.bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.daily = DailyQuota(requests_per_day) if requests_per_day else None
+        self.cooling_until = 0.0
+        self.disabled_until = 0.0
+        self.strikes = 0
+        self.stats = {'calls': 0, 'rate_limited': 0, 'refused': 0}
+
+    @property
+    def label(self):
+        """How the key is shown in stats and metrics: only its last four characters"""
+        if not self.secret:
+            return 'default'
+        return '...' + self.secret[-4:]
+
+    def state(self, now):
+        if now < self.disabled_until:
+            return 'disabled'
+        if self.daily is not None and self.daily.remaining() <= 0:
+            return 'exhausted'
+        if now < self.cooling_until:
+            return 'cooling'
+        return 'healthy'
+
+    def usable(self, now):
+        """Whether the key will be usable again today (it may still be cooling down)"""
+        return self.state(now) in ('healthy', 'cooling')
+
+    def wait_time(self, now):
+        """Seconds until the key may be used"""
+        if self.daily is not None and self.daily.remaining() <= 0:
+            return self.daily.seconds_until_reset()
+        wait = max(0.0, self.cooling_until - now, self.disabled_until - now)
+        if self.bucket is not None:
+            wait = max(wait, self.bucket.wait_time(now))
+        return wait
+
+    def headroom(self):
+        """Share of the per-minute and per-day quota left, with the least used key winning ties"""
+        minute = self.bucket.tokens / self.bucket.capacity if self.bucket is not None else 1.0
+        day = self.daily.remaining() / self.daily.limit if self.daily is not None else 1.0
+        return (minute, day, -self.stats['calls'])
+
+    def take(self, now):
+        if self.bucket is not None:
+            self.bucket.take(now)
+        if self.daily is not None:
+            self.daily.take()
+        self.stats['calls'] += 1
+
+
+class KeyPool:
+    """API keys sharing the outbound calls, each with its own quota.
+
+    Every call goes out on the ready key with the most headroom, so the
+    aggregate rate is the per-key rate times the number of keys. A key that
+    gets a 429 cools down for the Retry-After (or an exponential backoff)
+    while the others carry on; one refused with 401/403 is disabled for
+    `disable_seconds`.
+    """
+
+    def __init__(self, secrets, requests_per_minute=0, requests_per_day=0, backoff_base=1.0, backoff_cap=30.0, disable_seconds=600.0):
+        self.keys = [ApiKey(secret, requests_per_minute, requests_per_day) for secret in secrets or [None]]
+        self.requests_per_minute = requests_per_minute
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.disable_seconds = disable_seconds
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def wait_time(self, now):
+        """Seconds until any key may be used"""
+        with self._lock:
+            return min(key.wait_time(now) for key in self.keys)
+
+    def take(self, now):
+        """Count a call against the ready key with the most headroom and return it; None when no key is ready"""
+        with self._lock:
+            ready = [key for key in self.keys if key.wait_time(now) == 0]
+            if not ready:
+                return None
+            key = max(ready, key=ApiKey.headroom)
+            key.take(now)
+            return key
+
+    def choose(self):
+        """A key for a call that no scheduler paces: the best ready one, else the one ready soonest"""
+        now = time.monotonic()
+        with self._lock:
+            key = self.take(now)
+            if key is None:
+                key = min(self.keys, key=lambda key: key.wait_time(now))
+                key.take(now)
+            return key
+
+    def report(self, key, status, retry_after=None):
+        """Record how the upstream answered a call made with key"""
+        now = time.monotonic()
+        with self._lock:
+            if status == 429:
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = min(self.backoff_cap, self.backoff_base * 2 ** key.strikes)
+                key.strikes += 1
+                key.stats['rate_limited'] += 1
+                # Jittered, so keys cooled down together do not all come back at once
+                key.cooling_until = max(key.cooling_until, now + delay * random.uniform(0.5, 1.0))
+            elif status in (401, 403):
+                key.stats['refused'] += 1
+                key.disabled_until = now + self.disable_seconds
+            elif status == 200:
+                key.strikes = 0
+
+    def usable(self, now):
+        """Keys still able to serve calls today"""
+        with self._lock:
+            return [key for key in self.keys if key.usable(now)]
+
+    def available(self, now):
+        """Number of keys that may be used right now"""
+        with self._lock:
+            return sum(1 for key in self.keys if key.state(now) == 'healthy')
+
+    def exhausted(self):
+        """Whether every key has used up its daily quota"""
+        with self._lock:
+            return all(key.daily is not None and key.daily.remaining() <= 0 for key in self.keys)
+
+    def rate(self, now):
+        """Aggregate calls per minute of the usable keys"""
+        return self.requests_per_minute * max(1, len(self.usable(now)))
+
+    def capacity(self, now):
+        """Aggregate burst of the usable keys"""
+        return sum(key.bucket.capacity for key in self.usable(now) if key.bucket is not None)
+
+    def tokens(self, now):
+        """Calls that could go out right now across the keys"""
+        with self._lock:
+            tokens = 0.0
+            for key in self.keys:
+                if key.bucket is not None and key.state(now) == 'healthy':
+                    key.bucket._refill(now)
+                    tokens += max(0.0, key.bucket.tokens)
+            return tokens
+
+    def daily_remaining(self):
+        """Calls left today across the keys, or None without a daily quota"""
+        now = time.monotonic()
+        with self._lock:
+            if self.keys[0].daily is None:
+                return None
+            return sum(max(0, key.daily.remaining()) for key in self.keys if now >= key.disabled_until)
+
+    def seconds_until_reset(self):
+        return self.keys[0].daily.seconds_until_reset() if self.keys[0].daily is not None else 0.0
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = []
+            for key in self.keys:
+                entry = dict(key.stats, key=key.label, state=key.state(now), wait_seconds=round(key.wait_time(now), 2))
+                if key.bucket is not None:
+                    entry['tokens'] = round(key.bucket.tokens, 2)
+                if key.daily is not None:
+                    entry['daily_remaining'] = key.daily.remaining()
+                stats.append(entry)
+        return stats
+
+
+class Scheduler:
+    """Paces outbound calls to the per-minute and per-day quota of a KeyPool.
+
+    Waiting calls are served in priority order (interactive before batch,
+    then first come first served). A call that would wait longer than
+    `max_wait` seconds gets a QueueFull with its position and ETA instead.
+    Without `keys`, a pool of one key with the given limits is paced.
+    Coroutines use acquire_async() and backoff_async(), which wait on the
+    event loop, checking at least every `poll_interval` seconds.
+    """
+
+    def __init__(self, requests_per_minute, requests_per_day=0, max_wait=20, max_retries=3, backoff_base=1.0, backoff_cap=30.0, keys=None, poll_interval=0.1):
+        if keys is None:
+            keys = KeyPool([None], requests_per_minute, requests_per_day, backoff_base, backoff_cap)
+        self.keys = keys
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self._queue = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {'scheduled': 0, 'rejected': 0, 'retries': 0}
+
+    def _position(self, ticket):
+        return sum(1 for other in self._queue if other < ticket)
+
+    def _eta(self, position, now):
+        """Estimated seconds until the call at `position` gets a token"""
+        return self.keys.wait_time(now) + position * 60.0 / self.keys.rate(now)
+
+    def _remove(self, ticket):
+        self._queue.remove(ticket)
+        heapq.heapify(self._queue)
+        self._cond.notify_all()
+
+    def _enqueue(self, level):
+        """Queue a ticket for a call (with the lock held), raising QueueFull when no key has quota left today"""
+        if self.keys.exhausted():
+            self._stats['rejected'] += 1
+            raise QueueFull(len(self._queue), self.keys.seconds_until_reset())
+        ticket = (level, next(self._sequence))
+        heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _step(self, ticket, deadline):
+        """Try to schedule a queued ticket (with the lock held).
+
+        Returns (key, 0) once the call may go, or (None, seconds to wait
+        before trying again); raises QueueFull when it would miss the deadline.
+        """
+        now = time.monotonic()
+        position = self._position(ticket)
+        eta = self._eta(position, now)
+        if now + eta > deadline:
+            self._remove(ticket)
+            self._stats['rejected'] += 1
+            raise QueueFull(position, eta)
+
+        if position == 0:
+            key = self.keys.take(now)
+            if key is not None:
+                heapq.heappop(self._queue)
+                self._stats['scheduled'] += 1
+                self._cond.notify_all()
+                return key, 0.0
+            return None, self.keys.wait_time(now)
+        return None, eta
+
+    def acquire(self, level=None):
+        """Block until this call may go upstream and return the ApiKey to send it with.
+
+        Raises QueueFull if that would take too long.
+        """
+        level = current_priority.get() if level is None else level
+        with self._cond:
+            ticket = self._enqueue(level)
+            deadline = time.monotonic() + self.max_wait
+            while True:
+                key, wait = self._step(ticket, deadline)
+                if key is not None:
+                    return key
+                self._cond.wait(wait)
+
+    async def acquire_async(self, level=None):
+        """Like acquire, but waits on the event loop instead of blocking a thread"""
+        level = current_priority.get() if level is None else level
+        with self._cond:
+            ticket = self._enqueue(level)
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                with self._cond:
+                    key, wait = self._step(ticket, deadline)
+                if key is not None:
+                    return key
+                # Threads that give up their place notify a Condition the event loop cannot
+                # wait on, so look again after at most poll_interval
+                await asyncio.sleep(min(wait, self.poll_interval))
+        except asyncio.CancelledError:
+            with self._cond:
+                if ticket in self._queue:
+                    self._remove(ticket)
+            raise
+
+    def estimate_wait(self, calls=1, level=None):
+        """Seconds until `calls` more calls at this priority would all have been sent upstream"""
+        level = current_priority.get() if level is None else level
+        with self._cond:
+            daily_remaining = self.keys.daily_remaining()
+            if daily_remaining is not None and daily_remaining < calls:
+                return self.keys.seconds_until_reset()
+            ahead = sum(1 for other_level, _ in self._queue if other_level <= level)
+            now = time.monotonic()
+            return max(0.0, ahead + calls - self.keys.tokens(now)) * 60.0 / self.keys.rate(now)
+
+    def idle_wait(self, calls=1):
+        """Seconds `calls` calls would take to schedule with nothing queued and full buckets"""
+        now = time.monotonic()
+        return max(0, calls - self.keys.capacity(now)) * 60.0 / self.keys.rate(now)
+
+    def try_acquire(self):
+        """Take a key only if one is free right now and nobody is waiting for it; None otherwise"""
+        with self._cond:
+            if self._queue:
+                return None
+            key = self.keys.take(time.monotonic())
+            if key is not None:
+                self._stats['scheduled'] += 1
+            return key
+
+    def _retry_wait(self):
+        with self._cond:
+            self._stats['retries'] += 1
+            return self.keys.wait_time(time.monotonic())
+
+    def backoff(self):
+        """Sleep before retrying a call that got a 429 until some key may be used again.
+
+        The key that got the 429 has already been cooled down in the pool, so
+        while other keys are ready the retry goes out at once on one of them.
+        """
+        wait = self._retry_wait()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def backoff_async(self):
+        """Like backoff, but sleeps on the event loop"""
+        wait = self._retry_wait()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queued'] = len(self._queue)
+            stats['queued_interactive'] = sum(1 for level, _ in self._queue if level == INTERACTIVE)
+            now = time.monotonic()
+            stats['tokens'] = round(self.keys.tokens(now), 2)
+            stats['requests_per_minute'] = self.keys.rate(now)
+            daily_remaining = self.keys.daily_remaining()
+            if daily_remaining is not None:
+                stats['daily_remaining'] = daily_remaining
+        stats['keys'] = self.keys.stats()
+        return stats
@@ -0,0 +1,265 @@
+"""Repository-scale analysis.
+
+Walks a directory or a zip/tar archive one file at a time, filters and
+pre-analyzes the candidates in a process pool (in priority order), and
+hands the files that still need the model to a fix function.
+
+    python repo_scan.py path/to/project            # or project.zip, project.tar.gz
+    python repo_scan.py project.zip --format patch --concurrency 4 > results.ndjson
+"""
+import os
+import sys
+import json
+import tarfile
+import zipfile
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from preanalysis import Report, analyze_code
+
+# Extension -> (language name reported to the client, pre-analysis checker)
+LANGUAGES = {
+    '.py': ('python', 'python'),
+    '.js': ('javascript', 'brace'),
+    '.mjs': ('javascript', 'brace'),
+    '.jsx': ('javascript', 'brace'),
+    '.ts': ('typescript', 'brace'),
+    '.tsx': ('typescript', 'brace'),
+    '.java': ('java', 'brace'),
+    '.kt': ('kotlin', 'brace'),
+    '.go': ('go', 'brace'),
+    '.rs': ('rust', 'brace'),
+    '.c': ('c', 'brace'),
+    '.h': ('c', 'brace'),
+    '.cc': ('cpp', 'brace'),
+    '.cpp': ('cpp', 'brace'),
+    '.hpp': ('cpp', 'brace'),
+    '.cs': ('csharp', 'brace'),
+    '.swift': ('swift', 'brace'),
+    '.php': ('php', 'brace'),
+    '.rb': ('ruby', None),
+    '.sh': ('shell', None),
+}
+
+# Languages with the most thorough local checks go first, then by file size
+LANGUAGE_PRIORITY = ['python', 'javascript', 'typescript', 'go', 'java', 'c', 'cpp', 'rust', 'csharp', 'kotlin', 'swift', 'php', 'ruby', 'shell']
+
+# Tar members are copied here in archive order; past this size the copy moves to a temporary file
+TAR_SPOOL_MEMORY_BYTES = 32 * 1024 * 1024
+
+SKIP_DIRS = {'.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv', 'env', 'dist', 'build', 'vendor', 'third_party', '.tox', '.mypy_cache'}
+
+
+class SourceFile:
+    """A candidate file: its path inside the project, declared size, and how to read it (None if it was not kept)"""
+
+    def __init__(self, path, size, read):
+        self.path = path
+        self.size = size
+        self.read = read
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.path)[1].lower()
+
+    @property
+    def language(self):
+        return LANGUAGES[self.extension][0]
+
+
+def is_candidate(path):
+    parts = path.replace('\\', '/').split('/')
+    if any(part in SKIP_DIRS for part in parts[:-1]):
+        return False
+    return os.path.splitext(parts[-1])[1].lower() in LANGUAGES
+
+
+def directory_files(root, max_bytes):
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories[:] = sorted(d for d in subdirectories if d not in SKIP_DIRS)
+        for filename in sorted(files):
+            full_path = os.path.join(directory, filename)
+            path = os.path.relpath(full_path, root).replace(os.sep, '/')
+            if not is_candidate(path) or os.path.islink(full_path):
+                continue
+
+            def read(full_path=full_path):
+                with open(full_path, 'rb') as f:
+                    return f.read(max_bytes + 1)
+            yield SourceFile(path, os.path.getsize(full_path), read)
+
+
+def zip_files(archive, max_bytes):
+    for info in archive.infolist():
+        if info.is_dir() or not is_candidate(info.filename):
+            continue
+
+        def read(info=info):
+            with archive.open(info) as f:
+                return f.read(max_bytes + 1)
+        yield SourceFile(info.filename, info.file_size, read)
+
+
+def tar_files(archive, max_bytes, max_files=None):
+    """Copy the candidate members to a spool in archive order.
+
+    Reading a compressed tar out of order decompresses it again from the
+    start for every backward seek, so the files are read once, in order,
+    before they are prioritized. Only the first max_files candidates are
+    kept, so the spool stays bounded however many members the archive has;
+    the rest are listed without a way to read them.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=TAR_SPOOL_MEMORY_BYTES)
+    kept = 0
+    for member in archive:
+        if not member.isfile() or not is_candidate(member.name):
+            continue
+        if max_files is not None and kept >= max_files:
+            yield SourceFile(member.name, member.size, None)
+            continue
+        kept += 1
+        offset = spool.tell()
+        if member.size <= max_bytes:
+            with archive.extractfile(member) as f:
+                spool.write(f.read(max_bytes + 1))
+        length = spool.tell() - offset
+
+        def read(offset=offset, length=length):
+            spool.seek(offset)
+            return spool.read(length)
+        yield SourceFile(member.name, member.size, read)
+
+
+def open_source(source, max_bytes, max_files=None):
+    """List the candidate files of a directory path, or of a zip/tar archive given as a path or seekable file.
+
+    For directories and zip archives only the index is read here; file
+    contents are read one at a time, capped at max_bytes + 1, when the
+    file's turn comes. Tar archives are read through once, in order, keeping
+    the contents of at most max_files candidates.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if os.path.isdir(source):
+            return list(directory_files(source, max_bytes))
+        if not os.path.isfile(source):
+            raise ValueError(f"No such file or directory: {source}")
+    if zipfile.is_zipfile(source):
+        return list(zip_files(zipfile.ZipFile(source), max_bytes))
+    try:
+        if hasattr(source, 'read'):
+            source.seek(0)
+            archive = tarfile.open(fileobj=source, mode='r:*')
+        else:
+            archive = tarfile.open(source, mode='r:*')
+    except tarfile.TarError:
+        raise ValueError('Expected a directory, a zip archive or a (compressed) tar archive')
+    return list(tar_files(archive, max_bytes, max_files))
+
+
+def prioritize(files):
+    """Order files by language priority, then smallest first so results start flowing early; files that were not kept go last"""
+    rank = {language: index for index, language in enumerate(LANGUAGE_PRIORITY)}
+    return sorted(files, key=lambda f: (f.read is None, rank.get(f.language, len(rank)), f.size, f.path))
+
+
+def prefilter(path, data, checker, max_bytes, preanalysis=True, skip_clean=False):
+    """Decode and pre-analyze one file; runs in a worker process.
+
+    Returns a dict with the path, a status of 'skipped', 'clean' or 'pending'
+    and, for files that need the model, the preanalysis Report.
+    """
+    if len(data) > max_bytes:
+        return {'path': path, 'status': 'skipped', 'reason': f'larger than {max_bytes} bytes'}
+    if b'\0' in data:
+        return {'path': path, 'status': 'skipped', 'reason': 'binary file'}
+    try:
+        code = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return {'path': path, 'status': 'skipped', 'reason': 'not UTF-8 text'}
+    if not code.strip():
+        return {'path': path, 'status': 'skipped', 'reason': 'empty file'}
+
+    report = analyze_code(code, checker, skip_clean=skip_clean) if preanalysis else Report(code, checker)
+    if report.resolved and report.code == code:
+        return {'path': path, 'status': 'clean'}
+    return {'path': path, 'status': 'pending', 'code': code, 'report': report}
+
+
+process_pools = {}
+process_pools_lock = threading.Lock()
+
+
+def process_pool(processes):
+    """The pre-analysis pool of this size, shared by every scan and started on first use.
+
+    Its workers are spawned rather than forked, so they do not inherit the
+    threads and held locks of a threaded server. Spawned workers re-import
+    the __main__ module, so a script that scans with a pool must keep its
+    top-level code under an `if __name__ == '__main__':` guard.
+    """
+    with process_pools_lock:
+        if processes not in process_pools:
+            process_pools[processes] = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        return process_pools[processes]
+
+
+def prefiltered(files, max_bytes, processes=0, preanalysis=True, skip_clean=False):
+    """Yield prefilter results in priority order, keeping a bounded window of files in the process pool.
+
+    With processes=0 the files are pre-analyzed inline.
+    """
+    def submit(executor, source_file):
+        if source_file.size > max_bytes:
+            # Skip without reading it
+            future = Future()
+            future.set_result({'path': source_file.path, 'status': 'skipped', 'reason': f'larger than {max_bytes} bytes'})
+            return future
+        args = (source_file.path, source_file.read(), LANGUAGES[source_file.extension][1], max_bytes, preanalysis, skip_clean)
+        if executor is None:
+            future = Future()
+            future.set_result(prefilter(*args))
+            return future
+        return executor.submit(prefilter, *args)
+
+    executor = process_pool(processes) if processes else None
+    window = deque()
+    try:
+        for source_file in files:
+            window.append((source_file, submit(executor, source_file)))
+            if len(window) >= 2 * max(1, processes):
+                head, future = window.popleft()
+                yield dict(future.result(), language=head.language)
+        while window:
+            head, future = window.popleft()
+            yield dict(future.result(), language=head.language)
+    finally:
+        # The pool is shared: only drop this scan's queued files
+        for _, future in window:
+            future.cancel()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('source', help='Project directory, zip archive or tar archive')
+    parser.add_argument('--format', choices=('full', 'patch', 'hunks'), default='patch', help='How to report each fix')
+    parser.add_argument('--concurrency', type=int, default=None, help='Files fixed at once')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    from app import scan_repository
+
+    try:
+        for result in scan_repository(args.source, args.format, args.concurrency):
+            print(json.dumps(result), flush=True)
+    except ValueError as e:
+        sys.exit(f"Error: {str(e)}")
+
+
+if __name__ == '__main__':
+    main()
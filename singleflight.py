@@ -0,0 +1,235 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+
+class SQLiteLeases:
+    """Cross-process leases stored next to the result cache so only one worker calls upstream per key"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._ready = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    conn.execute("""
+                        CREATE TABLE IF NOT EXISTS leases (
+                            key TEXT PRIMARY KEY,
+                            owner TEXT NOT NULL,
+                            expires_at REAL NOT NULL
+                        )
+                    """)
+                    self._ready = True
+        return conn
+
+    def _owner(self):
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def acquire(self, key, ttl, owner=None):
+        """Try to take the lease for key, returning True on success.
+
+        The owner defaults to the calling thread; pass one explicitly when the
+        lease is released from another thread.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute('DELETE FROM leases WHERE key = ? AND expires_at < ?', (key, now))
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)',
+            (key, owner or self._owner(), now + ttl)
+        )
+        return cursor.rowcount == 1
+
+    def held(self, key):
+        row = self._connect().execute(
+            'SELECT expires_at FROM leases WHERE key = ?', (key,)
+        ).fetchone()
+        return row is not None and row[0] >= time.time()
+
+    def release(self, key, owner=None):
+        self._connect().execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, owner or self._owner()))
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls onto one execution.
+
+    Threads in this process wait on a shared future, and coroutines (via
+    do_async) on a shared task. With `leases` and `cache`, other worker
+    processes wait for the leader's result to show up in the shared cache
+    instead of calling upstream themselves.
+    """
+
+    def __init__(self, leases=None, cache=None, lease_ttl=60, poll_interval=0.05):
+        self.leases = leases
+        self.cache = cache
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'followers': 0, 'remote_followers': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def do(self, key, func):
+        """Return func(), sharing one call among everybody asking for the same key at once"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            self._count('followers')
+            return future.result()
+
+        try:
+            result = self._lead(key, func)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    async def do_async(self, key, func):
+        """Coroutine counterpart of do(): return await func(), sharing one call among coroutines asking for the same key.
+
+        The shared call runs as its own task, so a caller that is cancelled
+        (say, its client went away) does not cancel it for the others.
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = asyncio.ensure_future(self._lead_async(key, func))
+                self._tasks[key] = task
+                task.add_done_callback(lambda _: self._forget(key, task))
+        if not leader:
+            self._count('followers')
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller was cancelled
+
+    def _lead(self, key, func):
+        if self.leases is None or self.cache is None:
+            self._count('leaders')
+            return func()
+
+        while True:
+            try:
+                acquired = self.leases.acquire(key, self.lease_ttl)
+            except sqlite3.Error:
+                acquired = True  # Fall back to an uncoordinated call if the store is unavailable
+
+            if acquired:
+                try:
+                    # Another process may have finished between our cache miss and the lease
+                    cached = self.cache.peek(key)
+                    if cached is not None:
+                        return cached
+                    self._count('leaders')
+                    return func()
+                finally:
+                    try:
+                        self.leases.release(key)
+                    except sqlite3.Error:
+                        pass
+
+            self._count('remote_followers')
+            result = self._wait_for_remote(key)
+            if result is not None:
+                return result
+            # The other process gave up without caching a result; try to lead ourselves
+
+    async def _lead_async(self, key, func):
+        if self.leases is None or self.cache is None:
+            self._count('leaders')
+            return await func()
+
+        # The lease is taken and released from different executor threads
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        while True:
+            try:
+                acquired = await asyncio.to_thread(self.leases.acquire, key, self.lease_ttl, owner)
+            except sqlite3.Error:
+                acquired = True
+
+            if acquired:
+                try:
+                    cached = await asyncio.to_thread(self.cache.peek, key)
+                    if cached is not None:
+                        return cached
+                    self._count('leaders')
+                    return await func()
+                finally:
+                    try:
+                        await asyncio.to_thread(self.leases.release, key, owner)
+                    except sqlite3.Error:
+                        pass
+
+            self._count('remote_followers')
+            deadline = time.time() + self.lease_ttl
+            while time.time() < deadline:
+                finished, result = await asyncio.to_thread(self._check_remote, key)
+                if finished:
+                    break
+                await asyncio.sleep(self.poll_interval)
+            else:
+                result = None
+            if result is not None:
+                return result
+
+    def _check_remote(self, key):
+        """(finished, result) for a key led by another process: finished once it is cached or the lease is gone"""
+        cached = self.cache.peek(key)
+        if cached is not None:
+            return True, cached
+        try:
+            if not self.leases.held(key):
+                return True, self.cache.peek(key)
+        except sqlite3.Error:
+            return True, None
+        return False, None
+
+    def _wait_for_remote(self, key):
+        deadline = time.time() + self.lease_ttl
+        while time.time() < deadline:
+            finished, result = self._check_remote(key)
+            if finished:
+                return result
+            time.sleep(self.poll_interval)
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['in_flight'] = len(self._calls) + len(self._tasks)
+        return stats
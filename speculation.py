@@ -0,0 +1,86 @@
+"""Speculative background work.
+
+A result the client is likely to ask for next is started as soon as the
+request that makes it likely has been answered. A later request for the same
+key joins the computation still in flight; a finished one has left its
+result in the cache. Speculation spends credit that each opportunity earns at
+a fixed ratio, and is skipped whenever the server reports it is busy.
+"""
+import threading
+import contextvars
+
+from hedging import HedgeBudget
+from metrics import record_speculation
+
+
+class Speculator:
+    """Runs speculative calls on an executor, at most `max_in_flight` at a time.
+
+    `budget` is the share of opportunities that may be taken; `busy()` is
+    asked before each one and vetoes it when it returns True.
+    """
+
+    def __init__(self, executor, budget=0.5, max_in_flight=4, busy=None):
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.busy = busy
+        self.budget = HedgeBudget(budget, burst=max(1.0, budget * 10))
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._stats = {'started': 0, 'joined': 0, 'busy': 0, 'over_budget': 0}
+
+    def _skip(self, reason):
+        self._stats[reason] += 1
+        record_speculation('skipped')
+        return False
+
+    def submit(self, key, func, *args):
+        """Start func(*args) in the background under key, returning whether it was started"""
+        with self._lock:
+            self.budget.earn()
+            if key in self._futures:
+                return False
+            if len(self._futures) >= self.max_in_flight or (self.busy is not None and self.busy()):
+                return self._skip('busy')
+            if not self.budget.spend():
+                return self._skip('over_budget')
+            future = self.executor.submit(contextvars.copy_context().run, func, *args)
+            self._futures[key] = future
+            self._stats['started'] += 1
+        record_speculation('started')
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return True
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def pending(self, key):
+        """The future of the speculation running under key, or None"""
+        with self._lock:
+            return self._futures.get(key)
+
+    def joined(self):
+        with self._lock:
+            self._stats['joined'] += 1
+        record_speculation('joined')
+
+    def join(self, key, timeout=None):
+        """Wait for the speculation running under key; None when there is none or it failed"""
+        future = self.pending(key)
+        if future is None:
+            return None
+        try:
+            result = future.result(timeout)
+        except Exception:
+            return None
+        self.joined()
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._futures)
+            stats['credit'] = round(self.budget.credit, 2)
+        return stats
@@ -0,0 +1,226 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const buggyCodeTextarea = document.getElementById('buggy-code');
+    const fixedCodeElement = document.getElementById('fixed-code');
+    const fixCodeBtn = document.getElementById('fix-code-btn');
+    const explainCodeBtn = document.getElementById('explain-code-btn');
+    const copyCodeBtn = document.getElementById('copy-code-btn');
+    const loadingElement = document.getElementById('loading');
+    const loadingTextElement = document.getElementById('loading-text');
+    const explanationPanel = document.getElementById('explanation-panel');
+    const explanationContainer = document.getElementById('explanation-container');
+    const clearInputBtn = document.getElementById('clear-input');
+    const fullscreenBtn = document.getElementById('fullscreen-btn');
+    const progressFill = document.querySelector('.progress-fill');
+
+    let originalCode = '';
+    let fixedCode = '';
+
+    // Identifies this tab's document so re-submissions only resend changed code
+    let documentId = sessionStorage.getItem('stark-document-id');
+    if (!documentId) {
+        documentId = window.crypto && crypto.randomUUID
+            ? crypto.randomUUID()
+            : Date.now().toString(36) + Math.random().toString(36).slice(2);
+        sessionStorage.setItem('stark-document-id', documentId);
+    }
+
+    // Initially hide the explanation panel
+    explanationPanel.style.display = 'none';
+
+    // Clear input button functionality
+    clearInputBtn.addEventListener('click', function() {
+        buggyCodeTextarea.value = '';
+        buggyCodeTextarea.focus();
+    });
+
+    // Fullscreen functionality
+    fullscreenBtn.addEventListener('click', function() {
+        const codeContainer = document.querySelector('.output-panel');
+        if (!document.fullscreenElement) {
+            if (codeContainer.requestFullscreen) {
+                codeContainer.requestFullscreen();
+            } else if (codeContainer.mozRequestFullScreen) {
+                codeContainer.mozRequestFullScreen();
+            } else if (codeContainer.webkitRequestFullscreen) {
+                codeContainer.webkitRequestFullscreen();
+            } else if (codeContainer.msRequestFullscreen) {
+                codeContainer.msRequestFullscreen();
+            }
+        } else {
+            if (document.exitFullscreen) {
+                document.exitFullscreen();
+            } else if (document.mozCancelFullScreen) {
+                document.mozCancelFullScreen();
+            } else if (document.webkitExitFullscreen) {
+                document.webkitExitFullscreen();
+            } else if (document.msExitFullscreen) {
+                document.msExitFullscreen();
+            }
+        }
+    });
+
+    // POST a JSON body and read the Server-Sent Events response,
+    // calling onChunk for every text fragment as it arrives
+    async function streamCompletion(url, body, onChunk) {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify(body)
+        });
+
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || 'Unknown error');
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let payload = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        payload += line.slice(5).trim();
+                    }
+                });
+
+                const data = JSON.parse(payload);
+                if (event === 'error') {
+                    throw new Error(data.error);
+                } else if (event === 'done') {
+                    return data;
+                }
+                onChunk(data.text);
+            }
+        }
+        throw new Error('Stream ended unexpectedly');
+    }
+
+    function hideLoading() {
+        progressFill.style.width = '100%';
+        loadingElement.style.display = 'none';
+    }
+
+    fixCodeBtn.addEventListener('click', async function() {
+        originalCode = buggyCodeTextarea.value.trim();
+
+        if (!originalCode) {
+            alert('Please enter some code to analyze');
+            return;
+        }
+
+        // Show loading until the first chunk arrives
+        loadingElement.style.display = 'flex';
+        loadingTextElement.textContent = 'Analyzing code structure...';
+        progressFill.style.width = '0%';
+
+        // Hide explanation panel when starting a new debug
+        explanationPanel.style.display = 'none';
+
+        // Disable explain button initially
+        explainCodeBtn.disabled = true;
+        copyCodeBtn.disabled = true;
+        fixedCode = '';
+
+        try {
+            let streamed = '';
+            const data = await streamCompletion('/api/fix_code/stream', { code: originalCode, document_id: documentId }, text => {
+                if (!streamed) {
+                    hideLoading();
+                }
+                streamed += text;
+                fixedCodeElement.textContent = streamed;
+            });
+
+            fixedCode = data.fixed_code;
+            fixedCodeElement.textContent = fixedCode;
+
+            // Enable buttons after successful fix
+            explainCodeBtn.disabled = false;
+            copyCodeBtn.disabled = false;
+        } catch (error) {
+            fixedCodeElement.textContent = `Error: ${error.message}`;
+        } finally {
+            hideLoading();
+        }
+    });
+
+    explainCodeBtn.addEventListener('click', async function() {
+        if (!originalCode || !fixedCode) {
+            alert('Please debug the code first');
+            return;
+        }
+
+        // Show loading until the first chunk arrives
+        loadingElement.style.display = 'flex';
+        loadingTextElement.textContent = 'Generating technical analysis...';
+        progressFill.style.width = '0%';
+
+        try {
+            let streamed = '';
+            const data = await streamCompletion('/api/explain_changes/stream', {
+                original_code: originalCode,
+                fixed_code: fixedCode
+            }, text => {
+                if (!streamed) {
+                    hideLoading();
+                    explanationPanel.style.display = 'block';
+                }
+                streamed += text;
+                explanationContainer.innerHTML = streamed;
+            });
+
+            explanationContainer.innerHTML = data.explanation;
+            explanationPanel.style.display = 'block';
+        } catch (error) {
+            explanationContainer.innerHTML = `<p class="error">Error: ${error.message}</p>`;
+            explanationPanel.style.display = 'block';
+        } finally {
+            hideLoading();
+        }
+    });
+
+    copyCodeBtn.addEventListener('click', function() {
+        if (!fixedCode) {
+            return;
+        }
+
+        // Create a temporary textarea to copy the text
+        const tempTextarea = document.createElement('textarea');
+        tempTextarea.value = fixedCode;
+        document.body.appendChild(tempTextarea);
+        tempTextarea.select();
+
+        try {
+            document.execCommand('copy');
+            // Show temporary success message
+            const originalText = copyCodeBtn.textContent;
+            copyCodeBtn.textContent = 'Copied!';
+            setTimeout(() => {
+                copyCodeBtn.textContent = originalText;
+            }, 2000);
+        } catch (err) {
+            console.error('Failed to copy: ', err);
+        } finally {
+            document.body.removeChild(tempTextarea);
+        }
+    });
+});
@@ -0,0 +1,64 @@
+import time
+
+from cache import MemoryTier, ResultCache, SQLiteTier
+
+
+def test_memory_tier_evicts_least_recently_used():
+    tier = MemoryTier(max_entries=2)
+    expires_at = time.time() + 60
+    tier.set('a', 'A', expires_at)
+    tier.set('b', 'B', expires_at)
+    assert tier.get('a') == 'A'
+    tier.set('c', 'C', expires_at)
+    assert tier.get('b') is None
+    assert tier.get('a') == 'A'
+    assert tier.get('c') == 'C'
+
+
+def test_memory_tier_drops_expired_entries():
+    tier = MemoryTier()
+    tier.set('a', 'A', time.time() - 1)
+    assert tier.get('a') is None
+    assert len(tier) == 0
+
+
+def test_sqlite_tier_stays_under_size_cap(tmp_path):
+    tier = SQLiteTier(str(tmp_path / 'cache.db'), max_bytes=16000)
+    for index in range(100):
+        tier.set(f'k{index}', 'x' * 1000, time.time() + 60)
+    total = tier._connect().execute('SELECT SUM(size) FROM results').fetchone()[0]
+    assert total <= 16000
+    assert tier.get('k99') is not None
+    assert tier.get('k0') is None
+
+
+def test_sqlite_tier_evicts_least_recently_read(tmp_path):
+    tier = SQLiteTier(str(tmp_path / 'cache.db'), max_bytes=16000)
+    for index in range(16):
+        tier.set(f'k{index}', 'x' * 1000, time.time() + 60)
+    conn = tier._connect()
+    for index in range(16):
+        conn.execute('UPDATE results SET accessed_at = ? WHERE key = ?', (index, f'k{index}'))
+    assert tier.get('k0') is not None
+    tier.set('k16', 'x' * 1000, time.time() + 60)
+    assert tier.get('k0') is not None
+    assert tier.get('k1') is None
+
+
+def test_sqlite_tier_does_not_touch_recently_read_rows(tmp_path):
+    tier = SQLiteTier(str(tmp_path / 'cache.db'))
+    tier.set('k', 'v', time.time() + 60)
+    conn = tier._connect()
+    stored = conn.execute('SELECT accessed_at FROM results WHERE key = ?', ('k',)).fetchone()[0]
+    assert tier.get('k')[0] == 'v'
+    assert conn.execute('SELECT accessed_at FROM results WHERE key = ?', ('k',)).fetchone()[0] == stored
+
+
+def test_result_cache_fills_memory_from_disk(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResultCache(path).set('key', 'value')
+    cache = ResultCache(path)
+    assert cache.get('key') == 'value'
+    assert cache.get('key') == 'value'
+    stats = cache.stats()
+    assert (stats['disk_hits'], stats['memory_hits'], stats['misses']) == (1, 1, 0)
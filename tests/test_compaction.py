@@ -0,0 +1,88 @@
+from compaction import Compaction, MARKER_PATTERN, compact
+
+LICENSE = """# Copyright (c) 2024 Example Corp.
+# Licensed under the MIT License.
+"""
+
+COMMENT = """    # Walk the list once, keeping a running total.
+    # Negative values are skipped on purpose:
+    # they mark entries that were refunded
+    # and must not count towards the total.
+"""
+
+TABLE = "RATES = [\n" + "".join(f"    {index}.5,\n" for index in range(40)) + "]\n"
+
+CODE = LICENSE + """
+import math
+""" + TABLE + """
+
+
+def total(values):
+""" + COMMENT + """    result = 0
+    for value in values:
+        if value >= 0:
+            result += value
+    return result
+"""
+
+
+def test_compaction_omits_comments_blank_runs_and_data():
+    compaction = compact(CODE, 'python')
+    assert compaction.compacted
+    assert compaction.tokens_saved > 0
+    assert 'Copyright' not in compaction.text
+    assert 'refunded' not in compaction.text
+    assert '39.5' not in compaction.text
+    assert '\n\n\n\n' not in compaction.text
+    assert len(compaction.blocks) == 3
+    assert compaction.header is not None
+
+
+def test_restore_puts_omitted_content_back_around_the_fix():
+    compaction = compact(CODE, 'python')
+    fixed = compaction.text.replace('if value >= 0:', 'if value > 0:')
+    assert compaction.restore(fixed) == CODE.replace('if value >= 0:', 'if value > 0:')
+
+
+def test_restore_accepts_a_fenced_reply():
+    compaction = compact(CODE, 'python')
+    # Stripping the fence also drops the final newline
+    assert compaction.restore('```python\n' + compaction.text + '```') == CODE.rstrip('\n')
+
+
+def test_restore_returns_none_when_a_placeholder_is_dropped():
+    compaction = compact(CODE, 'python')
+    fixed = ''.join(line for line in compaction.text.splitlines(keepends=True) if 'comment' not in line or not MARKER_PATTERN.search(line))
+    assert compaction.restore(fixed) is None
+
+
+def test_restore_puts_a_dropped_license_header_back_on_top():
+    compaction = compact("#!/usr/bin/env python\n" + CODE, 'python')
+    fixed = ''.join(line for line in compaction.text.splitlines(keepends=True) if 'license header' not in line)
+    restored = compaction.restore(fixed)
+    assert restored.startswith("#!/usr/bin/env python\n" + LICENSE)
+    assert restored == "#!/usr/bin/env python\n" + CODE
+
+
+def test_line_numbers_map_into_the_compacted_text():
+    compaction = compact(CODE, 'python')
+    original_line = CODE.splitlines().index('    for value in values:') + 1
+    compacted_line = compaction.line_number(original_line)
+    assert compacted_line < original_line
+    assert compaction.text.splitlines()[compacted_line - 1] == '    for value in values:'
+
+
+def test_uncompacted_code_passes_through():
+    code = "def f(a):\n    return a\n"
+    compaction = compact(code, 'python')
+    assert not compaction.compacted
+    assert compaction.restore('fixed') == 'fixed'
+    assert Compaction(code).restore(code) == code
+
+
+def test_brace_comments_are_compacted_and_restored():
+    code = "int f(int a) {\n" + "".join(f"    // note {index}\n" for index in range(6)) + "    return a\n}\n"
+    compaction = compact(code, 'brace')
+    assert 'note 3' not in compaction.text
+    fixed = compaction.text.replace('return a\n', 'return a;\n')
+    assert compaction.restore(fixed) == code.replace('return a\n', 'return a;\n')
@@ -0,0 +1,108 @@
+import re
+import random
+
+import pytest
+
+from diffing import Diff, diff_opcodes, token_edits
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@$')
+
+ORIGINAL = """import os
+
+
+def load(path):
+    with open(path) as f:
+        return f.read()
+
+
+def save(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def main():
+    data = load('in.txt')
+    save('out.txt', data)
+"""
+
+
+def apply_patch(original, patch):
+    """Apply a unified diff the way patch(1) would, without fuzz"""
+    old_lines = original.splitlines()
+    out = []
+    position = 0
+    lines = patch.splitlines()[2:]
+    for line in lines:
+        match = HUNK_HEADER.match(line)
+        if match:
+            start = int(match.group(1))
+            length = 1 if match.group(2) is None else int(match.group(2))
+            # A hunk that removes nothing starts after the line it names
+            start = start if length == 0 else start - 1
+            out.extend(old_lines[position:start])
+            position = start
+        elif line.startswith(' ') or line.startswith('-'):
+            assert old_lines[position] == line[1:]
+            if line.startswith(' '):
+                out.append(line[1:])
+            position += 1
+        else:
+            assert line.startswith('+')
+            out.append(line[1:])
+    out.extend(old_lines[position:])
+    return out
+
+
+def replay_opcodes(a, b, opcodes):
+    out = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+            out.extend(a[i1:i2])
+        else:
+            out.extend(b[j1:j2])
+    return out
+
+
+@pytest.mark.parametrize('fixed', [
+    ORIGINAL,
+    ORIGINAL.replace("with open(path) as f:", "with open(path, encoding='utf-8') as f:"),
+    ORIGINAL.replace("import os\n", ""),
+    ORIGINAL + "\n\nif __name__ == '__main__':\n    main()\n",
+    "#!/usr/bin/env python\n" + ORIGINAL.replace("    save('out.txt', data)\n", "    save('out.txt', data.strip())\n    return 0\n"),
+    "",
+])
+def test_unified_patch_round_trips(fixed):
+    patch = Diff(ORIGINAL, fixed).unified()
+    assert apply_patch(ORIGINAL, patch) == fixed.splitlines()
+    assert Diff(ORIGINAL, fixed).changed == (fixed != ORIGINAL)
+
+
+def test_random_edits_round_trip():
+    rng = random.Random(7)
+    original = ORIGINAL.splitlines()
+    for _ in range(200):
+        fixed = list(original)
+        for _ in range(rng.randint(1, 4)):
+            position = rng.randrange(len(fixed) + 1)
+            action = rng.choice(('insert', 'delete', 'replace'))
+            if action == 'insert' or not fixed:
+                fixed.insert(position, f"    x = {rng.random()}")
+            elif position < len(fixed):
+                if action == 'delete':
+                    del fixed[position]
+                else:
+                    fixed[position] = fixed[position].upper()
+        assert replay_opcodes(original, fixed, diff_opcodes(original, fixed)) == fixed
+        for context in (0, 3):
+            patch = Diff(ORIGINAL, '\n'.join(fixed) + '\n', context).unified()
+            assert apply_patch(ORIGINAL, patch) == fixed
+
+
+def test_hunks_carry_token_edits_for_lines_changed_in_place():
+    fixed = ORIGINAL.replace("return f.read()", "return f.read().strip()")
+    [hunk] = Diff(ORIGINAL, fixed).hunks()
+    assert hunk['old_lines'] == hunk['new_lines']
+    assert len(hunk['inline']) == 1
+    assert hunk['inline'][0]['old_line'] == 6
+    assert hunk['inline'][0]['edits'] == token_edits("        return f.read()", "        return f.read().strip()")
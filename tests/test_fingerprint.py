@@ -0,0 +1,69 @@
+import json
+
+from fingerprint import fingerprint
+
+ORIGINAL = """def total(values):
+    result = 0
+    for value in values
+        result += value
+    return result
+"""
+
+FIXED = ORIGINAL.replace("for value in values\n", "for value in values:\n")
+
+RENAMED = """def sum_all(items):
+    \"\"\"Add up the items\"\"\"
+    acc = 0  # running sum
+    for item in items
+        acc += item
+    return acc
+"""
+
+
+def stored_template(code, fixed_code):
+    """A fix template as it comes back out of the cache"""
+    return json.loads(json.dumps(fingerprint(code, 'python').template(fixed_code)))
+
+
+def test_renamed_and_reformatted_code_has_the_same_fingerprint():
+    assert fingerprint(ORIGINAL, 'python').key == fingerprint(RENAMED, 'python').key
+
+
+def test_different_code_has_a_different_fingerprint():
+    assert fingerprint(ORIGINAL, 'python').key != fingerprint(ORIGINAL.replace('= 0', '= 1'), 'python').key
+    assert fingerprint(ORIGINAL, 'python').key != fingerprint(ORIGINAL, 'brace').key
+
+
+def test_fix_replays_on_its_own_code():
+    assert fingerprint(ORIGINAL, 'python').apply(stored_template(ORIGINAL, FIXED)) == FIXED
+
+
+def test_fix_replays_on_a_near_duplicate_keeping_its_names_and_comments():
+    replayed = fingerprint(RENAMED, 'python').apply(stored_template(ORIGINAL, FIXED))
+    assert replayed == RENAMED.replace("for item in items\n", "for item in items:\n")
+
+
+def test_inserted_lines_take_the_callers_indentation():
+    fixed = ORIGINAL.replace("    result = 0\n", "    result = 0\n    values = list(values)\n").replace("values\n        result", "values:\n        result")
+    caller = ORIGINAL.replace("    ", "\t").replace("total", "grand_total")
+    replayed = fingerprint(caller, 'python').apply(stored_template(ORIGINAL, fixed))
+    assert replayed == "def grand_total(values):\n\tresult = 0\n\tvalues = list(values)\n\tfor value in values:\n\t\tresult += value\n\treturn result\n"
+
+
+def test_fix_that_does_not_fit_is_rejected():
+    other = "def total(values):\n    return sum(values)\n"
+    assert fingerprint(other, 'python').apply(stored_template(ORIGINAL, FIXED)) is None
+
+
+def test_crlf_line_endings_are_kept():
+    caller = RENAMED.replace("\n", "\r\n")
+    replayed = fingerprint(caller, 'python').apply(stored_template(ORIGINAL, FIXED))
+    assert replayed == RENAMED.replace("for item in items\n", "for item in items:\n").replace("\n", "\r\n")
+
+
+def test_brace_code_replays_across_formatting_and_comments():
+    original = "int add(int a, int b) {\n  return a + b\n}\n"
+    caller = "// adds two numbers\nint add(int a, int b)\n{\n    return a + b\n}\n"
+    assert fingerprint(original, 'brace').key == fingerprint(caller, 'brace').key
+    template = json.loads(json.dumps(fingerprint(original, 'brace').template(original.replace("a + b\n", "a + b;\n"))))
+    assert fingerprint(caller, 'brace').apply(template) == caller.replace("a + b\n", "a + b;\n")
@@ -0,0 +1,99 @@
+import time
+
+from jobs import DONE, FAILED, FINISHED, QUEUED, RUNNING, JobQueue, JobStore, RetryLater
+
+
+def finished(queue, job_id, timeout=5):
+    """Long-poll a job until it has finished"""
+    deadline = time.monotonic() + timeout
+    job = queue.get(job_id)
+    while job['status'] not in FINISHED and time.monotonic() < deadline:
+        job = queue.wait(job_id, job['version'], timeout=1)
+    return job
+
+
+def test_claim_takes_jobs_oldest_first(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    first = store.create('fix', {'code': 'a'})
+    time.sleep(0.01)
+    second = store.create('fix', {'code': 'b'})
+    assert store.claim('worker-1', lease_ttl=60)[:3] == (first, 'fix', {'code': 'a'})
+    assert store.claim('worker-2', lease_ttl=60)[0] == second
+    assert store.claim('worker-3', lease_ttl=60) is None
+
+
+def test_expired_lease_is_claimed_by_another_worker(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    job_id = store.create('fix', {'code': 'a'})
+    assert store.claim('worker-1', lease_ttl=0.05)[3] == 1
+    assert store.claim('worker-2', lease_ttl=60) is None
+    time.sleep(0.1)
+    claimed = store.claim('worker-2', lease_ttl=60)
+    assert claimed[0] == job_id
+    assert claimed[3] == 2
+    # The worker that lost the lease can no longer record anything
+    assert not store.finish(job_id, 'worker-1', {'fixed_code': 'stale'})
+    assert not store.renew(job_id, 'worker-1', 60)
+    assert store.finish(job_id, 'worker-2', {'fixed_code': 'b'})
+    job = store.get(job_id)
+    assert job['status'] == DONE
+    assert job['result'] == {'fixed_code': 'b'}
+
+
+def test_renewed_lease_is_not_taken(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    store.create('fix', {})
+    job_id = store.claim('worker-1', lease_ttl=0.1)[0]
+    time.sleep(0.05)
+    assert store.renew(job_id, 'worker-1', 60)
+    time.sleep(0.1)
+    assert store.claim('worker-2', lease_ttl=60) is None
+    assert store.get(job_id)['status'] == RUNNING
+
+
+def test_requeued_job_waits_and_keeps_its_attempt_count(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    job_id = store.create('fix', {})
+    store.claim('worker-1', lease_ttl=60)
+    assert store.requeue(job_id, 'worker-1', delay=0.1)
+    assert store.get(job_id)['status'] == QUEUED
+    assert store.claim('worker-1', lease_ttl=60) is None
+    time.sleep(0.15)
+    assert store.claim('worker-1', lease_ttl=60)[3] == 1
+
+
+def test_queue_runs_jobs_and_gives_up_after_max_attempts(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    queue = JobQueue(store, {'echo': lambda payload, report: payload}, workers=1, max_attempts=2, poll_interval=0.05)
+    # A job whose worker died twice is failed instead of run a third time
+    interrupted = store.create('echo', {'n': 1})
+    for _ in range(2):
+        store.claim('dead-worker', lease_ttl=0)
+        time.sleep(0.01)
+    queue.start()
+    job_id = queue.submit('echo', {'n': 2})
+    job = finished(queue, job_id)
+    assert job['status'] == DONE
+    assert job['result'] == {'n': 2}
+    job = finished(queue, interrupted)
+    assert job['status'] == FAILED
+    assert 'interrupted' in job['error']
+
+
+def test_handler_can_ask_for_a_retry(tmp_path):
+    calls = []
+
+    def flaky(payload, report):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise RetryLater(0.05)
+        report({'stage': 'done'})
+        return 'ok'
+
+    queue = JobQueue(JobStore(str(tmp_path / 'jobs.db')), {'flaky': flaky}, workers=1, poll_interval=0.02)
+    queue.start()
+    job = finished(queue, queue.submit('flaky', {}))
+    assert job['status'] == DONE
+    assert job['result'] == 'ok'
+    assert job['progress'] == {'stage': 'done'}
+    assert len(calls) == 2
@@ -0,0 +1,55 @@
+import time
+import threading
+
+import pytest
+
+from ratelimit import BATCH, INTERACTIVE, KeyPool, QueueFull, Scheduler
+
+
+def drained(requests_per_minute, **kwargs):
+    """A scheduler whose single key has just used up its burst"""
+    scheduler = Scheduler(requests_per_minute, **kwargs)
+    scheduler.keys.keys[0].bucket.drain(time.monotonic())
+    return scheduler
+
+
+def wait_for_queue(scheduler, length):
+    deadline = time.monotonic() + 5
+    while len(scheduler._queue) < length:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_interactive_calls_go_before_batch_calls_queued_earlier():
+    scheduler = drained(120)
+    order = []
+
+    def call(name, level):
+        scheduler.acquire(level)
+        order.append(name)
+
+    threads = []
+    for index, (name, level) in enumerate([('batch-1', BATCH), ('batch-2', BATCH), ('interactive', INTERACTIVE)]):
+        thread = threading.Thread(target=call, args=(name, level))
+        thread.start()
+        threads.append(thread)
+        wait_for_queue(scheduler, index + 1)
+    for thread in threads:
+        thread.join(10)
+    assert order == ['interactive', 'batch-1', 'batch-2']
+
+
+def test_call_that_would_miss_its_wait_gets_queue_full():
+    scheduler = drained(1, max_wait=0.5)
+    with pytest.raises(QueueFull) as raised:
+        scheduler.acquire(INTERACTIVE)
+    assert raised.value.position == 0
+    assert raised.value.eta > 0.5
+    assert scheduler._queue == []
+
+
+def test_calls_go_out_on_the_key_with_most_headroom():
+    keys = KeyPool(['key-a', 'key-b'], requests_per_minute=10)
+    scheduler = Scheduler(10, keys=keys)
+    chosen = [scheduler.acquire(INTERACTIVE).secret for _ in range(4)]
+    assert sorted(chosen) == ['key-a', 'key-a', 'key-b', 'key-b']